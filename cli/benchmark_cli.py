@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+
+import argparse
+
+from lib.benchmark import (
+    startup_benchmark_command,
+    pruning_benchmark_command,
+    search_benchmark_command,
+    DEFAULT_BENCHMARK_RUNS,
+    DEFAULT_PRUNING_LIMIT,
+    DEFAULT_PRUNING_QUERIES,
+    DEFAULT_PRUNING_QUERY_LENGTHS,
+    DEFAULT_SEARCH_BENCHMARK_LIMIT,
+    DEFAULT_SEARCH_BENCHMARK_QUERIES,
+    DEFAULT_SEARCH_BENCHMARK_SCALES,
+    DEFAULT_SEARCH_BENCHMARK_WARMUP,
+    SEARCH_BENCHMARK_PATHS,
+    SEARCH_BENCHMARK_REPORT_PATH,
+)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Search Benchmark CLI")
+    subparsers = parser.add_subparsers(dest="command", help="Available commands")
+
+    startup_parser = subparsers.add_parser("startup", help="Measure process startup time of every CLI subcommand")
+    startup_parser.add_argument("--runs", type=int, default=DEFAULT_BENCHMARK_RUNS, help="Runs per subcommand")
+
+    pruning_parser = subparsers.add_parser("bm25-pruning", help="Compare exhaustive and block-max pruned BM25 top-k queries")
+    pruning_parser.add_argument("--queries", type=int, default=DEFAULT_PRUNING_QUERIES, help="Queries per query length")
+    pruning_parser.add_argument("--lengths", type=int, nargs="+", default=DEFAULT_PRUNING_QUERY_LENGTHS, help="Query lengths in words")
+    pruning_parser.add_argument("--limit", type=int, default=DEFAULT_PRUNING_LIMIT, help="Results per query")
+
+    search_parser = subparsers.add_parser("search", help="Measure build, load, cold start, latency percentiles, QPS and peak RSS of every search path on the movie catalog and synthetic scaled copies, using an offline fake encoder")
+    search_parser.add_argument("--scales", type=int, nargs="+", default=DEFAULT_SEARCH_BENCHMARK_SCALES, help="Catalog sizes as multiples of movies.json")
+    search_parser.add_argument("--paths", type=str, nargs="+", choices=SEARCH_BENCHMARK_PATHS, default=SEARCH_BENCHMARK_PATHS, help="Search paths to measure")
+    search_parser.add_argument("--queries", type=int, default=DEFAULT_SEARCH_BENCHMARK_QUERIES, help="Timed queries per path")
+    search_parser.add_argument("--warmup", type=int, default=DEFAULT_SEARCH_BENCHMARK_WARMUP, help="Untimed queries after the first one")
+    search_parser.add_argument("--limit", type=int, default=DEFAULT_SEARCH_BENCHMARK_LIMIT, help="Results per query")
+    search_parser.add_argument("--mmap", action="store_true", help="Memory-map cached embeddings instead of reading them into memory")
+    search_parser.add_argument("--output", type=str, default=SEARCH_BENCHMARK_REPORT_PATH, help="Where to write the JSON report")
+
+    args = parser.parse_args()
+
+    match args.command:
+        case "startup":
+            startup_benchmark_command(args.runs)
+        case "bm25-pruning":
+            pruning_benchmark_command(args.queries, args.lengths, args.limit)
+        case "search":
+            search_benchmark_command(args.scales, args.paths, args.queries, args.warmup, args.limit, args.output, args.mmap)
+        case _:
+            parser.print_help()
+
+
+if __name__ == "__main__":
+    main()
@@ -4,44 +4,78 @@ from lib.hybrid_search import (
     normalize_scores_command,
     weighted_search_command,
     rrf_search_command,
-    enhance_query
+    batch_search_command,
 )
+from lib.query_enhancement import ENHANCEMENT_METHODS
 from lib.search_utils import (
     DEFAULT_HYBRID_SEARCH_ALPHA,
-    DEFAULT_HYBRID_SEARCH_LIMIT
+    DEFAULT_HYBRID_SEARCH_LIMIT,
+    DEFAULT_EMBEDDING_DTYPE,
+    DEFAULT_ANN_NPROBE,
+    DEFAULT_PQ_RERANK,
+    DEFAULT_ENHANCEMENT_TIMEOUT,
+    EMBEDDING_DTYPES,
+    HYBRID_CANDIDATE_MULTIPLIER,
+    HYBRID_SEARCH_THREADS
 )
+from lib.tracing import profiling, span
 
 def main() -> None:
     parser = argparse.ArgumentParser(description="Hybrid Search CLI")
+    parser.add_argument("--profile", action="store_true", help="Trace every search stage and print a per-stage timing summary to stderr")
+    parser.add_argument("--profile-output", type=str, metavar="PATH", help="Also append every traced span to PATH as JSONL (implies --profile)")
     subparsers = parser.add_subparsers(dest="command", help="Available commands")
 
+    embedding_parser = argparse.ArgumentParser(add_help=False)
+    embedding_parser.add_argument("--mmap", action="store_true", help="Memory-map cached embeddings instead of reading them into memory")
+    embedding_parser.add_argument("--embedding-dtype", type=str, choices=EMBEDDING_DTYPES, default=DEFAULT_EMBEDDING_DTYPE, help="Dtype embeddings are loaded and scored in; float16 uses a half-size copy of the float32 cache")
+    embedding_parser.add_argument("--ann", action="store_true", help="Use the approximate nearest-neighbour (IVF) index instead of exhaustive scoring")
+    embedding_parser.add_argument("--nprobe", type=int, default=DEFAULT_ANN_NPROBE, help="IVF lists to scan per query, higher is slower but more accurate")
+    embedding_parser.add_argument("--pq", action="store_true", help="Score product-quantized codes and re-rank the best candidates against the memory-mapped originals")
+    embedding_parser.add_argument("--rerank", type=int, default=DEFAULT_PQ_RERANK, help="Candidates re-ranked exactly when --pq is set")
+    embedding_parser.add_argument("--sharded", action="store_true", help="Run the BM25 side on the sharded keyword index, building it if missing")
+    embedding_parser.add_argument("--threads", type=int, default=HYBRID_SEARCH_THREADS, help="Threads running the BM25 and semantic legs of a query concurrently, 1 runs them one after the other")
+    embedding_parser.add_argument("--leg-timeout", type=float, help="Seconds to wait for each leg before fusing the other leg's results alone")
+    embedding_parser.add_argument("--depth", type=int, help=f"Candidates taken from each search before fusion (default: {HYBRID_CANDIDATE_MULTIPLIER} x limit)")
+
     normalize_parser = subparsers.add_parser("normalize", help="Normalize scores with min-max normalization")
     normalize_parser.add_argument("scores", type=float, nargs="+", help="List of scores to normalize")
 
-    weighted_search_parser = subparsers.add_parser("weighted-search", help="Hybrid search")
+    weighted_search_parser = subparsers.add_parser("weighted-search", help="Hybrid search", parents=[embedding_parser])
     weighted_search_parser.add_argument("query", type=str, help="Query to search")
     weighted_search_parser.add_argument("--alpha", type=float, default=DEFAULT_HYBRID_SEARCH_ALPHA, help="Configurable alpha")
     weighted_search_parser.add_argument("--limit", type=int, default=DEFAULT_HYBRID_SEARCH_LIMIT, help="Results limit")
+    weighted_search_parser.add_argument("--server", type=str, help="Forward the query to a running search server, e.g. http://127.0.0.1:8765")
 
-    rrf_search_parser = subparsers.add_parser("rrf-search", help="Reciprocal Rank Fusion")
+    rrf_search_parser = subparsers.add_parser("rrf-search", help="Reciprocal Rank Fusion", parents=[embedding_parser])
     rrf_search_parser.add_argument("query", type=str, help="Query to search")
     rrf_search_parser.add_argument("-k", type=int, default=60, help="k constant")
     rrf_search_parser.add_argument("--limit", type=int, default=5, help="Results limit")
-    rrf_search_parser.add_argument("--enhance", type=str, choices=["spell", "rewrite"], help="Query enhancement method")
+    rrf_search_parser.add_argument("--enhance", type=str, choices=ENHANCEMENT_METHODS, help="Query enhancement method")
+    rrf_search_parser.add_argument("--enhance-timeout", type=float, default=DEFAULT_ENHANCEMENT_TIMEOUT, help="Seconds to wait for the LLM before searching the original query")
+    rrf_search_parser.add_argument("--server", type=str, help="Forward the query to a running search server, e.g. http://127.0.0.1:8765")
+
+    batch_parser = subparsers.add_parser("batch", help="Search every query of a JSONL file (or stdin) and stream JSONL results", parents=[embedding_parser])
+    batch_parser.add_argument("input", type=str, nargs="?", default="-", help="JSONL file with one query string or {\"query\": ...} object per line, - for stdin")
+    batch_parser.add_argument("--method", type=str, choices=["bm25", "semantic", "weighted", "rrf"], default="rrf", help="Search to run for every query")
+    batch_parser.add_argument("--alpha", type=float, default=DEFAULT_HYBRID_SEARCH_ALPHA, help="Configurable alpha for weighted search")
+    batch_parser.add_argument("-k", type=int, default=60, help="k constant for RRF search")
+    batch_parser.add_argument("--limit", type=int, default=DEFAULT_HYBRID_SEARCH_LIMIT, help="Results limit per query")
 
     args = parser.parse_args()
 
-    match args.command:
-        case "normalize":
-            normalize_scores_command(args.scores)
-        case "weighted-search":
-            weighted_search_command(args.query, args.alpha, args.limit)
-        case "rrf-search":
-            if args.enhance:
-                args.query = enhance_query(args.enhance, args.query)
-            rrf_search_command(args.query, args.k, args.limit)
-        case _:
-            parser.print_help()
+    with profiling(args.profile, args.profile_output), span(args.command or "help"):
+        match args.command:
+            case "normalize":
+                normalize_scores_command(args.scores)
+            case "weighted-search":
+                weighted_search_command(args.query, args.alpha, args.limit, args.mmap, args.embedding_dtype, args.server, args.ann, args.nprobe, args.pq, args.rerank, args.sharded, args.depth, args.threads, args.leg_timeout)
+            case "rrf-search":
+                rrf_search_command(args.query, args.k, args.limit, args.mmap, args.embedding_dtype, args.server, args.ann, args.nprobe, args.pq, args.rerank, args.sharded, args.depth, args.enhance, args.enhance_timeout, args.threads, args.leg_timeout)
+            case "batch":
+                batch_search_command(args.input, args.method, args.alpha, args.k, args.limit, args.mmap, args.embedding_dtype, args.ann, args.nprobe, args.pq, args.rerank, args.sharded, args.depth, threads=args.threads, leg_timeout=args.leg_timeout)
+            case _:
+                parser.print_help()
 
 
 if __name__ == "__main__":
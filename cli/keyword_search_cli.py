@@ -4,17 +4,29 @@ import argparse
 
 from lib.keyword_search import KeywordSearch
 from lib.search_utils import print_search_results, DEFAULT_SEARCH_LIMIT, BM25_K1, BM25_B
-from lib.inverted_index import InvertedIndex
+from lib.inverted_index import InvertedIndex, convert_pickle_index_command, update_index_command
+from lib.sharded_index import build_sharded_index_command, sharded_bm25_search_command
+from lib.search_client import search_remote
+from lib.tracing import profiling, span
 
 
 def main() -> None:
     parser = argparse.ArgumentParser(description="Keyword Search CLI")
+    parser.add_argument("--profile", action="store_true", help="Trace every search stage and print a per-stage timing summary to stderr")
+    parser.add_argument("--profile-output", type=str, metavar="PATH", help="Also append every traced span to PATH as JSONL (implies --profile)")
     subparsers = parser.add_subparsers(dest="command", help="Available commands")
 
     search_parser = subparsers.add_parser("search", help="Search movies using BM25")
     search_parser.add_argument("query", type=str, help="Search query")
 
-    subparsers.add_parser("build", help="Build movies index")
+    build_parser = subparsers.add_parser("build", help="Build movies index")
+    build_parser.add_argument("--impacts", action="store_true", help="Also store quantized BM25 impact scores for the default k1/b so searches only accumulate them; scores, with or without --prune, are then within 2e-5 times the idf of each query term of the exact ones")
+    build_parser.add_argument("--shards", type=int, help="Build a sharded index with this many shards, built in parallel processes")
+    build_parser.add_argument("--workers", type=int, help="Processes used to build shards (default: one per shard)")
+
+    subparsers.add_parser("update", help="Apply added, changed and removed movies to the existing index")
+
+    subparsers.add_parser("convert", help="Convert a legacy pickled index to the binary index format")
 
     tf_parser = subparsers.add_parser("tf", help="Search term frequency")
     tf_parser.add_argument("doc_id", type=int, help="Doc id")
@@ -40,54 +52,71 @@ def main() -> None:
 
     bm25search_parser = subparsers.add_parser("bm25search", help="Search movies using full BM25 scoring")
     bm25search_parser.add_argument("query", type=str, help="Search query")
-    bm25_tf_parser.add_argument("limit", type=float, nargs='?', default=DEFAULT_SEARCH_LIMIT, help="Default search limit")
+    bm25search_parser.add_argument("limit", type=int, nargs='?', default=DEFAULT_SEARCH_LIMIT, help="Number of results to return")
+    bm25search_parser.add_argument("--prune", action="store_true", help="Skip postings that cannot reach the top results (block-max pruning), results are unchanged")
+    bm25search_parser.add_argument("--sharded", action="store_true", help="Search the sharded index, fanning the query out to every shard")
+    bm25search_parser.add_argument("--server", type=str, help="Forward the query to a running search server, e.g. http://127.0.0.1:8765")
 
     args = parser.parse_args()
 
-    index = InvertedIndex()
-    search = KeywordSearch(index)
-
-    match args.command:
-        case "search":
-            print("Searching for:", args.query)
-            try:
+    with profiling(args.profile, args.profile_output), span(args.command or "help"):
+        index = InvertedIndex()
+        search = KeywordSearch(index)
+
+        match args.command:
+            case "search":
+                print("Searching for:", args.query)
+                try:
+                    index.load()
+                except Exception as e:
+                    print(e)
+                    return
+                search_results = search.keyword_search(args.query, DEFAULT_SEARCH_LIMIT)
+                print_search_results(search_results)
+            case "build":
+                if args.shards:
+                    build_sharded_index_command(args.shards, args.workers, args.impacts)
+                else:
+                    index.build()
+                    index.store_impacts = args.impacts
+                    index.save()
+            case "update":
+                update_index_command()
+            case "convert":
+                convert_pickle_index_command()
+            case "tf":
+                index.load()
+                tf = index.get_tf(args.doc_id, args.term)
+                print(f"Term frequency of '{args.term}' in document '{args.doc_id}': {tf}")
+            case "idf":
+                index.load()
+                idf = index.get_idf(args.term)
+                print(f"Inverse document frequency of '{args.term}': {idf:.2f}")
+            case "tfidf":
                 index.load()
-            except Exception as e:
-                print(e)
-                return
-            search_results = search.keyword_search(args.query, DEFAULT_SEARCH_LIMIT)
-            print_search_results(search_results)
-        case "build":
-            index.build()
-            index.save()
-        case "tf":
-            index.load()
-            tf = index.get_tf(args.doc_id, args.term)
-            print(f"Term frequency of '{args.term}' in document '{args.doc_id}': {tf}")
-        case "idf":
-            index.load()
-            idf = index.get_idf(args.term)
-            print(f"Inverse document frequency of '{args.term}': {idf:.2f}")
-        case "tfidf":
-            index.load()
-            tf = index.get_tf(args.doc_id, args.term)
-            idf = index.get_idf(args.term)
-            tf_idf = tf * idf
-            print(f"TF-IDF score of '{args.term}' in document '{args.doc_id}': {tf_idf:.2f}")
-        case "bm25idf":
-            bm25idf = search.bm25_idf_command(args.term)
-            print(f"BM25 IDF score of '{args.term}': {bm25idf:.2f}")
-        case "bm25tf":
-            bm25tf = search.bm25_tf_command(args.doc_id, args.term, args.k1, args.b)
-            print(f"BM25 TF score of '{args.term}' in document '{args.doc_id}': {bm25tf:.2f}")
-        case "bm25search":
-            print("Searching for:", args.query)
-            search_results = search.bm25_search_command(args.query)
-            for i, res in enumerate(search_results, 1):
-                print(f"{i}. ({res['id']}) {res['title']} - Score: {res['score']:.2f}")
+                tf = index.get_tf(args.doc_id, args.term)
+                idf = index.get_idf(args.term)
+                tf_idf = tf * idf
+                print(f"TF-IDF score of '{args.term}' in document '{args.doc_id}': {tf_idf:.2f}")
+            case "bm25idf":
+                bm25idf = search.bm25_idf_command(args.term)
+                print(f"BM25 IDF score of '{args.term}': {bm25idf:.2f}")
+            case "bm25tf":
+                bm25tf = search.bm25_tf_command(args.doc_id, args.term, args.k1, args.b)
+                print(f"BM25 TF score of '{args.term}' in document '{args.doc_id}': {bm25tf:.2f}")
+            case "bm25search":
+                print("Searching for:", args.query)
+                if args.server:
+                    search_results = search_remote(args.server, "bm25search", query=args.query, limit=args.limit, prune=args.prune)
+                elif args.sharded:
+                    search_results = sharded_bm25_search_command(args.query, args.limit, prune=args.prune)
+                else:
+                    search_results = search.bm25_search_command(args.query, args.limit, prune=args.prune)
+                for i, res in enumerate(search_results, 1):
+                    print(f"{i}. ({res['id']}) {res['title']} - Score: {res['score']:.2f}")
                 
-        case _:
-            parser.print_help()
+            case _:
+                parser.print_help()
 
 
 if __name__ == "__main__":
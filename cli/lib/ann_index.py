@@ -0,0 +1,157 @@
+import os
+import time
+
+import numpy as np
+
+from .search_utils import (
+    file_stamp,
+    top_k_indices,
+    ANN_KMEANS_ITERATIONS,
+    ANN_KMEANS_SAMPLE_SIZE,
+    DEFAULT_ANN_NPROBE,
+    EMBEDDING_SCORE_BLOCK_SIZE,
+)
+
+IVF_FORMAT_VERSION = 1
+
+
+def default_n_lists(n_rows: int) -> int:
+    return max(1, int(round(np.sqrt(n_rows))))
+
+
+def assign_lists(embeddings: np.ndarray, centroids: np.ndarray, block_size=EMBEDDING_SCORE_BLOCK_SIZE) -> np.ndarray:
+    assignments = np.empty(len(embeddings), dtype=np.int32)
+    for start in range(0, len(embeddings), block_size):
+        block = np.asarray(embeddings[start:start + block_size], dtype=np.float32)
+        assignments[start:start + block_size] = np.argmax(block @ centroids.T, axis=1)
+    return assignments
+
+
+def spherical_kmeans(embeddings: np.ndarray, n_lists: int, iterations=ANN_KMEANS_ITERATIONS, seed=0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    data = np.asarray(embeddings, dtype=np.float32)
+    centroids = data[rng.choice(len(data), size=n_lists, replace=False)].copy()
+
+    for _ in range(iterations):
+        assignments = assign_lists(data, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, data)
+        counts = np.bincount(assignments, minlength=n_lists)
+
+        empty = np.flatnonzero(counts == 0)
+        sums[empty] = data[rng.choice(len(data), size=len(empty), replace=False)]
+
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        centroids = sums / norms
+
+    return centroids
+
+
+class IVFIndex:
+    def __init__(self, centroids: np.ndarray, list_offsets: np.ndarray, list_rows: np.ndarray) -> None:
+        self.centroids = centroids
+        self.list_offsets = list_offsets
+        self.list_rows = list_rows
+
+    @property
+    def n_lists(self) -> int:
+        return len(self.centroids)
+
+    @classmethod
+    def build(cls, embeddings: np.ndarray, n_lists=None, iterations=ANN_KMEANS_ITERATIONS, sample_size=ANN_KMEANS_SAMPLE_SIZE, seed=0) -> "IVFIndex":
+        if n_lists is None:
+            n_lists = default_n_lists(len(embeddings))
+        n_lists = max(1, min(n_lists, len(embeddings)))
+
+        rng = np.random.default_rng(seed)
+        sample = embeddings
+        if len(embeddings) > sample_size:
+            sample = embeddings[np.sort(rng.choice(len(embeddings), size=sample_size, replace=False))]
+        centroids = spherical_kmeans(sample, min(n_lists, len(sample)), iterations, seed)
+        n_lists = len(centroids)
+
+        assignments = assign_lists(embeddings, centroids)
+        list_rows = np.argsort(assignments, kind="stable").astype(np.int32)
+        list_offsets = np.zeros(n_lists + 1, dtype=np.int64)
+        np.cumsum(np.bincount(assignments, minlength=n_lists), out=list_offsets[1:])
+        return cls(centroids.astype(np.float32), list_offsets, list_rows)
+
+    def probe(self, query_embedding: np.ndarray, nprobe=DEFAULT_ANN_NPROBE) -> np.ndarray:
+        lists = top_k_indices(self.centroids @ query_embedding, min(nprobe, self.n_lists))
+        rows = [self.list_rows[self.list_offsets[i]:self.list_offsets[i + 1]] for i in lists]
+        return np.sort(np.concatenate(rows))
+
+    def save(self, path: str, source_stamp: tuple):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(
+                f,
+                version=IVF_FORMAT_VERSION,
+                source_stamp=np.array(source_stamp, dtype=np.int64),
+                centroids=self.centroids,
+                list_offsets=self.list_offsets,
+                list_rows=self.list_rows,
+            )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> tuple["IVFIndex", tuple]:
+        with np.load(path) as data:
+            if int(data["version"]) != IVF_FORMAT_VERSION:
+                raise ValueError(f"Unsupported ANN index version in {path}")
+            index = cls(data["centroids"], data["list_offsets"], data["list_rows"])
+            return index, tuple(data["source_stamp"].tolist())
+
+
+def load_or_build_ivf_index(index_path: str, embeddings_path: str, embeddings: np.ndarray, n_lists=None) -> IVFIndex:
+    source_stamp = file_stamp(embeddings_path)
+    if os.path.exists(index_path):
+        try:
+            index, stamp = IVFIndex.load(index_path)
+            if stamp == source_stamp and (n_lists is None or n_lists == index.n_lists):
+                return index
+        except ValueError:
+            pass
+
+    index = IVFIndex.build(embeddings, n_lists)
+    index.save(index_path, source_stamp)
+    return index
+
+
+def ann_recall_report(embeddings: np.ndarray, index: IVFIndex, k: int, nprobes: list[int], n_queries=200, seed=0) -> list[dict]:
+    rng = np.random.default_rng(seed)
+    # Queries are midpoints of random pairs of stored vectors, so they are
+    # realistic but not identical to any indexed row.
+    pairs = rng.choice(len(embeddings), size=(n_queries, 2))
+    queries = np.asarray(embeddings[pairs[:, 0]], dtype=np.float32) + np.asarray(embeddings[pairs[:, 1]], dtype=np.float32)
+    queries /= np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+
+    dense = np.asarray(embeddings, dtype=np.float32)
+    exact = []
+    start = time.perf_counter()
+    for query in queries:
+        scores = dense @ query
+        exact.append(set(top_k_indices(scores, k).tolist()))
+    exact_seconds = (time.perf_counter() - start) / n_queries
+
+    report = [{"nprobe": None, "recall": 1.0, "candidates": len(embeddings), "ms_per_query": exact_seconds * 1000}]
+    for nprobe in nprobes:
+        hits = 0
+        candidates = 0
+        start = time.perf_counter()
+        for query, truth in zip(queries, exact):
+            rows = index.probe(query, nprobe)
+            scores = dense[rows] @ query
+            found = rows[top_k_indices(scores, k)]
+            hits += len(truth.intersection(found.tolist()))
+            candidates += len(rows)
+        seconds = (time.perf_counter() - start) / n_queries
+        report.append({
+            "nprobe": nprobe,
+            "recall": hits / (n_queries * min(k, len(embeddings))),
+            "candidates": candidates / n_queries,
+            "ms_per_query": seconds * 1000,
+        })
+    return report
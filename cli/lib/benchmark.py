@@ -0,0 +1,413 @@
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import time
+import zlib
+
+import numpy as np
+
+from .catalog import Catalog, load_catalog
+from .inverted_index import InvertedIndex
+from .search_utils import load_movies, CACHE_DIR
+
+CLI_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DEFAULT_BENCHMARK_RUNS = 5
+DEFAULT_PRUNING_QUERIES = 100
+DEFAULT_PRUNING_QUERY_LENGTHS = [1, 2, 3, 5, 10, 20]
+DEFAULT_PRUNING_LIMIT = 10
+
+SEARCH_BENCHMARK_PATHS = ["bm25", "keyword", "semantic", "chunked", "weighted", "rrf"]
+DEFAULT_SEARCH_BENCHMARK_SCALES = [1, 10, 100]
+DEFAULT_SEARCH_BENCHMARK_QUERIES = 200
+DEFAULT_SEARCH_BENCHMARK_WARMUP = 10
+DEFAULT_SEARCH_BENCHMARK_LIMIT = 5
+DEFAULT_SEARCH_BENCHMARK_QUERY_WORDS = 3
+SEARCH_BENCHMARK_DIR = os.path.join(CACHE_DIR, "benchmark")
+SEARCH_BENCHMARK_REPORT_PATH = os.path.join(SEARCH_BENCHMARK_DIR, "report.json")
+FAKE_ENCODER_DIM = 384
+
+STARTUP_COMMANDS = [
+    ["keyword_search_cli.py", "search", "bear"],
+    ["keyword_search_cli.py", "tf", "1", "bear"],
+    ["keyword_search_cli.py", "idf", "bear"],
+    ["keyword_search_cli.py", "tfidf", "1", "bear"],
+    ["keyword_search_cli.py", "bm25idf", "bear"],
+    ["keyword_search_cli.py", "bm25tf", "1", "bear"],
+    ["keyword_search_cli.py", "bm25search", "bear"],
+    ["semantic_search_cli.py", "chunk", "A bear in London eats marmalade."],
+    ["semantic_search_cli.py", "semantic_chunk", "A bear in London. He eats marmalade."],
+    ["semantic_search_cli.py", "verify_embeddings"],
+    ["semantic_search_cli.py", "search", "bear in london"],
+    ["semantic_search_cli.py", "search_chunked", "bear in london"],
+    ["hybrid_search_cli.py", "normalize", "0.5", "2.3", "1.2"],
+    ["hybrid_search_cli.py", "weighted-search", "bear in london"],
+    ["hybrid_search_cli.py", "rrf-search", "bear in london"],
+]
+
+# Runs a CLI script in-process and reports on stderr whether torch was imported.
+STARTUP_RUNNER = """
+import runpy, sys
+sys.argv = sys.argv[1:]
+try:
+    runpy.run_path(sys.argv[0], run_name="__main__")
+finally:
+    sys.stderr.write(f"\\ntorch_loaded={int('torch' in sys.modules)}\\n")
+"""
+
+
+# Runs one search benchmark task in a fresh interpreter, so every task gets
+# its own cold start and peak RSS; progress output goes to stderr and the
+# result is printed as JSON.
+SEARCH_BENCHMARK_WORKER = """
+import contextlib, json, sys
+from lib.benchmark import run_search_benchmark_task
+task = json.loads(sys.argv[1])
+with contextlib.redirect_stdout(sys.stderr):
+    result = run_search_benchmark_task(task)
+print(json.dumps(result))
+"""
+
+
+def run_startup_command(command: list[str]) -> tuple[float, bool, bool]:
+    start = time.perf_counter()
+    process = subprocess.run(
+        [sys.executable, "-c", STARTUP_RUNNER, *command],
+        cwd=CLI_DIR,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        text=True,
+    )
+    elapsed = time.perf_counter() - start
+    return elapsed, "torch_loaded=1" in process.stderr, process.returncode == 0
+
+
+def startup_benchmark(commands=STARTUP_COMMANDS, runs=DEFAULT_BENCHMARK_RUNS) -> list[dict]:
+    results = []
+    for command in commands:
+        timings = []
+        torch_loaded = False
+        ok = True
+        for _ in range(runs):
+            elapsed, loaded, succeeded = run_startup_command(command)
+            timings.append(elapsed)
+            torch_loaded = torch_loaded or loaded
+            ok = ok and succeeded
+        results.append({
+            "command": " ".join(command[:2]),
+            "median_seconds": statistics.median(timings),
+            "min_seconds": min(timings),
+            "torch_loaded": torch_loaded,
+            "ok": ok,
+        })
+    return results
+
+
+def startup_benchmark_command(runs=DEFAULT_BENCHMARK_RUNS):
+    results = startup_benchmark(runs=runs)
+    print(f"{'command':<40} {'median':>9} {'min':>9}  torch  status")
+    for r in results:
+        status = "ok" if r["ok"] else "failed"
+        torch = "yes" if r["torch_loaded"] else "no"
+        print(f"{r['command']:<40} {r['median_seconds']:>8.3f}s {r['min_seconds']:>8.3f}s  {torch:<5}  {status}")
+
+
+def sample_queries(documents: list[dict], n_words: int, n_queries: int, seed=0) -> list[str]:
+    # Runs of consecutive description words, so longer queries look like the
+    # rewritten queries produced by query enhancement.
+    rng = random.Random(seed)
+    queries = []
+    for _ in range(n_queries):
+        words = rng.choice(documents)["description"].split()
+        start = rng.randrange(max(1, len(words) - n_words + 1))
+        queries.append(" ".join(words[start:start + n_words]))
+    return queries
+
+
+def pruning_benchmark(index: InvertedIndex, documents: list[dict], lengths=DEFAULT_PRUNING_QUERY_LENGTHS, n_queries=DEFAULT_PRUNING_QUERIES, limit=DEFAULT_PRUNING_LIMIT) -> list[dict]:
+    results = []
+    for n_words in lengths:
+        postings = scored = lookups = 0
+        exhaustive_seconds = pruned_seconds = 0.0
+        mismatches = 0
+        for query in sample_queries(documents, n_words, n_queries):
+            start = time.perf_counter()
+            exhaustive = index.bm25_top_k(query, limit)
+            exhaustive_seconds += time.perf_counter() - start
+
+            start = time.perf_counter()
+            pruned = index.bm25_top_k(query, limit, prune=True)
+            pruned_seconds += time.perf_counter() - start
+
+            if not (np.array_equal(exhaustive[0], pruned[0]) and np.array_equal(exhaustive[1], pruned[1])):
+                mismatches += 1
+            postings += pruned[2]["postings"]
+            scored += pruned[2]["postings_scored"]
+            lookups += pruned[2]["lookups"]
+
+        results.append({
+            "query_words": n_words,
+            "postings": postings / n_queries,
+            "skipped": 1 - scored / postings if postings else 0.0,
+            "lookups": lookups / n_queries,
+            "exhaustive_ms": exhaustive_seconds / n_queries * 1000,
+            "pruned_ms": pruned_seconds / n_queries * 1000,
+            "mismatches": mismatches,
+        })
+    return results
+
+
+def pruning_benchmark_command(n_queries=DEFAULT_PRUNING_QUERIES, lengths=DEFAULT_PRUNING_QUERY_LENGTHS, limit=DEFAULT_PRUNING_LIMIT):
+    index = InvertedIndex()
+    index.ensure_loaded()
+    results = pruning_benchmark(index, load_movies(), lengths, n_queries, limit)
+    print(f"BM25 top-{limit} over {index.num_docs} documents, {n_queries} queries per length")
+    print(f"{'words':>5} {'postings':>10} {'skipped':>8} {'lookups':>9} {'exhaustive':>11} {'pruned':>9}  identical")
+    for r in results:
+        identical = "yes" if r["mismatches"] == 0 else f"no ({r['mismatches']})"
+        print(f"{r['query_words']:>5} {r['postings']:>10.0f} {r['skipped']:>7.1%} {r['lookups']:>9.0f} {r['exhaustive_ms']:>9.3f}ms {r['pruned_ms']:>7.3f}ms  {identical}")
+
+
+class FakeEncoder:
+    # Deterministic offline stand-in for SentenceTransformer: a hashed bag
+    # of words, so texts sharing words still score as similar.
+    max_seq_length = 256
+
+    def __init__(self, dim=FAKE_ENCODER_DIM) -> None:
+        self.dim = dim
+        self.features: dict[str, tuple[int, float]] = {}
+
+    def __feature(self, word: str) -> tuple[int, float]:
+        feature = self.features.get(word)
+        if feature is None:
+            h = zlib.crc32(word.encode())
+            feature = self.features[word] = (h % self.dim, 1.0 + (h >> 16) % 7 / 7)
+        return feature
+
+    def encode(self, sentences, show_progress_bar=False, **kwargs) -> np.ndarray:
+        rows, columns, weights = [], [], []
+        for i, sentence in enumerate(sentences):
+            for word in sentence.lower().split():
+                column, weight = self.__feature(word)
+                rows.append(i)
+                columns.append(column)
+                weights.append(weight)
+        embeddings = np.zeros((len(sentences), self.dim), dtype=np.float32)
+        np.add.at(embeddings, (rows, columns), weights)
+        return embeddings
+
+
+def synthetic_catalog(documents: list[dict], scale: int, seed=0) -> list[dict]:
+    # The catalog repeated `scale` times; every copy gets fresh ids and
+    # shuffled descriptions, so vocabulary and lengths stay realistic while
+    # documents stay distinct.
+    rng = random.Random(seed)
+    id_stride = max((doc["id"] for doc in documents), default=0) + 1
+    catalog = list(documents)
+    for copy in range(1, scale):
+        for doc in documents:
+            words = doc["description"].split()
+            rng.shuffle(words)
+            catalog.append({**doc, "id": doc["id"] + copy * id_stride, "description": " ".join(words)})
+    return catalog
+
+
+def peak_rss_mb() -> float:
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes.
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def open_search_path(path: str, documents: "list[dict] | Catalog", mmap=False):
+    # Loads everything the search path needs and returns query -> results.
+    from .hybrid_search import HybridSearch
+    from .keyword_search import KeywordSearch
+    from .semantic_search import ChunkedSemanticSearch, SemanticSearch
+
+    match path:
+        case "bm25":
+            index = InvertedIndex()
+            index.load()
+            return lambda query, limit: index.bm25_search(query, limit)
+        case "keyword":
+            index = InvertedIndex()
+            index.load()
+            search = KeywordSearch(index)
+            return search.keyword_search
+        case "semantic":
+            search = SemanticSearch(mmap=mmap, cache_queries=False, model=FakeEncoder())
+            search.load_or_create_embeddings(documents)
+            return search.search
+        case "chunked":
+            search = ChunkedSemanticSearch(mmap=mmap, cache_queries=False, model=FakeEncoder())
+            search.load_or_create_chunk_embeddings(documents)
+            return search.search_chunks
+        case "weighted":
+            search = HybridSearch(documents, mmap, model=FakeEncoder())
+            search.semantic_search.query_cache = None
+            return lambda query, limit: search.weighted_search(query, 0.5, limit)
+        case "rrf":
+            search = HybridSearch(documents, mmap, model=FakeEncoder())
+            search.semantic_search.query_cache = None
+            return lambda query, limit: search.rrf_search(query, 60, limit)
+        case _:
+            raise ValueError(f"Unknown search path {path}")
+
+
+def build_search_indexes(paths: list[str], mmap=False) -> dict:
+    from .semantic_search import ChunkedSemanticSearch
+
+    start = time.perf_counter()
+    documents = load_movies()
+    result = {"parse_seconds": time.perf_counter() - start}
+
+    if {"bm25", "keyword", "weighted", "rrf"} & set(paths):
+        start = time.perf_counter()
+        index = InvertedIndex()
+        index.build(documents)
+        index.save()
+        result["index_seconds"] = time.perf_counter() - start
+
+    search = ChunkedSemanticSearch(mmap=mmap, cache_queries=False, model=FakeEncoder())
+    if {"semantic", "weighted", "rrf"} & set(paths):
+        start = time.perf_counter()
+        search.build_embeddings(documents)
+        result["embeddings_seconds"] = time.perf_counter() - start
+    if {"chunked", "weighted", "rrf"} & set(paths):
+        start = time.perf_counter()
+        search.build_chunk_embeddings(documents)
+        result["chunk_embeddings_seconds"] = time.perf_counter() - start
+
+    result["peak_rss_mb"] = peak_rss_mb()
+    return result
+
+
+def time_search_path(path: str, queries: list[str], warmup: int, limit: int, spawned_at: float, mmap=False) -> dict:
+    start = time.perf_counter()
+    search = open_search_path(path, load_catalog(), mmap)
+    load_seconds = time.perf_counter() - start
+
+    # Cold start runs from process spawn to the first answered query.
+    search(queries[0], limit)
+    cold_start_seconds = time.time() - spawned_at
+
+    for query in queries[1:1 + warmup]:
+        search(query, limit)
+    latencies = []
+    for query in queries[1 + warmup:]:
+        start = time.perf_counter()
+        search(query, limit)
+        latencies.append(time.perf_counter() - start)
+
+    latencies_ms = np.array(latencies) * 1000
+    p50, p95, p99 = np.percentile(latencies_ms, [50, 95, 99]) if len(latencies) else (0.0, 0.0, 0.0)
+    return {
+        "path": path,
+        "load_seconds": load_seconds,
+        "cold_start_seconds": cold_start_seconds,
+        "queries": len(latencies),
+        "p50_ms": float(p50),
+        "p95_ms": float(p95),
+        "p99_ms": float(p99),
+        "qps": len(latencies) / sum(latencies) if latencies else 0.0,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def run_search_benchmark_task(task: dict) -> dict:
+    match task["kind"]:
+        case "build":
+            return build_search_indexes(task["paths"], task["mmap"])
+        case "query":
+            return time_search_path(task["path"], task["queries"], task["warmup"], task["limit"], task["spawned_at"], task["mmap"])
+        case _:
+            raise ValueError(f"Unknown benchmark task {task['kind']}")
+
+
+def run_search_benchmark_worker(task: dict, env: dict) -> dict:
+    task = {**task, "spawned_at": time.time()}
+    process = subprocess.run(
+        [sys.executable, "-c", SEARCH_BENCHMARK_WORKER, json.dumps(task)],
+        cwd=CLI_DIR,
+        env=env,
+        capture_output=True,
+        text=True,
+    )
+    if process.returncode != 0:
+        lines = process.stderr.strip().splitlines()
+        return {"error": lines[-1] if lines else f"exit status {process.returncode}"}
+    return json.loads(process.stdout.strip().splitlines()[-1])
+
+
+def search_benchmark(scales=DEFAULT_SEARCH_BENCHMARK_SCALES, paths=SEARCH_BENCHMARK_PATHS, n_queries=DEFAULT_SEARCH_BENCHMARK_QUERIES, warmup=DEFAULT_SEARCH_BENCHMARK_WARMUP, limit=DEFAULT_SEARCH_BENCHMARK_LIMIT, workdir=SEARCH_BENCHMARK_DIR, mmap=False, seed=0) -> dict:
+    base = load_movies()
+    report = {
+        "environment": {
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+        },
+        "settings": {
+            "queries": n_queries,
+            "warmup": warmup,
+            "limit": limit,
+            "query_words": DEFAULT_SEARCH_BENCHMARK_QUERY_WORDS,
+            "mmap": mmap,
+            "seed": seed,
+            "encoder": f"FakeEncoder({FAKE_ENCODER_DIM})",
+        },
+        "catalogs": [],
+    }
+
+    for scale in scales:
+        # Each catalog gets its own data file and an empty cache, which the
+        # workers are pointed at through SEARCH_DATA_PATH/SEARCH_CACHE_DIR.
+        catalog_dir = os.path.join(workdir, f"scale_{scale}")
+        cache_dir = os.path.join(catalog_dir, "cache")
+        data_path = os.path.join(catalog_dir, "movies.json")
+        shutil.rmtree(catalog_dir, ignore_errors=True)
+        os.makedirs(cache_dir)
+
+        documents = synthetic_catalog(base, scale, seed)
+        with open(data_path, "w") as f:
+            json.dump({"movies": documents}, f)
+        queries = sample_queries(documents, DEFAULT_SEARCH_BENCHMARK_QUERY_WORDS, n_queries + warmup + 1, seed)
+        env = {**os.environ, "SEARCH_DATA_PATH": data_path, "SEARCH_CACHE_DIR": cache_dir}
+
+        build = run_search_benchmark_worker({"kind": "build", "paths": list(paths), "mmap": mmap}, env)
+        results = []
+        for path in paths:
+            result = run_search_benchmark_worker({"kind": "query", "path": path, "queries": queries, "warmup": warmup, "limit": limit, "mmap": mmap}, env)
+            results.append({"path": path, **result})
+        report["catalogs"].append({"scale": scale, "documents": len(documents), "build": build, "paths": results})
+    return report
+
+
+def search_benchmark_command(scales=DEFAULT_SEARCH_BENCHMARK_SCALES, paths=SEARCH_BENCHMARK_PATHS, n_queries=DEFAULT_SEARCH_BENCHMARK_QUERIES, warmup=DEFAULT_SEARCH_BENCHMARK_WARMUP, limit=DEFAULT_SEARCH_BENCHMARK_LIMIT, output=SEARCH_BENCHMARK_REPORT_PATH, mmap=False):
+    report = search_benchmark(scales, paths, n_queries, warmup, limit, mmap=mmap)
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    for catalog in report["catalogs"]:
+        build = catalog["build"]
+        print(f"\n{catalog['documents']} documents ({catalog['scale']}x)")
+        if "error" in build:
+            print(f"  build failed: {build['error']}")
+        else:
+            steps = ", ".join(f"{key[:-len('_seconds')]} {value:.2f}s" for key, value in build.items() if key.endswith("_seconds"))
+            print(f"  build: {steps}, peak RSS {build['peak_rss_mb']:.0f} MB")
+        print(f"  {'path':<9} {'load':>8} {'cold':>8} {'p50':>9} {'p95':>9} {'p99':>9} {'qps':>8} {'rss':>8}")
+        for r in catalog["paths"]:
+            if "error" in r:
+                print(f"  {r['path']:<9} failed: {r['error']}")
+                continue
+            print(f"  {r['path']:<9} {r['load_seconds']:>7.2f}s {r['cold_start_seconds']:>7.2f}s {r['p50_ms']:>7.2f}ms {r['p95_ms']:>7.2f}ms {r['p99_ms']:>7.2f}ms {r['qps']:>8.1f} {r['peak_rss_mb']:>5.0f} MB")
+    print(f"\nReport written to {output}")
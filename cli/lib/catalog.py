@@ -0,0 +1,181 @@
+import hashlib
+import json
+import os
+from functools import cached_property
+
+import numpy as np
+
+from .search_utils import CACHE_MANIFEST_PATH, DATA_PATH, file_stamp, load_movies
+from .tracing import span
+
+CATALOG_STATE_DTYPE = np.dtype([("id", "<i8"), ("hash", "<u8")])
+CACHE_MANIFEST_VERSION = 1
+
+
+def document_hash(doc: dict) -> int:
+    data = json.dumps(doc, sort_keys=True, separators=(",", ":")).encode()
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), "little")
+
+
+def catalog_state(documents: list[dict]) -> np.ndarray:
+    state = np.empty(len(documents), dtype=CATALOG_STATE_DTYPE)
+    state["id"] = [doc["id"] for doc in documents]
+    state["hash"] = [document_hash(doc) for doc in documents]
+    return state
+
+
+def catalog_fingerprint(state: np.ndarray) -> str:
+    return hashlib.blake2b(np.ascontiguousarray(state).tobytes(), digest_size=16).hexdigest()
+
+
+def save_catalog_state(path: str, state: np.ndarray):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        np.save(f, state)
+    os.replace(tmp_path, path)
+
+
+def load_catalog_state(path: str) -> np.ndarray | None:
+    if not os.path.exists(path):
+        return None
+    return np.load(path)
+
+
+class CatalogDiff:
+    def __init__(self, old_state: np.ndarray, new_state: np.ndarray) -> None:
+        old_positions = {doc_id: i for i, doc_id in enumerate(old_state["id"].tolist())}
+        new_ids = new_state["id"].tolist()
+        new_positions = set(new_ids)
+
+        # For every new document, the position of an identical cached
+        # document, or -1 if it has to be (re)processed.
+        self.reused = np.full(len(new_state), -1, dtype=np.int64)
+        self.added = []
+        self.changed = []
+        for i, doc_id in enumerate(new_ids):
+            old_i = old_positions.get(doc_id)
+            if old_i is None:
+                self.added.append(i)
+            elif old_state["hash"][old_i] != new_state["hash"][i]:
+                self.changed.append((old_i, i))
+            else:
+                self.reused[i] = old_i
+
+        self.removed = [i for doc_id, i in old_positions.items() if doc_id not in new_positions]
+
+    @property
+    def unchanged(self) -> bool:
+        return not self.added and not self.changed and not self.removed
+
+    @property
+    def reordered(self) -> bool:
+        return not np.array_equal(self.reused, np.arange(len(self.reused)))
+
+    def summary(self) -> str:
+        return f"{len(self.added)} added, {len(self.changed)} changed, {len(self.removed)} removed"
+
+
+class Catalog:
+    # The parsed catalog, shared by every subsystem that needs it. Its state
+    # hashes every document, so it is only computed when something asks for
+    # it, and then once. `stamp` is the file_stamp of movies.json it was read
+    # at, or None for documents that did not come from the file.
+    def __init__(self, documents: list[dict], stamp: tuple | None = None) -> None:
+        self.documents = documents
+        self.stamp = stamp
+
+    def __len__(self) -> int:
+        return len(self.documents)
+
+    @cached_property
+    def state(self) -> np.ndarray:
+        return catalog_state(self.documents)
+
+    @cached_property
+    def fingerprint(self) -> str:
+        return catalog_fingerprint(self.state)
+
+    @cached_property
+    def document_map(self) -> dict:
+        return {doc["id"]: doc for doc in self.documents}
+
+
+_catalog: Catalog | None = None
+
+
+def load_catalog() -> Catalog:
+    # movies.json is parsed once per process; every caller gets the same
+    # Catalog until the file changes.
+    global _catalog
+    stamp = file_stamp(DATA_PATH)
+    if _catalog is None or _catalog.stamp != stamp:
+        with span("catalog.load"):
+            _catalog = Catalog(load_movies(), stamp)
+    return _catalog
+
+
+def as_catalog(documents: "list[dict] | Catalog") -> Catalog:
+    return documents if isinstance(documents, Catalog) else Catalog(documents)
+
+
+def stamp_record(stamp: tuple | None) -> list | None:
+    return None if stamp is None else list(stamp)
+
+
+class CacheManifest:
+    # What each derived cache was last validated against: the catalog
+    # fingerprint and the movies.json stamp it had, the model that produced
+    # the cache (None for the BM25 indexes), and the stamps of its files.
+    # While those still match, the cache is used as is, without hashing the
+    # catalog, diffing states or re-checking the files.
+    def __init__(self, path=CACHE_MANIFEST_PATH) -> None:
+        self.path = path
+
+    def read(self) -> dict:
+        try:
+            with open(self.path) as f:
+                manifest = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+        if manifest.get("version") != CACHE_MANIFEST_VERSION:
+            return {}
+        return manifest["caches"]
+
+    def write(self, caches: dict):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"version": CACHE_MANIFEST_VERSION, "caches": caches}, f)
+        os.replace(tmp_path, self.path)
+
+    def matches(self, name: str, catalog: Catalog, model: str | None, paths: list[str]) -> bool:
+        caches = self.read()
+        entry = caches.get(name)
+        if entry is None or entry["model"] != model:
+            return False
+        for path in paths:
+            stamp = stamp_record(file_stamp(path))
+            if stamp is None or entry["files"].get(os.path.basename(path)) != stamp:
+                return False
+
+        if catalog.stamp is not None and entry["catalog_stamp"] == stamp_record(catalog.stamp):
+            return True
+        if entry["catalog"] != catalog.fingerprint:
+            return False
+        # Same documents under a new stamp (the file was rewritten or
+        # copied): restamp, so the next check can skip hashing again.
+        if catalog.stamp is not None:
+            entry["catalog_stamp"] = stamp_record(catalog.stamp)
+            self.write(caches)
+        return True
+
+    def record(self, name: str, catalog: Catalog, model: str | None, paths: list[str]):
+        caches = self.read()
+        caches[name] = {
+            "catalog": catalog.fingerprint,
+            "catalog_stamp": stamp_record(catalog.stamp),
+            "model": model,
+            "files": {os.path.basename(path): stamp_record(file_stamp(path)) for path in paths},
+        }
+        self.write(caches)
@@ -1,160 +1,325 @@
+import asyncio
+import contextvars
 import os
+import sys
 import json
+import threading
+import time
+from collections import Counter
+from collections.abc import Awaitable
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from itertools import batched
 
-from dotenv import load_dotenv
-from google import genai
+import numpy as np
 
+from .catalog import CacheManifest, Catalog, as_catalog, load_catalog
 from .keyword_search import InvertedIndex
+from .sharded_index import ShardedIndex
 from .semantic_search import ChunkedSemanticSearch
-from .search_utils import DATA_PATH
-
-load_dotenv()
-api_key = os.environ.get("GEMINI_API_KEY")
+from .search_client import search_remote
+from .query_enhancement import ENHANCEMENT_METHODS, QueryEnhancer
+from .tracing import span
+from .search_utils import (
+    DEFAULT_ANN_NPROBE,
+    DEFAULT_EMBEDDING_DTYPE,
+    DEFAULT_PQ_RERANK,
+    BATCH_QUERY_BLOCK_SIZE,
+    DEFAULT_ENHANCEMENT_TIMEOUT,
+    HYBRID_CANDIDATE_MULTIPLIER,
+    HYBRID_SEARCH_THREADS,
+    to_json,
+    top_k_indices,
+)
 
 
 class HybridSearch:
-    def __init__(self, documents):
-        self.documents = documents
-        self.semantic_search = ChunkedSemanticSearch()
-        self.semantic_search.load_or_create_embeddings(documents)
-        self.semantic_search.load_or_create_chunk_embeddings(documents)
-
-        self.idx = InvertedIndex()
-        if not os.path.exists(self.idx.index_path):
-            self.idx.build()
+    def __init__(self, documents, mmap=False, embedding_dtype=DEFAULT_EMBEDDING_DTYPE, ann=False, nprobe=DEFAULT_ANN_NPROBE, quantized=False, rerank=DEFAULT_PQ_RERANK, sharded=False, model=None, threads=HYBRID_SEARCH_THREADS, leg_timeout=None):
+        with span("hybrid.load", sharded=sharded):
+            # One catalog serves the semantic caches' validation and the
+            # index build, so it is parsed and hashed at most once.
+            catalog = as_catalog(documents)
+            self.documents = documents = catalog.documents
+            # The BM25 and semantic legs of a query run concurrently on
+            # `threads` threads (1 runs them one after the other); a leg
+            # still running `leg_timeout` seconds in is left out of fusion.
+            self.threads = threads
+            self.leg_timeout = leg_timeout
+            self.leg_timeouts = Counter()
+            # Created up front: threaded servers share this object, and a
+            # lazily created pool could be created twice by concurrent
+            # first queries.
+            self.pool = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="hybrid-leg") if threads > 1 else None
+            self.index_lock = threading.Lock()
+            doc_ids = np.array([doc['id'] for doc in documents], dtype=np.int64)
+            self.id_order = np.argsort(doc_ids, kind="stable")
+            self.sorted_ids = doc_ids[self.id_order]
+            self.semantic_search = ChunkedSemanticSearch(mmap=mmap, embedding_dtype=embedding_dtype, ann=ann, nprobe=nprobe, quantized=quantized, rerank=rerank, model=model)
+            self.semantic_search.load_or_create_embeddings(catalog)
+            self.semantic_search.load_or_create_chunk_embeddings(catalog)
+
+            self.idx = ShardedIndex() if sharded else InvertedIndex()
+            index_name, index_paths = ("sharded_index", [self.idx.manifest_path]) if sharded else ("index", [self.idx.index_path])
+            manifest = CacheManifest()
+            if not manifest.matches(index_name, catalog, None, index_paths):
+                self.__sync_index(catalog)
+                manifest.record(index_name, catalog, None, index_paths)
+
+    def __sync_index(self, catalog: Catalog):
+        # Builds a missing index and brings one built from another catalog
+        # up to date, so the BM25 leg searches the same documents as the
+        # semantic leg.
+        if isinstance(self.idx, ShardedIndex):
+            if os.path.exists(self.idx.manifest_path):
+                self.idx.load()
+                if self.idx.is_current(catalog):
+                    return
+                self.idx.build(catalog.documents, self.idx.n_shards, store_impacts=self.idx.store_impacts)
+            else:
+                self.idx.build(catalog.documents)
+            self.idx.load()
+        elif os.path.exists(self.idx.index_path):
+            self.idx.load()
+            if not self.idx.update(catalog).unchanged:
+                self.idx.save()
+        else:
+            self.idx.build(catalog.documents)
             self.idx.save()
 
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+            self.pool = None
+        with self.index_lock:
+            if isinstance(self.idx, ShardedIndex):
+                self.idx.close()
+
+    def _run_legs(self, keyword_leg, semantic_leg, empty):
+        # Returns both legs' results; a timed-out leg yields `empty`, so the
+        # query degrades to the other leg alone. A timed-out leg keeps its
+        # thread until it finishes, as threads cannot be interrupted.
+        pool = self.pool
+        if pool is None:
+            # Single-threaded, or closed.
+            return keyword_leg(), semantic_leg()
+
+        # Each leg runs in a copy of the caller's context so its trace
+        # spans nest under the caller's.
+        legs = {
+            "bm25": pool.submit(contextvars.copy_context().run, keyword_leg),
+            "semantic": pool.submit(contextvars.copy_context().run, semantic_leg),
+        }
+        deadline = None if self.leg_timeout is None else time.monotonic() + self.leg_timeout
+        results = {}
+        with span("hybrid.wait_legs") as trace:
+            for leg, future in legs.items():
+                try:
+                    results[leg] = future.result(None if deadline is None else max(0.0, deadline - time.monotonic()))
+                except FutureTimeoutError:
+                    self.leg_timeouts[leg] += 1
+                    trace.set(timed_out=leg)
+                    results[leg] = None
+
+        if results["bm25"] is None and results["semantic"] is None:
+            raise TimeoutError(f"Both search legs timed out after {self.leg_timeout}s")
+        return tuple(empty if result is None else result for result in results.values())
+
+    def _retrieve(self, query, depth) -> tuple[tuple[np.ndarray, np.ndarray], tuple[np.ndarray, np.ndarray]]:
+        return self._run_legs(
+            lambda: self._bm25_top_k(query, depth),
+            lambda: self.semantic_search.search_top_k(query, depth),
+            (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)),
+        )
+
+    def _retrieve_batch(self, queries, depth) -> tuple[list, list]:
+        return self._run_legs(
+            lambda: self._bm25_top_k_batch(queries, depth),
+            lambda: self.semantic_search.batch_search_top_k(queries, depth),
+            [(np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64))] * len(queries),
+        )
+
+    def current_index(self) -> InvertedIndex | ShardedIndex:
+        # A changed index is loaded into a new object and swapped in, so
+        # queries still scoring on the old one keep consistent arrays.
+        with self.index_lock:
+            self.idx = self.idx.reloaded()
+            return self.idx
+
     def _bm25_search(self, query, limit):
-        self.idx.load()
-        return self.idx.bm25_search(query, limit)
-
-    def weighted_search(self, query, alpha, limit=5):
-        keyword_results = self._bm25_search(query, limit * 500)
-        semantic_results = self.semantic_search.search(query, limit * 500)
-        semantic_results = [{'id': r['id'], 'title': r['title'], 'description': r['description'][:100], 'score': s} for s, r in semantic_results]
-
-        # combined_scores = []
-        # combined_scores.extend([r['score'] for r in keyword_results])
-        # combined_scores.extend([r['score'] for r in semantic_results])
-        
-        # normalized_scores = normalize_scores(combined_scores)
-        
-        keyword_scores = normalize_scores([r['score'] for r in keyword_results])
-        semantic_scores = normalize_scores([r['score'] for r in semantic_results])
-
-
-        weighted_results = {}
-        for i, r in enumerate(keyword_results):
-            id = r['id']
-            score = keyword_scores[i]
-            if id not in weighted_results:
-                weighted_results[id] = {
-                    'title': r['title'],
-                    'description': r['description'],
-                    'hybrid_score': 0.0,
-                    'bm25_score': 0.0,
-                    'semantic_score': 0.0
-                }
-            if score > weighted_results[id]['bm25_score']:
-                weighted_results[id]['bm25_score'] = score
-        
-        for i, r in enumerate(semantic_results):
-            id = r['id']
-            score = semantic_scores[i]
-            if id not in weighted_results:
-                weighted_results[id] = {
-                    'title': r['title'],
-                    'description': r['description'],
-                    'hybrid_score': 0.0,
-                    'bm25_score': 0.0,
-                    'semantic_score': 0.0
-                }
-            if score > weighted_results[id]['semantic_score']:
-                weighted_results[id]['semantic_score'] = score
-        
-        hybrid_results = []
-        for k, v in weighted_results.items():
-            hybrid_results.append({
-                'id': k,
-                'title': v['title'],
-                'description': v['description'],
-                'hybrid_score': hybrid_score(v['bm25_score'], v['semantic_score'], alpha),
-                'bm25_score': v['bm25_score'],
-                'semantic_score': v['semantic_score']
-            })
-            # weighted_results[k]['hybrid_score'] = hybrid_score(v['bm25_score'], v['semantic_score'], alpha)
-        
-        combined_results = sorted(hybrid_results, key=lambda x: x["hybrid_score"], reverse=True)
-        return combined_results[:limit]
-
-    def rrf_search(self, query, k, limit=10):
-        keyword_results = self._bm25_search(query, limit * 500)
-        # semantic_results = self.semantic_search.search_chunks(query, limit * 500)
-        semantic_results = self.semantic_search.search(query, limit * 500)
-        semantic_results = [{'id': r['id'], 'title': r['title'], 'description': r['description'][:100], 'score': s} for s, r in semantic_results]
-
-        ranked_results = {}
-        for rank, r in enumerate(keyword_results, start=1):
-            id = r['id']
-            s = rrf_score(rank, k)
-            if id not in ranked_results:
-                ranked_results[id] = {'title': r['title'], 'description': r['description'], 'bm25_rank': rank, 'rrf_score': s}
-            
-        for rank, r in enumerate(semantic_results, start=1):
-            id = r['id']
-            s = rrf_score(rank, k)
-            if id not in ranked_results:
-                ranked_results[id] = {'title': r['title'], 'description': r['description'], 'semantic_rank': rank, 'rrf_score': s}
+        with span("hybrid.bm25", limit=limit):
+            return self.current_index().bm25_search(query, limit)
+
+    def _bm25_search_batch(self, queries, limit):
+        with span("hybrid.bm25_batch", queries=len(queries), limit=limit):
+            return self.current_index().bm25_search_batch(queries, limit)
+
+    def _catalog_positions(self, doc_ids: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        # Positions in self.documents of the given ids, and which ids were
+        # found; ids the catalog no longer has are dropped.
+        i = np.searchsorted(self.sorted_ids, doc_ids)
+        found = i < len(self.sorted_ids)
+        found[found] = self.sorted_ids[i[found]] == doc_ids[found]
+        return self.id_order[i[found]], found
+
+    def _bm25_top_k(self, query, depth) -> tuple[np.ndarray, np.ndarray]:
+        with span("hybrid.bm25", depth=depth):
+            idx = self.current_index()
+            best, scores, _ = idx.bm25_top_k(query, depth)
+            positions, found = self._catalog_positions(idx.doc_ids[best])
+            return pad_keyword_leg(positions, scores[found], len(self.documents), depth)
+
+    def _bm25_top_k_batch(self, queries, depth) -> list[tuple[np.ndarray, np.ndarray]]:
+        with span("hybrid.bm25_batch", queries=len(queries), depth=depth):
+            idx = self.current_index()
+            results = []
+            for best, scores, _ in idx.bm25_top_k_batch(queries, depth):
+                positions, found = self._catalog_positions(idx.doc_ids[best])
+                results.append(pad_keyword_leg(positions, scores[found], len(self.documents), depth))
+            return results
+
+    def weighted_search(self, query, alpha, limit=5, depth=None):
+        depth = limit * HYBRID_CANDIDATE_MULTIPLIER if depth is None else depth
+        with span("hybrid.weighted_search", limit=limit, depth=depth):
+            keyword, semantic = self._retrieve(query, depth)
+            return self.__weighted_results(keyword, semantic, alpha, limit)
+
+    def batch_weighted_search(self, queries, alpha, limit=5, depth=None):
+        depth = limit * HYBRID_CANDIDATE_MULTIPLIER if depth is None else depth
+        with span("hybrid.batch_weighted_search", queries=len(queries), limit=limit, depth=depth):
+            keyword, semantic = self._retrieve_batch(queries, depth)
+            return [self.__weighted_results(kw, sem, alpha, limit) for kw, sem in zip(keyword, semantic)]
+
+    def __weighted_results(self, keyword, semantic, alpha, limit):
+        with span("hybrid.fusion", method="weighted"):
+            best, hybrid_scores, bm25_scores, semantic_scores = weighted_fusion(*keyword, *semantic, len(self.documents), alpha, limit)
+            results = []
+            for i, hybrid, bm25, sem in zip(best.tolist(), hybrid_scores.tolist(), bm25_scores.tolist(), semantic_scores.tolist()):
+                doc = self.documents[i]
+                results.append({
+                    'id': doc['id'],
+                    'title': doc['title'],
+                    'description': doc['description'][:100],
+                    'hybrid_score': hybrid,
+                    'bm25_score': bm25,
+                    'semantic_score': sem
+                })
+            return results
+
+    def rrf_search(self, query, k, limit=10, depth=None):
+        depth = limit * HYBRID_CANDIDATE_MULTIPLIER if depth is None else depth
+        with span("hybrid.rrf_search", limit=limit, depth=depth):
+            (keyword_positions, _), (semantic_positions, _) = self._retrieve(query, depth)
+            return self.__rrf_results(keyword_positions, semantic_positions, k, limit)
+
+    async def enhanced_rrf_search(self, query, enhancement: Awaitable[str], k, limit=10, depth=None) -> tuple[str, list[dict]]:
+        # BM25 for the raw query runs while the LLM enhancement is pending
+        # and is reused whenever the enhancement falls back to, or returns,
+        # the raw query. Returns the query that was searched and the results.
+        depth = limit * HYBRID_CANDIDATE_MULTIPLIER if depth is None else depth
+        with span("hybrid.enhanced_rrf_search", limit=limit, depth=depth):
+            keyword_positions, _ = await asyncio.to_thread(self._bm25_top_k, query, depth)
+            enhanced_query = await enhancement
+            if enhanced_query == query:
+                semantic_positions, _ = await asyncio.to_thread(self.semantic_search.search_top_k, query, depth)
             else:
-                ranked_results[id]['semantic_rank'] = rank
-                ranked_results[id]['rrf_score'] = ranked_results[id]['rrf_score'] + rrf_score(rank, k)
-
-        combined_results = []
-        for k, v, in ranked_results.items():
-            combined_results.append({
-                'id': k,
-                'title': v['title'],
-                'description': v['description'],
-                'bm25_rank': v.get  ('bm25_rank'),
-                'semantic_rank': v.get('semantic_rank'),
-                'rrf_score': v['rrf_score']
-            })
-        
-        sorted_results = sorted(combined_results, key=lambda r: r["rrf_score"], reverse=True)
-        return sorted_results[:limit]
+                (keyword_positions, _), (semantic_positions, _) = await asyncio.to_thread(self._retrieve, enhanced_query, depth)
+            return enhanced_query, self.__rrf_results(keyword_positions, semantic_positions, k, limit)
+
+    def batch_rrf_search(self, queries, k, limit=10, depth=None):
+        depth = limit * HYBRID_CANDIDATE_MULTIPLIER if depth is None else depth
+        with span("hybrid.batch_rrf_search", queries=len(queries), limit=limit, depth=depth):
+            keyword, semantic = self._retrieve_batch(queries, depth)
+            return [self.__rrf_results(kw[0], sem[0], k, limit) for kw, sem in zip(keyword, semantic)]
+
+    def __rrf_results(self, keyword_positions, semantic_positions, k, limit):
+        with span("hybrid.fusion", method="rrf"):
+            best, rrf_scores, bm25_ranks, semantic_ranks = rrf_fusion(keyword_positions, semantic_positions, len(self.documents), k, limit)
+            results = []
+            for i, rrf, bm25_rank, semantic_rank in zip(best.tolist(), rrf_scores.tolist(), bm25_ranks.tolist(), semantic_ranks.tolist()):
+                doc = self.documents[i]
+                results.append({
+                    'id': doc['id'],
+                    'title': doc['title'],
+                    'description': doc['description'][:100],
+                    'bm25_rank': bm25_rank or None,
+                    'semantic_rank': semantic_rank or None,
+                    'rrf_score': rrf
+                })
+            return results
+
+def pad_keyword_leg(positions: np.ndarray, scores: np.ndarray, n_docs: int, depth: int) -> tuple[np.ndarray, np.ndarray]:
+    # BM25 only returns matching documents, but fusion has always seen the
+    # top `depth` of every document's score: when fewer match, the rest is
+    # made up of zero scores in catalog order. Those zeros are the floor of
+    # the min-max normalization and hold BM25 ranks in RRF.
+    missing = min(depth, n_docs) - len(positions)
+    if missing <= 0:
+        return positions, scores
+    matched = np.zeros(n_docs, dtype=bool)
+    matched[positions] = True
+    padding = np.flatnonzero(~matched[:len(positions) + missing])[:missing]
+    return np.concatenate([positions, padding]), np.concatenate([scores, np.zeros(len(padding), dtype=scores.dtype)])
+
+def fusion_candidates(keyword_positions: np.ndarray, semantic_positions: np.ndarray, n_docs: int) -> np.ndarray:
+    # Keyword candidates in rank order, then semantic-only candidates in rank
+    # order; equal fused scores keep this order.
+    seen = np.zeros(n_docs, dtype=bool)
+    seen[keyword_positions] = True
+    return np.concatenate([keyword_positions, semantic_positions[~seen[semantic_positions]]])
+
+def weighted_fusion(keyword_positions, keyword_scores, semantic_positions, semantic_scores, n_docs: int, alpha: float, limit: int):
+    # Returns the best document positions with their hybrid, normalized
+    # BM25 and normalized semantic scores (0 where a leg missed the doc).
+    bm25 = np.zeros(n_docs, dtype=np.float64)
+    bm25[keyword_positions] = normalize_scores(keyword_scores)
+    semantic = np.zeros(n_docs, dtype=np.float64)
+    semantic[semantic_positions] = normalize_scores(semantic_scores)
+
+    candidates = fusion_candidates(keyword_positions, semantic_positions, n_docs)
+    best = candidates[top_k_indices(hybrid_score(bm25[candidates], semantic[candidates], alpha), limit)]
+    return best, hybrid_score(bm25[best], semantic[best], alpha), bm25[best], semantic[best]
+
+def rrf_fusion(keyword_positions, semantic_positions, n_docs: int, k: int, limit: int):
+    # Returns the best document positions with their RRF scores and 1-based
+    # ranks in each leg (0 where a leg missed the doc).
+    bm25_ranks = np.zeros(n_docs, dtype=np.int64)
+    bm25_ranks[keyword_positions] = np.arange(1, len(keyword_positions) + 1)
+    semantic_ranks = np.zeros(n_docs, dtype=np.int64)
+    semantic_ranks[semantic_positions] = np.arange(1, len(semantic_positions) + 1)
+
+    candidates = fusion_candidates(keyword_positions, semantic_positions, n_docs)
+    scores = np.zeros(len(candidates), dtype=np.float64)
+    for ranks in (bm25_ranks[candidates], semantic_ranks[candidates]):
+        hit = ranks > 0
+        scores[hit] += rrf_score(ranks[hit], k)
+    best = top_k_indices(scores, limit)
+    return candidates[best], scores[best], bm25_ranks[candidates[best]], semantic_ranks[candidates[best]]
 
 def normalize_scores_command(scores: list[float]):
     normalized_scores = normalize_scores(scores)
     for score in normalized_scores:
         print(f"* {score:.4f}")
 
-def normalize_scores(scores: list[float]):
-    if not scores:
-        return []
-
-    max_score = None
-    min_score = None
-    for score in scores:
-        if max_score is None or score > max_score:
-            max_score = score
-        if min_score is None or score < min_score:
-            min_score = score
-    
+def normalize_scores(scores) -> np.ndarray:
+    scores = np.asarray(scores, dtype=np.float64)
+    if len(scores) == 0:
+        return scores
+
+    min_score, max_score = scores.min(), scores.max()
     if min_score == max_score:
-        return [1.0 for _ in scores]
+        return np.ones_like(scores)
 
-    return [(s - min_score)/(max_score - min_score) for s in scores]
+    return (scores - min_score) / (max_score - min_score)
 
 def hybrid_score(bm25_score, semantic_score, alpha=0.5):
     return alpha * bm25_score + (1 - alpha) * semantic_score
 
-def weighted_search_command(query:str, alpha:float, limit:int):
-    with open(DATA_PATH, 'r') as f:
-        data = json.load(f)
-    
-    search = HybridSearch(data['movies'])
-
-    results = search.weighted_search(query, alpha, limit)
+def weighted_search_command(query:str, alpha:float, limit:int, mmap=False, embedding_dtype=DEFAULT_EMBEDDING_DTYPE, server=None, ann=False, nprobe=DEFAULT_ANN_NPROBE, quantized=False, rerank=DEFAULT_PQ_RERANK, sharded=False, depth=None, threads=HYBRID_SEARCH_THREADS, leg_timeout=None):
+    if server:
+        results = search_remote(server, "weighted-search", query=query, alpha=alpha, limit=limit, depth=depth)
+    else:
+        search = load_hybrid_search(mmap, embedding_dtype, ann, nprobe, quantized, rerank, sharded, threads, leg_timeout)
+        results = search.weighted_search(query, alpha, limit, depth)
+        print_leg_timeouts(search)
     for i, r in enumerate(results, start=1):
         print(f"{i}. {r['title']}")
         print(f"    Hybrid Score: {r['hybrid_score']}")
@@ -171,13 +336,19 @@ def weighted_search_command(query:str, alpha:float, limit:int):
 def rrf_score(rank, k=60):
     return 1 / (k + rank)
 
-def rrf_search_command(query: str, k: int, limit:int):
-    with open(DATA_PATH, 'r') as f:
-        data = json.load(f)
-    
-    search = HybridSearch(data['movies'])
-
-    results = search.rrf_search(query, k, limit)
+def rrf_search_command(query: str, k: int, limit:int, mmap=False, embedding_dtype=DEFAULT_EMBEDDING_DTYPE, server=None, ann=False, nprobe=DEFAULT_ANN_NPROBE, quantized=False, rerank=DEFAULT_PQ_RERANK, sharded=False, depth=None, enhance=None, enhance_timeout=DEFAULT_ENHANCEMENT_TIMEOUT, threads=HYBRID_SEARCH_THREADS, leg_timeout=None):
+    enhancer = QueryEnhancer(timeout=enhance_timeout)
+    if server:
+        if enhance:
+            query = enhance_query(enhance, query, enhancer)
+        results = search_remote(server, "rrf-search", query=query, k=k, limit=limit, depth=depth)
+    elif enhance in ENHANCEMENT_METHODS:
+        enhanced_query, results = asyncio.run(enhanced_rrf_search(enhance, query, enhancer, k, limit, depth, mmap, embedding_dtype, ann, nprobe, quantized, rerank, sharded, threads, leg_timeout))
+        print(f"Enhanced query ({enhance}): '{query}' -> '{enhanced_query}'")
+    else:
+        search = load_hybrid_search(mmap, embedding_dtype, ann, nprobe, quantized, rerank, sharded, threads, leg_timeout)
+        results = search.rrf_search(query, k, limit, depth)
+        print_leg_timeouts(search)
 
     for i, r in enumerate(results, start=1):
         print(f"{i}. {r['title']}")
@@ -185,54 +356,68 @@ def rrf_search_command(query: str, k: int, limit:int):
         print(f"     BM25 Rank: {r['bm25_rank']}, Semantic: {r['semantic_rank']}")
         print(f"     {r['description']}")
 
-def enhance_query(method: str, query:str):
-    client = genai.Client(api_key=api_key)
-    model = "gemini-2.5-flash"
-
-    match method:
-        case "spell":
-            spell_prompt = f"""Fix any spelling errors in this movie search query.
-
-            Only correct obvious typos. Don't change correctly spelled words.
-            
-            Query: "{query}"
-            
-            If no errors, return the original query.
-            """
-
-            response = client.models.generate_content(model=model, contents=spell_prompt)
-
-            if response.text is None:
-                return query
-            
-            enhanced_query = response.text
-        
-        case "rewrite":
-            rewrite_prompt = f"""Rewrite this movie search query to be more specific and searchable.
-            
-            Original: "{query}"
-            
-            Consider:
-            - Common movie knowledge (famous actors, popular films)
-            - Genre conventions (horror = scary, animation = cartoon)
-            - Keep it concise (under 10 words)
-            - It should be a google style search query that's very specific
-            - Don't use boolean logic
-            
-            Examples:
-            - "that bear movie where leo gets attacked" -> "The Revenant Leonardo DiCaprio bear attack"
-            - "movie about bear in london with marmalade" -> "Paddington London marmalade"
-            - "scary movie with bear from few years ago" -> "bear horror movie 2015-2020"
-            """
-
-            response = client.models.generate_content(model=model, contents=rewrite_prompt)
-
-            if response.text is None:
-                return query
-            
-            enhanced_query = response.text
-            
-        case _:
-            return query
+async def enhanced_rrf_search(method: str, query: str, enhancer: QueryEnhancer, k: int, limit: int, depth=None, mmap=False, embedding_dtype=DEFAULT_EMBEDDING_DTYPE, ann=False, nprobe=DEFAULT_ANN_NPROBE, quantized=False, rerank=DEFAULT_PQ_RERANK, sharded=False, threads=HYBRID_SEARCH_THREADS, leg_timeout=None) -> tuple[str, list[dict]]:
+    # The LLM request is sent first, so loading the catalog, embeddings and
+    # index and the raw-query BM25 search all overlap its round trip.
+    enhancement = asyncio.create_task(enhancer.enhance(method, query))
+    search = await asyncio.to_thread(load_hybrid_search, mmap, embedding_dtype, ann, nprobe, quantized, rerank, sharded, threads, leg_timeout)
+    return await search.enhanced_rrf_search(query, enhancement, k, limit, depth)
+
+def load_hybrid_search(mmap=False, embedding_dtype=DEFAULT_EMBEDDING_DTYPE, ann=False, nprobe=DEFAULT_ANN_NPROBE, quantized=False, rerank=DEFAULT_PQ_RERANK, sharded=False, threads=HYBRID_SEARCH_THREADS, leg_timeout=None) -> HybridSearch:
+    return HybridSearch(load_catalog(), mmap, embedding_dtype, ann, nprobe, quantized, rerank, sharded, threads=threads, leg_timeout=leg_timeout)
+
+def print_leg_timeouts(search: HybridSearch):
+    for leg in search.leg_timeouts:
+        print(f"The {leg} leg timed out after {search.leg_timeout}s, results come from the other leg only")
+
+def read_batch_queries(lines):
+    # Each line is a JSON string or an object with a "query" field; other
+    # fields (such as an id) are echoed back with the results.
+    for line_number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        record = json.loads(line)
+        if isinstance(record, str):
+            record = {'query': record}
+        if not isinstance(record, dict) or not isinstance(record.get('query'), str):
+            raise ValueError(f"Line {line_number}: expected a JSON string or an object with a \"query\" field")
+        yield record
+
+def batch_search_command(input_path, method: str, alpha: float, k: int, limit: int, mmap=False, embedding_dtype=DEFAULT_EMBEDDING_DTYPE, ann=False, nprobe=DEFAULT_ANN_NPROBE, quantized=False, rerank=DEFAULT_PQ_RERANK, sharded=False, depth=None, block_size=BATCH_QUERY_BLOCK_SIZE, threads=HYBRID_SEARCH_THREADS, leg_timeout=None):
+    search = load_hybrid_search(mmap, embedding_dtype, ann, nprobe, quantized, rerank, sharded, threads, leg_timeout)
+
+    lines = sys.stdin if input_path in (None, '-') else open(input_path, 'r')
+    try:
+        # Results are written per block of queries so output streams while
+        # the rest of the input is still being searched.
+        for block in batched(read_batch_queries(lines), block_size):
+            queries = [record['query'] for record in block]
+            match method:
+                case "bm25":
+                    results = search._bm25_search_batch(queries, limit)
+                case "semantic":
+                    results = [
+                        [{'id': r['id'], 'title': r['title'], 'description': r['description'][:100], 'score': s} for s, r in query_results]
+                        for query_results in search.semantic_search.batch_search(queries, limit)
+                    ]
+                case "weighted":
+                    results = search.batch_weighted_search(queries, alpha, limit, depth)
+                case "rrf":
+                    results = search.batch_rrf_search(queries, k, limit, depth)
+                case _:
+                    raise ValueError(f"Unknown batch search method {method}")
+
+            for record, query_results in zip(block, results):
+                sys.stdout.write(json.dumps({**record, 'results': query_results}, default=to_json) + "\n")
+            sys.stdout.flush()
+    finally:
+        if lines is not sys.stdin:
+            lines.close()
+
+def enhance_query(method: str, query: str, enhancer: QueryEnhancer | None = None) -> str:
+    if method not in ENHANCEMENT_METHODS:
+        return query
+
+    enhanced_query = asyncio.run((enhancer or QueryEnhancer()).enhance(method, query))
     print(f"Enhanced query ({method}): '{query}' -> '{enhanced_query}'")
     return enhanced_query
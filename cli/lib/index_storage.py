@@ -0,0 +1,158 @@
+import json
+import os
+import struct
+from collections.abc import MutableMapping
+
+import numpy as np
+
+INDEX_MAGIC = b"RSEINDEX"
+INDEX_FORMAT_VERSION = 2
+SECTION_ALIGNMENT = 8
+
+# magic, format version, header length
+HEADER_STRUCT = struct.Struct("<8sII")
+
+
+def varint_lengths(values: np.ndarray) -> np.ndarray:
+    values = np.asarray(values, dtype=np.uint64)
+    lengths = np.ones(len(values), dtype=np.int64)
+    rest = values >> np.uint64(7)
+    while rest.any():
+        lengths += rest > 0
+        rest >>= np.uint64(7)
+    return lengths
+
+
+def encode_varints(values: np.ndarray) -> np.ndarray:
+    values = np.asarray(values, dtype=np.uint64)
+    if len(values) == 0:
+        return np.empty(0, dtype=np.uint8)
+
+    lengths = varint_lengths(values)
+    starts = np.cumsum(lengths) - lengths
+    owner = np.repeat(np.arange(len(values)), lengths)
+    position = np.arange(len(owner)) - starts[owner]
+
+    encoded = ((values[owner] >> (position * 7).astype(np.uint64)) & np.uint64(0x7F)).astype(np.uint8)
+    encoded[position < lengths[owner] - 1] |= 0x80
+    return encoded
+
+
+def decode_varints(data) -> np.ndarray:
+    data = np.frombuffer(data, dtype=np.uint8) if isinstance(data, (bytes, bytearray)) else data
+    if len(data) == 0:
+        return np.empty(0, dtype=np.uint64)
+
+    ends = np.flatnonzero(data < 0x80)
+    starts = np.empty_like(ends)
+    starts[0] = 0
+    starts[1:] = ends[:-1] + 1
+    owner = np.repeat(np.arange(len(ends)), ends - starts + 1)
+    shifts = ((np.arange(len(data)) - starts[owner]) * 7).astype(np.uint64)
+
+    parts = (data & 0x7F).astype(np.uint64) << shifts
+    return np.bitwise_or.reduceat(parts, starts)
+
+
+def encode_postings(postings: list[tuple[np.ndarray, np.ndarray]]) -> tuple[np.ndarray, np.ndarray]:
+    # Each term is stored as its doc gaps followed by its term frequencies;
+    # the returned offsets hold the start byte of every term plus the end.
+    values = []
+    value_offsets = [0]
+    for doc_idx, tfs in postings:
+        values.append(np.diff(doc_idx, prepend=0))
+        values.append(tfs)
+        value_offsets.append(value_offsets[-1] + 2 * len(doc_idx))
+
+    values = np.concatenate(values) if values else np.empty(0, dtype=np.uint64)
+    byte_offsets = np.zeros(len(values) + 1, dtype=np.uint64)
+    np.cumsum(varint_lengths(values), out=byte_offsets[1:])
+    return encode_varints(values), byte_offsets[value_offsets]
+
+
+def decode_postings(data) -> tuple[np.ndarray, np.ndarray]:
+    values = decode_varints(data)
+    df = len(values) // 2
+    doc_idx = np.cumsum(values[:df]).astype(np.int32)
+    tfs = values[df:].astype(np.int32)
+    return doc_idx, tfs
+
+
+class DocStore(MutableMapping):
+    def __init__(self, positions: dict[int, int], offsets: np.ndarray, data: np.ndarray) -> None:
+        self.positions = positions
+        self.offsets = offsets
+        self.data = data
+        # Documents added or replaced since the store was written.
+        self.overlay: dict[int, dict] = {}
+
+    def __getitem__(self, doc_id):
+        doc = self.overlay.get(doc_id)
+        if doc is not None:
+            return doc
+        i = self.positions[doc_id]
+        return json.loads(self.data[self.offsets[i]:self.offsets[i + 1]].tobytes())
+
+    def __setitem__(self, doc_id, doc):
+        self.overlay[doc_id] = doc
+
+    def __delitem__(self, doc_id):
+        if self.overlay.pop(doc_id, None) is None and doc_id not in self.positions:
+            raise KeyError(doc_id)
+        self.positions.pop(doc_id, None)
+
+    def __iter__(self):
+        yield from (doc_id for doc_id in self.positions if doc_id not in self.overlay)
+        yield from self.overlay
+
+    def __len__(self):
+        return len(self.positions) + sum(1 for doc_id in self.overlay if doc_id not in self.positions)
+
+
+def encode_documents(documents: list[dict]) -> tuple[np.ndarray, np.ndarray]:
+    encoded = [json.dumps(doc, separators=(",", ":")).encode() for doc in documents]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.uint64)
+    np.cumsum([len(doc) for doc in encoded], out=offsets[1:])
+    return np.frombuffer(b"".join(encoded), dtype=np.uint8), offsets
+
+
+def write_index(path: str, sections: dict[str, np.ndarray], metadata: dict) -> None:
+    layout = {}
+    offset = 0
+    for name, array in sections.items():
+        array = np.ascontiguousarray(array)
+        layout[name] = [offset, len(array), array.dtype.str]
+        offset += array.nbytes
+        offset += -offset % SECTION_ALIGNMENT
+
+    header = json.dumps({"sections": layout, "metadata": metadata}).encode()
+    data_start = HEADER_STRUCT.size + len(header)
+    data_start += -data_start % SECTION_ALIGNMENT
+    header += b" " * (data_start - HEADER_STRUCT.size - len(header))
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(HEADER_STRUCT.pack(INDEX_MAGIC, INDEX_FORMAT_VERSION, len(header)))
+        f.write(header)
+        for name, array in sections.items():
+            f.seek(data_start + layout[name][0])
+            f.write(np.ascontiguousarray(array).tobytes())
+        f.truncate(data_start + offset)
+    os.replace(tmp_path, path)
+
+
+def read_index(path: str) -> tuple[dict[str, np.ndarray], dict]:
+    buffer = np.memmap(path, dtype=np.uint8, mode="r")
+    magic, version, header_length = HEADER_STRUCT.unpack(buffer[:HEADER_STRUCT.size].tobytes())
+    if magic != INDEX_MAGIC:
+        raise ValueError(f"{path} is not a search index file")
+    if version != INDEX_FORMAT_VERSION:
+        raise ValueError(f"Unsupported index format version {version}, rebuild the index")
+
+    header = json.loads(buffer[HEADER_STRUCT.size:HEADER_STRUCT.size + header_length].tobytes())
+    data_start = HEADER_STRUCT.size + header_length
+
+    sections = {}
+    for name, (offset, count, dtype) in header["sections"].items():
+        sections[name] = np.frombuffer(buffer, dtype=np.dtype(dtype), count=count, offset=data_start + offset)
+    return sections, header["metadata"]
@@ -3,143 +3,635 @@ import pickle
 import math
 from collections import Counter, defaultdict
 
+import numpy as np
+
+from .catalog import CATALOG_STATE_DTYPE, Catalog, CatalogDiff, as_catalog, catalog_state, load_catalog
+from .index_storage import (
+    DocStore,
+    decode_postings,
+    encode_documents,
+    encode_postings,
+    read_index,
+    write_index,
+)
+from .tracing import span
 from .search_utils import (
-    tokenize_text, 
-    load_movies,
+    file_stamp,
+    get_tokenizer,
+    top_k_indices,
     CACHE_DIR,
+    INDEX_PATH,
     BM25_K1,
-    BM25_B
+    BM25_B,
+    BM25_BLOCK_SIZE,
+    BM25_IMPACT_LEVELS,
 )
 
+# Marks a document slot freed by an incremental update; save() compacts them.
+DELETED_DOC_ID = -1
+
+# Relative slack added to block upper bounds so float rounding can never
+# make a bound smaller than a score it covers.
+BOUND_SLACK = 1e-9
+
+# Width of one quantized impact level, in tf component units.
+IMPACT_STEP = (BM25_K1 + 1) / BM25_IMPACT_LEVELS
+
+def document_text(doc: dict) -> str:
+    return f"{doc['title']} f{doc['description']}"
+
+def bm25_idf(num_docs: int, df: int) -> float:
+    return math.log((num_docs - df + 0.5)/(df + 0.5) + 1)
+
+def bm25_tf_component(tf, doc_lengths, avg_doc_length, k1=BM25_K1, b=BM25_B):
+    length_norm = 1 - b + b * (doc_lengths / avg_doc_length)
+    return (tf * (k1 + 1)) / (tf + k1 * length_norm)
+
+def block_max_scores(doc_idx: np.ndarray, tf_component: np.ndarray, block_size=BM25_BLOCK_SIZE) -> tuple[np.ndarray, np.ndarray]:
+    # Blocks holding at least one posting and, for each, the largest tf
+    # component in it, rounded up to float32.
+    blocks = doc_idx // block_size
+    starts = np.flatnonzero(np.diff(blocks, prepend=-1))
+    max_scores = np.maximum.reduceat(tf_component, starts)
+    rounded = max_scores.astype(np.float32)
+    rounded = np.where(rounded < max_scores, np.nextafter(rounded, np.float32(np.inf)), rounded)
+    return blocks[starts].astype(np.int32), rounded
+
+def quantize_impacts(tf_component: np.ndarray) -> np.ndarray:
+    return np.minimum(np.rint(tf_component / IMPACT_STEP), BM25_IMPACT_LEVELS).astype(np.uint16)
+
+def concat_ranges(starts: np.ndarray, ends: np.ndarray) -> np.ndarray:
+    lengths = ends - starts
+    offsets = np.repeat(starts - (np.cumsum(lengths) - lengths), lengths)
+    return offsets + np.arange(lengths.sum())
+
 class InvertedIndex:
-    def __init__(self) -> None:
-        self.index = defaultdict(set)
+    def __init__(self, index_path=INDEX_PATH) -> None:
+        self.lexicon: dict[str, int] = {}
+        self.postings: dict[str, tuple[np.ndarray, np.ndarray]] = {}
+        self.postings_data = None
+        self.postings_offsets = None
         self.docmap: dict[int, dict] = {}
-        self.index_path = os.path.join(CACHE_DIR, "index.pkl")
-        self.docmap_path = os.path.join(CACHE_DIR, "docmap.pkl")
-        self.tf_path = os.path.join(CACHE_DIR, "term_frequencies.pkl")
-        self.term_frequencies = defaultdict(Counter)
-        self.doc_lengths: dict[int, int] = {}
-        self.doc_lengths_path = os.path.join(CACHE_DIR, "doc_lengths.pkl")
-
-    def __add_document(self, doc_id, text):
-        tokens = tokenize_text(text)
-        for token in set(tokens):
-            self.index[token].add(doc_id)
-        self.term_frequencies[doc_id].update(tokens)
-        self.doc_lengths[doc_id] = len(tokens)
+        self.doc_positions: dict[int, int] = {}
+        self.doc_ids = np.empty(0, dtype=np.int64)
+        self.doc_lengths = np.empty(0, dtype=np.int32)
+        self.doc_hashes = np.empty(0, dtype=np.uint64)
+        self.index_path = index_path
+        self.index_stamp = None
+        self.num_docs = 0
+        self.avg_doc_length = 0.0
+        # Average document length of the whole collection when this index
+        # holds one shard of it, so BM25 length normalization stays global.
+        self.collection_avg_doc_length: float | None = None
+        self.idf_cache: dict[str, float] = {}
+        self.block_bounds: dict[str, tuple[np.ndarray, np.ndarray]] = {}
+        self.block_bounds_data = None
+        # Whether save() writes precomputed impacts for the default k1/b.
+        self.store_impacts = False
+        self.impacts: dict[str, np.ndarray] = {}
+        self.impacts_data = None
+        # The first tokenizer pulls in nltk, often the slowest part of startup.
+        with span("tokenizer.load"):
+            self.tokenizer = get_tokenizer()
+
+    def __set_documents(self, documents: list[dict], token_counts: list[Counter]):
+        postings = defaultdict(lambda: ([], []))
+        for doc_idx, counts in enumerate(token_counts):
+            for token, tf in counts.items():
+                doc_list, tf_list = postings[token]
+                doc_list.append(doc_idx)
+                tf_list.append(tf)
+
+        self.lexicon = {}
+        self.postings = {}
+        for token, (doc_list, tf_list) in postings.items():
+            self.lexicon[token] = len(self.lexicon)
+            self.postings[token] = (np.array(doc_list, dtype=np.int32), np.array(tf_list, dtype=np.int32))
+        self.postings_data = None
+        self.postings_offsets = None
+        self.block_bounds_data = None
+        self.impacts_data = None
+
+        self.docmap = {doc['id']: doc for doc in documents}
+        self.doc_positions = {doc['id']: i for i, doc in enumerate(documents)}
+        self.doc_ids = np.array([doc['id'] for doc in documents], dtype=np.int64)
+        self.doc_lengths = np.array([counts.total() for counts in token_counts], dtype=np.int32)
+        self.doc_hashes = catalog_state(documents)["hash"]
+        self.__update_stats()
+
+    def get_postings(self, token: str) -> tuple[np.ndarray, np.ndarray] | None:
+        postings = self.postings.get(token)
+        if postings is None:
+            term_id = self.lexicon.get(token)
+            if term_id is None:
+                return None
+            start, end = self.postings_offsets[term_id], self.postings_offsets[term_id + 1]
+            postings = decode_postings(self.postings_data[start:end])
+            self.postings[token] = postings
+        return postings
+
+    def get_block_bounds(self, token: str) -> tuple[np.ndarray, np.ndarray]:
+        # Upper bounds on the BM25 tf component (default k1/b) of `token` in
+        # every block of BM25_BLOCK_SIZE documents where it occurs.
+        bounds = self.block_bounds.get(token)
+        if bounds is None:
+            if self.block_bounds_data is not None:
+                offsets, blocks, max_scores = self.block_bounds_data
+                term_id = self.lexicon[token]
+                start, end = offsets[term_id], offsets[term_id + 1]
+                bounds = (blocks[start:end], max_scores[start:end])
+            else:
+                doc_idx, tf = self.get_postings(token)
+                bounds = block_max_scores(doc_idx, bm25_tf_component(tf, self.doc_lengths[doc_idx], self.avg_doc_length))
+            self.block_bounds[token] = bounds
+        return bounds
+
+    def get_impacts(self, token: str) -> np.ndarray:
+        # Quantized BM25 tf components (default k1/b) of `token`, aligned
+        # with its postings.
+        impacts = self.impacts.get(token)
+        if impacts is None:
+            if self.impacts_data is not None:
+                offsets, data = self.impacts_data
+                term_id = self.lexicon[token]
+                impacts = data[offsets[term_id]:offsets[term_id + 1]]
+            else:
+                doc_idx, tf = self.get_postings(token)
+                impacts = quantize_impacts(bm25_tf_component(tf, self.doc_lengths[doc_idx], self.avg_doc_length))
+            self.impacts[token] = impacts
+        return impacts
 
     def get_documents(self, term: str):
         term = term.lower()
-        ids = self.index.get(term)
+        postings = self.get_postings(term)
 
-        if not ids:
+        if postings is None:
             return []
-        
-        return [self.docmap.get(id) for id in sorted(ids)]
-    
-    def build(self):
-        movies = load_movies()
-        for movie in movies:
-            self.__add_document(movie['id'], f"{movie['title']} f{movie['description']}")
-            self.docmap[movie['id']] = movie
 
-    def save(self):
-        os.makedirs('cache', exist_ok=True)
+        return [self.docmap.get(id) for id in sorted(self.doc_ids[postings[0]].tolist())]
+
+    def build(self, documents: list[dict] | None = None):
+        movies = load_catalog().documents if documents is None else documents
+        texts = [document_text(movie) for movie in movies]
+        self.__set_documents(movies, [Counter(tokens) for tokens in self.tokenizer.tokenize_many(texts)])
+
+    def set_collection_avg_doc_length(self, avg_doc_length: float | None):
+        self.collection_avg_doc_length = avg_doc_length
+        # Stored bounds and impacts were computed with the old average.
+        self.block_bounds_data = None
+        self.impacts_data = None
+        self.__update_stats()
 
-        with open(self.index_path, 'wb') as f:
-            pickle.dump(self.index, f)
-        
-        with open(self.docmap_path, 'wb') as f:
-            pickle.dump(self.docmap, f)
+    def update(self, documents: "list[dict] | Catalog") -> CatalogDiff:
+        catalog = as_catalog(documents)
+        documents = catalog.documents
+        slots = np.flatnonzero(self.doc_ids != DELETED_DOC_ID)
+        old_state = np.empty(len(slots), dtype=CATALOG_STATE_DTYPE)
+        old_state["id"] = self.doc_ids[slots]
+        old_state["hash"] = self.doc_hashes[slots]
+        new_state = catalog.state
 
-        with open(self.tf_path, 'wb') as f:
-            pickle.dump(self.term_frequencies, f)
+        diff = CatalogDiff(old_state, new_state)
+        if diff.unchanged:
+            return diff
 
-        with open(self.doc_lengths_path, 'wb') as f:
-            pickle.dump(self.doc_lengths, f)
+        free_slots = [int(slots[old_i]) for old_i in diff.removed]
+        appended = max(0, len(diff.added) - len(free_slots))
+        self.doc_ids = np.concatenate([self.doc_ids, np.full(appended, DELETED_DOC_ID, dtype=np.int64)])
+        self.doc_lengths = np.concatenate([self.doc_lengths, np.zeros(appended, dtype=np.int32)])
+        self.doc_hashes = np.concatenate([self.doc_hashes, np.zeros(appended, dtype=np.uint64)])
+        free_slots.extend(range(len(self.doc_ids) - appended, len(self.doc_ids)))
+
+        for old_i in [old_i for old_i, _ in diff.changed] + diff.removed:
+            self.__remove_document(int(slots[old_i]))
+
+        targets = [(int(slots[old_i]), new_i) for old_i, new_i in diff.changed]
+        targets += [(free_slots.pop(0), new_i) for new_i in diff.added]
+        token_lists = self.tokenizer.tokenize_many([document_text(documents[new_i]) for _, new_i in targets])
+        for (slot, new_i), tokens in zip(targets, token_lists):
+            self.__insert_document(slot, documents[new_i], Counter(tokens), new_state["hash"][new_i])
+
+        self.block_bounds_data = None
+        self.impacts_data = None
+        self.__update_stats()
+        return diff
+
+    def __remove_document(self, slot: int):
+        doc_id = int(self.doc_ids[slot])
+        for term in set(self.tokenizer.tokenize(document_text(self.docmap[doc_id]))):
+            doc_idx, tfs = self.get_postings(term)
+            keep = doc_idx != slot
+            if keep.any():
+                self.postings[term] = (doc_idx[keep], tfs[keep])
+            else:
+                del self.postings[term]
+                del self.lexicon[term]
+
+        del self.docmap[doc_id]
+        del self.doc_positions[doc_id]
+        self.doc_ids[slot] = DELETED_DOC_ID
+        self.doc_lengths[slot] = 0
+        self.doc_hashes[slot] = 0
+
+    def __insert_document(self, slot: int, doc: dict, counts: Counter, doc_hash):
+        for term, tf in counts.items():
+            postings = self.get_postings(term)
+            if postings is None:
+                self.lexicon[term] = len(self.lexicon)
+                self.postings[term] = (np.array([slot], dtype=np.int32), np.array([tf], dtype=np.int32))
+            else:
+                doc_idx, tfs = postings
+                i = np.searchsorted(doc_idx, slot)
+                self.postings[term] = (np.insert(doc_idx, i, slot), np.insert(tfs, i, tf))
+
+        self.docmap[doc['id']] = doc
+        self.doc_positions[doc['id']] = slot
+        self.doc_ids[slot] = doc['id']
+        self.doc_lengths[slot] = counts.total()
+        self.doc_hashes[slot] = doc_hash
+
+    def __compact(self):
+        live = self.doc_ids != DELETED_DOC_ID
+        if live.all():
+            return
+
+        remap = (np.cumsum(live) - 1).astype(np.int32)
+        for term in self.lexicon:
+            doc_idx, tfs = self.get_postings(term)
+            self.postings[term] = (remap[doc_idx], tfs)
+
+        self.doc_ids = self.doc_ids[live]
+        self.doc_lengths = self.doc_lengths[live]
+        self.doc_hashes = self.doc_hashes[live]
+        self.doc_positions = {doc_id: i for i, doc_id in enumerate(self.doc_ids.tolist())}
+        self.block_bounds = {}
+        self.impacts = {}
+
+    def save(self):
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        self.__compact()
+
+        terms = list(self.lexicon)
+        postings_data, postings_offsets = encode_postings([self.get_postings(term) for term in terms])
+        docs_data, docs_offsets = encode_documents([self.docmap[doc_id] for doc_id in self.doc_ids.tolist()])
+        bounds = [self.get_block_bounds(term) for term in terms]
+        bounds_offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        np.cumsum([len(blocks) for blocks, _ in bounds], out=bounds_offsets[1:])
+
+        sections = {
+            "terms": np.frombuffer("\n".join(terms).encode(), dtype=np.uint8),
+            "postings_offsets": postings_offsets,
+            "postings": postings_data,
+            "doc_ids": self.doc_ids,
+            "doc_lengths": self.doc_lengths,
+            "doc_hashes": self.doc_hashes,
+            "docs_offsets": docs_offsets,
+            "docs": docs_data,
+            "block_offsets": bounds_offsets,
+            "blocks": np.concatenate([blocks for blocks, _ in bounds] or [np.empty(0, dtype=np.int32)]),
+            "block_max_scores": np.concatenate([max_scores for _, max_scores in bounds] or [np.empty(0, dtype=np.float32)]),
+        }
+        metadata = {
+            "num_docs": len(self.doc_ids),
+            "num_terms": len(terms),
+            "block_bounds": self.__block_bounds_key(),
+        }
+        if self.collection_avg_doc_length is not None:
+            metadata["collection_avg_doc_length"] = self.collection_avg_doc_length
+        if self.store_impacts:
+            impacts = [self.get_impacts(term) for term in terms]
+            impact_offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+            np.cumsum([len(term_impacts) for term_impacts in impacts], out=impact_offsets[1:])
+            sections["impact_offsets"] = impact_offsets
+            sections["impacts"] = np.concatenate(impacts or [np.empty(0, dtype=np.uint16)])
+            metadata["impacts"] = self.__impacts_key()
+        write_index(self.index_path, sections, metadata)
+        self.index_stamp = file_stamp(self.index_path)
 
     def load(self):
-        # if not os.path.exists(self.index_path) or not os.path.exists(self.docmap_path) or not os.path.exists(self.tf_path):
-            # raise Exception("Files don't exist, build the index first!")
-        
-        with open(self.index_path, 'rb') as f:
-            self.index = pickle.load(f)
-                
-        with open(self.docmap_path, 'rb') as f:
-            self.docmap = pickle.load(f)
-        
-        with open(self.tf_path, 'rb') as f:
-            self.term_frequencies = pickle.load(f)
-        
-        with open(self.doc_lengths_path, 'rb') as f:
-            self.doc_lengths = pickle.load(f)
-    
+        with span("bm25.load", path=os.path.basename(self.index_path)):
+            if not os.path.exists(self.index_path):
+                raise FileNotFoundError(f"{self.index_path} doesn't exist, build the index first!")
+
+            index_stamp = file_stamp(self.index_path)
+            sections, metadata = read_index(self.index_path)
+
+            terms = sections["terms"].tobytes().decode().split("\n") if len(sections["terms"]) else []
+            self.lexicon = {term: term_id for term_id, term in enumerate(terms)}
+            self.postings = {}
+            self.postings_data = sections["postings"]
+            self.postings_offsets = sections["postings_offsets"]
+
+            self.doc_ids = sections["doc_ids"]
+            self.doc_lengths = sections["doc_lengths"]
+            self.doc_hashes = sections["doc_hashes"]
+            self.doc_positions = {doc_id: i for i, doc_id in enumerate(self.doc_ids.tolist())}
+            self.docmap = DocStore(dict(self.doc_positions), sections["docs_offsets"], sections["docs"])
+            self.index_stamp = index_stamp
+
+            self.collection_avg_doc_length = metadata.get("collection_avg_doc_length")
+            self.__update_stats()
+            # Indexes written before block bounds existed, or for other BM25
+            # parameters, compute them per query term on first use instead.
+            self.block_bounds_data = None
+            if metadata.get("block_bounds") == self.__block_bounds_key():
+                self.block_bounds_data = (sections["block_offsets"], sections["blocks"], sections["block_max_scores"])
+            self.store_impacts = "impacts" in metadata
+            self.impacts_data = None
+            if metadata.get("impacts") == self.__impacts_key():
+                self.impacts_data = (sections["impact_offsets"], sections["impacts"])
+
+    def is_stale(self) -> bool:
+        return self.index_stamp is None or self.index_stamp != file_stamp(self.index_path)
+
+    def ensure_loaded(self):
+        if self.is_stale():
+            self.load()
+
+    def reloaded(self) -> "InvertedIndex":
+        # This index while its file is unchanged, otherwise a newly loaded
+        # one; unlike ensure_loaded() it never mutates an index that other
+        # threads may be scoring on.
+        if not self.is_stale():
+            return self
+        index = InvertedIndex(self.index_path)
+        index.load()
+        return index
+
+    def load_pickles(self, cache_dir=CACHE_DIR):
+        with open(os.path.join(cache_dir, "docmap.pkl"), 'rb') as f:
+            docmap = pickle.load(f)
+
+        with open(os.path.join(cache_dir, "term_frequencies.pkl"), 'rb') as f:
+            term_frequencies = pickle.load(f)
+
+        self.__set_documents(list(docmap.values()), [Counter(term_frequencies.get(doc_id, {})) for doc_id in docmap])
+
+    def __update_stats(self):
+        self.num_docs = int(np.count_nonzero(self.doc_ids != DELETED_DOC_ID))
+        self.avg_doc_length = self.__get_avg_doc_length()
+        self.idf_cache = {}
+        self.block_bounds = {}
+        self.impacts = {}
+
+    def __block_bounds_key(self) -> dict:
+        return {"k1": BM25_K1, "b": BM25_B, "block_size": BM25_BLOCK_SIZE, "avg_doc_length": self.avg_doc_length}
+
+    def __impacts_key(self) -> dict:
+        return {"k1": BM25_K1, "b": BM25_B, "levels": BM25_IMPACT_LEVELS, "avg_doc_length": self.avg_doc_length}
+
     def get_tf(self, doc_id, term):
-        tokens = tokenize_text(term)
+        tokens = self.tokenizer.tokenize(term)
         if len(tokens) != 1:
             raise ValueError("term must be a single token")
-        
-        doc:dict = self.term_frequencies.get(doc_id)
-        if not doc:
+
+        postings = self.get_postings(tokens[0])
+        doc_idx = self.doc_positions.get(doc_id)
+        if postings is None or doc_idx is None:
             return 0
-        
-        term = doc.get(tokens[0])
-        if not term:
+
+        doc_list, tf_list = postings
+        i = np.searchsorted(doc_list, doc_idx)
+        if i == len(doc_list) or doc_list[i] != doc_idx:
             return 0
-        
-        return term
+
+        return int(tf_list[i])
 
     def get_idf(self, term):
-        tokens = tokenize_text(term)
+        tokens = self.tokenizer.tokenize(term)
         if len(tokens) != 1:
             raise ValueError("term must be a single token")
-        
-        return math.log((len(self.docmap) + 1) / (len(self.index.get(tokens[0], [])) + 1))
+
+        return math.log((self.num_docs + 1) / (self.__get_df(tokens[0]) + 1))
 
     def get_bm25_idf(self, term:str):
-        tokens = tokenize_text(term)
+        tokens = self.tokenizer.tokenize(term)
         if len(tokens) != 1:
-            raise ValueError("term must be a single token")\
-        
-        N = len(self.docmap)
-        df = len(self.index.get(tokens[0], []))
-        
-        return math.log((N - df + 0.5)/(df + 0.5) + 1)
+            raise ValueError("term must be a single token")
+
+        return self.__get_term_bm25_idf(tokens[0])
+
+    def get_document_frequency(self, token: str) -> int:
+        postings = self.get_postings(token)
+        return 0 if postings is None else len(postings[0])
+
+    def __get_df(self, token: str) -> int:
+        return self.get_document_frequency(token)
+
+    def __get_term_bm25_idf(self, token: str) -> float:
+        idf = self.idf_cache.get(token)
+        if idf is None:
+            idf = bm25_idf(self.num_docs, self.__get_df(token))
+            self.idf_cache[token] = idf
+        return idf
 
     def get_bm25_tf(self, doc_id, term, k1=BM25_K1, b=BM25_B):
         tf = self.get_tf(doc_id, term)
-        doc_length = self.doc_lengths[doc_id]
-        avg_doc_length = self.__get_avg_doc_length()
-        length_norm = 1 - b + b * (doc_length / avg_doc_length)
+        doc_length = self.doc_lengths[self.doc_positions[doc_id]]
+        length_norm = 1 - b + b * (doc_length / self.avg_doc_length)
         # return (tf * (k1 + 1)) / (tf + k1)
         tf_component = (tf * (k1 + 1)) / (tf + k1 * length_norm)
         return tf_component
 
 
     def __get_avg_doc_length(self) -> float:
-        if len(self.doc_lengths) == 0:
+        if self.collection_avg_doc_length is not None:
+            return self.collection_avg_doc_length
+
+        if self.num_docs == 0:
             return 0.0
-        
-        return sum([self.doc_lengths[i] for i in self.doc_lengths]) / len(self.doc_lengths)
-    
+
+        return float(self.doc_lengths.sum()) / self.num_docs
+
     def bm25(self, doc_id, term):
         bm25_tf = self.get_bm25_tf(doc_id, term)
         bm25_idf = self.get_bm25_idf(term)
         return bm25_tf * bm25_idf
-    
-    def bm25_search(self, query, limit):
-        tokens = tokenize_text(query)
-        scores= {}
-        for doc_id in self.docmap:
-            bm25_total = 0
-            for term in tokens:
-                bm25_total += self.bm25(doc_id, term)
-            scores[doc_id] = bm25_total
-
-        scores = sorted(scores.items(), key=lambda item: item[1], reverse=True)
-
-        results = []
-        for doc_id, score in scores[:limit]:
-            results.append({ 'id': doc_id, 'title': self.docmap[doc_id]['title'], 'description': self.docmap[doc_id]['description'][:100], 'score': score})
-        return results
\ No newline at end of file
+
+    def __query_term_weights(self, query) -> list[tuple[str, float]]:
+        term_weights = []
+        for term, query_tf in Counter(self.tokenizer.tokenize(query)).items():
+            if self.get_postings(term) is not None:
+                term_weights.append((term, self.__get_term_bm25_idf(term) * query_tf))
+        return term_weights
+
+    def bm25_top_k(self, query, limit, k1=BM25_K1, b=BM25_B, prune=False) -> tuple[np.ndarray, np.ndarray, dict]:
+        return self.bm25_top_k_weighted(self.__query_term_weights(query), limit, k1, b, prune)
+
+    def bm25_top_k_batch(self, queries: list[str], limit, k1=BM25_K1, b=BM25_B, prune=False) -> list[tuple[np.ndarray, np.ndarray, dict]]:
+        # Repeated queries are scored once, and the tf components of terms
+        # shared between queries are computed once per batch.
+        components = {}
+        results = {}
+        for query in queries:
+            if query not in results:
+                results[query] = self.bm25_top_k_weighted(self.__query_term_weights(query), limit, k1, b, prune, components)
+        return [results[query] for query in queries]
+
+    def bm25_top_k_weighted(self, term_weights: list[tuple[str, float]], limit, k1=BM25_K1, b=BM25_B, prune=False, components=None) -> tuple[np.ndarray, np.ndarray, dict]:
+        # Scores query terms with caller-supplied weights (idf times query
+        # tf); a sharded index passes weights from collection-wide stats.
+        # `components` optionally caches per-term tf components across calls
+        # with the same k1/b.
+        with span("bm25.score", terms=len(term_weights), limit=limit, prune=prune) as trace:
+            query_terms = []
+            for term, weight in term_weights:
+                postings = self.get_postings(term)
+                if postings is not None:
+                    query_terms.append((term, postings, weight))
+
+            # Block bounds are only valid for the parameters they were built
+            # with. Precomputed impacts approximate the exact tf components
+            # to within half an IMPACT_STEP; both paths score from them so
+            # pruning returns exactly what exhaustive scoring does.
+            use_impacts = self.store_impacts and k1 == BM25_K1 and b == BM25_B
+            if prune and k1 == BM25_K1 and b == BM25_B and limit > 0:
+                best, scores, stats = self.__bm25_top_k_pruned(query_terms, limit, use_impacts)
+                trace.set(**stats)
+                return best, scores, stats
+
+            scores = np.zeros(len(self.doc_ids), dtype=np.float64)
+            matched = np.zeros(len(self.doc_ids), dtype=bool)
+            if use_impacts:
+                # Precomputed impacts turn scoring into pure accumulation; any
+                # other k1/b is scored from the stored term frequencies below.
+                for term, (doc_idx, _), idf in query_terms:
+                    scores[doc_idx] += (idf * IMPACT_STEP) * self.get_impacts(term)
+                    matched[doc_idx] = True
+            else:
+                for term, (doc_idx, tf), idf in query_terms:
+                    component = None if components is None else components.get(term)
+                    if component is None:
+                        component = bm25_tf_component(tf, self.doc_lengths[doc_idx], self.avg_doc_length, k1, b)
+                        if components is not None:
+                            components[term] = component
+                    scores[doc_idx] += idf * component
+                    matched[doc_idx] = True
+
+            matched = np.flatnonzero(matched)
+            best = matched[top_k_indices(scores[matched], limit)]
+            postings = sum(len(doc_idx) for _, (doc_idx, _), _ in query_terms)
+            stats = {"postings": postings, "postings_scored": postings, "lookups": 0}
+            trace.set(**stats)
+            return best, scores[best], stats
+
+    def __bm25_top_k_pruned(self, query_terms, limit, use_impacts=False) -> tuple[np.ndarray, np.ndarray, dict]:
+        # Block-max pruning: every block of BM25_BLOCK_SIZE documents gets an
+        # upper bound from the per-term block maxima, blocks are scored in
+        # decreasing bound order, and scoring stops once no remaining block
+        # can beat the current k-th best score. Within a block, terms whose
+        # summed maxima cannot reach that score on their own (MaxScore's
+        # non-essential terms) are only looked up for documents matching an
+        # essential term. Results match exhaustive scoring exactly, from
+        # impacts when `use_impacts` is set and from tf components otherwise.
+        n_blocks = -(-len(self.doc_ids) // BM25_BLOCK_SIZE)
+        block_starts = np.arange(n_blocks + 1) * BM25_BLOCK_SIZE
+        upper_bounds = np.zeros(n_blocks, dtype=np.float64)
+        term_blocks = []
+        term_max_scores = np.zeros(len(query_terms), dtype=np.float64)
+        for i, (term, (doc_idx, _), idf) in enumerate(query_terms):
+            blocks, max_scores = self.get_block_bounds(term)
+            # Bounds are stored as float32; multiplying by a Python float
+            # would keep float32 and could round a bound below the score.
+            max_scores = max_scores.astype(np.float64)
+            if use_impacts:
+                # A rounded impact exceeds its tf component by at most half a step.
+                max_scores += IMPACT_STEP / 2
+            upper_bounds[blocks] += idf * max_scores
+            term_max_scores[i] = idf * max_scores.max()
+            term_blocks.append(np.searchsorted(doc_idx, block_starts))
+        upper_bounds *= 1 + BOUND_SLACK
+        term_max_scores *= 1 + BOUND_SLACK
+        by_max_score = np.argsort(term_max_scores, kind="stable")
+        max_score_prefix = np.cumsum(term_max_scores[by_max_score])
+
+        order = np.argsort(-upper_bounds, kind="stable")
+        order = order[upper_bounds[order] > 0]
+        neg_bounds = -upper_bounds[order]
+        scores = np.zeros(len(self.doc_ids), dtype=np.float64)
+        matched = np.zeros(len(self.doc_ids), dtype=bool)
+        found = []
+        top_scores = np.empty(0, dtype=np.float64)
+        threshold = -np.inf
+        done, batch, scored, lookups = 0, 1, 0, 0
+        # Blocks are scored in rounds of growing size to keep the number of
+        # numpy calls logarithmic in the number of blocks.
+        while True:
+            eligible = int(np.searchsorted(neg_bounds, -threshold, side="right"))
+            if done >= eligible:
+                break
+            blocks = order[done:min(done + batch, eligible)]
+            done += len(blocks)
+            batch *= 4
+
+            essential = np.ones(len(query_terms), dtype=bool)
+            essential[by_max_score[:np.searchsorted(max_score_prefix, threshold)]] = False
+
+            # Candidates are the documents of these blocks matching at least
+            # one essential term.
+            block_rows = {}
+            for i in np.flatnonzero(essential):
+                rows = concat_ranges(term_blocks[i][blocks], term_blocks[i][blocks + 1])
+                block_rows[i] = rows
+                matched[query_terms[i][1][0][rows]] = True
+            candidates = concat_ranges(block_starts[blocks], np.minimum(block_starts[blocks + 1], len(self.doc_ids)))
+            candidates = np.sort(candidates[matched[candidates]])
+            if len(candidates) == 0:
+                continue
+
+            # Terms are accumulated in query order so every score is
+            # computed exactly as the exhaustive path computes it.
+            for i, (term, (doc_idx, tf), idf) in enumerate(query_terms):
+                rows = block_rows.get(i)
+                if rows is None:
+                    rows = np.minimum(np.searchsorted(doc_idx, candidates), len(doc_idx) - 1)
+                    rows = rows[doc_idx[rows] == candidates]
+                    lookups += len(candidates)
+                scored += len(rows)
+                if len(rows) == 0:
+                    continue
+                term_doc_idx = doc_idx[rows]
+                if use_impacts:
+                    scores[term_doc_idx] += (idf * IMPACT_STEP) * self.get_impacts(term)[rows]
+                else:
+                    scores[term_doc_idx] += idf * bm25_tf_component(tf[rows], self.doc_lengths[term_doc_idx], self.avg_doc_length)
+
+            found.append(candidates)
+            top_scores = np.concatenate([top_scores, scores[candidates]])
+            if len(top_scores) >= limit:
+                top_scores = np.partition(top_scores, len(top_scores) - limit)[len(top_scores) - limit:]
+                threshold = top_scores[0]
+
+        found = np.sort(np.concatenate(found)) if found else np.empty(0, dtype=np.intp)
+        best = found[top_k_indices(scores[found], limit)]
+        postings = sum(len(doc_idx) for _, (doc_idx, _), _ in query_terms)
+        return best, scores[best], {"postings": postings, "postings_scored": scored, "lookups": lookups}
+
+    def bm25_search(self, query, limit, k1=BM25_K1, b=BM25_B, prune=False):
+        best, scores, _ = self.bm25_top_k(query, limit, k1, b, prune)
+        return [self.search_result(i, score) for i, score in zip(best.tolist(), scores.tolist())]
+
+    def bm25_search_batch(self, queries: list[str], limit, k1=BM25_K1, b=BM25_B, prune=False) -> list[list[dict]]:
+        return [
+            [self.search_result(i, score) for i, score in zip(best.tolist(), scores.tolist())]
+            for best, scores, _ in self.bm25_top_k_batch(queries, limit, k1, b, prune)
+        ]
+
+    def search_result(self, doc_idx: int, score: float) -> dict:
+        doc = self.docmap[int(self.doc_ids[doc_idx])]
+        return { 'id': doc['id'], 'title': doc['title'], 'description': doc['description'][:100], 'score': score}
+
+
+def convert_pickle_index_command(cache_dir=CACHE_DIR):
+    index = InvertedIndex()
+    index.load_pickles(cache_dir)
+    index.save()
+    print(f"Converted {index.num_docs} documents and {len(index.lexicon)} terms to {index.index_path}")
+
+def update_index_command():
+    index = InvertedIndex()
+    index.ensure_loaded()
+    diff = index.update(load_catalog())
+    if not diff.unchanged:
+        index.save()
+    print(f"Updated {index.index_path}: {diff.summary()}")
@@ -0,0 +1,160 @@
+import os
+import time
+
+import numpy as np
+
+from .search_utils import (
+    file_stamp,
+    top_k_indices,
+    DEFAULT_PQ_SUBSPACES,
+    EMBEDDING_SCORE_BLOCK_SIZE,
+    PQ_CENTROIDS,
+    PQ_KMEANS_ITERATIONS,
+    PQ_KMEANS_SAMPLE_SIZE,
+)
+
+PQ_FORMAT_VERSION = 1
+
+
+def nearest_centroids(data: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    # argmin ||x - c||^2 == argmax (x.c - ||c||^2 / 2)
+    return np.argmax(data @ centroids.T - 0.5 * np.einsum("ij,ij->i", centroids, centroids), axis=1)
+
+
+def kmeans(data: np.ndarray, k: int, iterations=PQ_KMEANS_ITERATIONS, seed=0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    centroids = data[rng.choice(len(data), size=k, replace=False)].copy()
+
+    for _ in range(iterations):
+        assignments = nearest_centroids(data, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, data)
+        counts = np.bincount(assignments, minlength=k)
+
+        filled = counts > 0
+        centroids[filled] = sums[filled] / counts[filled, None]
+        empty = np.flatnonzero(~filled)
+        centroids[empty] = data[rng.choice(len(data), size=len(empty), replace=False)]
+
+    return centroids
+
+
+class ProductQuantizer:
+    def __init__(self, codebooks: np.ndarray, codes: np.ndarray) -> None:
+        # codebooks: (subspaces, centroids, sub_dim), codes: (rows, subspaces)
+        self.codebooks = codebooks
+        self.codes = codes
+
+    @property
+    def n_subspaces(self) -> int:
+        return self.codebooks.shape[0]
+
+    @property
+    def nbytes(self) -> int:
+        return self.codebooks.nbytes + self.codes.nbytes
+
+    @classmethod
+    def train(cls, embeddings: np.ndarray, n_subspaces=DEFAULT_PQ_SUBSPACES, iterations=PQ_KMEANS_ITERATIONS, sample_size=PQ_KMEANS_SAMPLE_SIZE, seed=0) -> "ProductQuantizer":
+        dim = embeddings.shape[1]
+        if dim % n_subspaces:
+            raise ValueError(f"{n_subspaces} subspaces do not evenly divide {dim} dimensions")
+
+        rng = np.random.default_rng(seed)
+        sample = embeddings
+        if len(embeddings) > sample_size:
+            sample = embeddings[np.sort(rng.choice(len(embeddings), size=sample_size, replace=False))]
+        sample = np.asarray(sample, dtype=np.float32).reshape(len(sample), n_subspaces, -1)
+
+        n_centroids = min(PQ_CENTROIDS, len(sample))
+        codebooks = np.stack([kmeans(sample[:, j], n_centroids, iterations, seed + j) for j in range(n_subspaces)])
+        quantizer = cls(codebooks.astype(np.float32), np.empty((0, n_subspaces), dtype=np.uint8))
+        quantizer.codes = quantizer.encode(embeddings)
+        return quantizer
+
+    def encode(self, embeddings: np.ndarray, block_size=EMBEDDING_SCORE_BLOCK_SIZE) -> np.ndarray:
+        codes = np.empty((len(embeddings), self.n_subspaces), dtype=np.uint8)
+        for start in range(0, len(embeddings), block_size):
+            block = np.asarray(embeddings[start:start + block_size], dtype=np.float32)
+            block = block.reshape(len(block), self.n_subspaces, -1)
+            for j in range(self.n_subspaces):
+                codes[start:start + block_size, j] = nearest_centroids(block[:, j], self.codebooks[j])
+        return codes
+
+    def score(self, query_embedding: np.ndarray, rows: np.ndarray | None = None) -> np.ndarray:
+        # Asymmetric distance computation: the query stays exact and every
+        # stored vector's inner product is a sum of per-subspace lookups.
+        table = np.einsum("jkd,jd->jk", self.codebooks, query_embedding.reshape(self.n_subspaces, -1)).astype(np.float32)
+        codes = self.codes if rows is None else self.codes[rows]
+
+        scores = np.zeros(len(codes), dtype=np.float32)
+        for j in range(self.n_subspaces):
+            scores += table[j].take(codes[:, j])
+        return scores
+
+    def save(self, path: str, source_stamp: tuple):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(
+                f,
+                version=PQ_FORMAT_VERSION,
+                source_stamp=np.array(source_stamp, dtype=np.int64),
+                codebooks=self.codebooks,
+                codes=self.codes,
+            )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> tuple["ProductQuantizer", tuple]:
+        with np.load(path) as data:
+            if int(data["version"]) != PQ_FORMAT_VERSION:
+                raise ValueError(f"Unsupported quantized embeddings version in {path}")
+            quantizer = cls(data["codebooks"], data["codes"])
+            return quantizer, tuple(data["source_stamp"].tolist())
+
+
+def load_or_train_quantizer(path: str, embeddings_path: str, embeddings: np.ndarray, n_subspaces=DEFAULT_PQ_SUBSPACES) -> ProductQuantizer:
+    source_stamp = file_stamp(embeddings_path)
+    if os.path.exists(path):
+        try:
+            quantizer, stamp = ProductQuantizer.load(path)
+            if stamp == source_stamp and quantizer.n_subspaces == n_subspaces:
+                return quantizer
+        except ValueError:
+            pass
+
+    quantizer = ProductQuantizer.train(embeddings, n_subspaces)
+    quantizer.save(path, source_stamp)
+    return quantizer
+
+
+def quantization_report(embeddings: np.ndarray, quantizer: ProductQuantizer, k: int, rerank_depths: list[int], n_queries=200, seed=0) -> list[dict]:
+    rng = np.random.default_rng(seed)
+    pairs = rng.choice(len(embeddings), size=(n_queries, 2))
+    queries = np.asarray(embeddings[pairs[:, 0]], dtype=np.float32) + np.asarray(embeddings[pairs[:, 1]], dtype=np.float32)
+    queries /= np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+
+    dense = np.asarray(embeddings, dtype=np.float32)
+    exact = []
+    start = time.perf_counter()
+    for query in queries:
+        exact.append(set(top_k_indices(dense @ query, k).tolist()))
+    exact_seconds = (time.perf_counter() - start) / n_queries
+
+    report = [{"rerank": None, "recall": 1.0, "ms_per_query": exact_seconds * 1000}]
+    for depth in rerank_depths:
+        hits = 0
+        start = time.perf_counter()
+        for query, truth in zip(queries, exact):
+            candidates = top_k_indices(quantizer.score(query), max(depth, k))
+            if depth > 0:
+                candidates = np.sort(candidates)
+                candidates = candidates[top_k_indices(dense[candidates] @ query, k)]
+            hits += len(truth.intersection(candidates[:k].tolist()))
+        seconds = (time.perf_counter() - start) / n_queries
+        report.append({
+            "rerank": depth,
+            "recall": hits / (n_queries * min(k, len(embeddings))),
+            "ms_per_query": seconds * 1000,
+        })
+    return report
@@ -0,0 +1,137 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+import numpy as np
+
+from .search_utils import (
+    QUERY_CACHE_PATH,
+    QUERY_CACHE_MEMORY_SIZE,
+    QUERY_CACHE_DISK_SIZE,
+)
+
+
+def normalize_query(query: str) -> str:
+    return " ".join(unicodedata.normalize("NFC", query).split())
+
+
+class QueryEmbeddingCache:
+    def __init__(self, path=QUERY_CACHE_PATH, memory_size=QUERY_CACHE_MEMORY_SIZE, disk_size=QUERY_CACHE_DISK_SIZE) -> None:
+        self.path = path
+        self.memory_size = memory_size
+        self.disk_size = disk_size
+        self.memory: OrderedDict[str, np.ndarray] = OrderedDict()
+        self.hits = 0
+        self.memory_hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.__connection = None
+
+    def __connect(self) -> sqlite3.Connection:
+        if self.__connection is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self.__connection = sqlite3.connect(self.path, check_same_thread=False)
+            self.__connection.execute(
+                "CREATE TABLE IF NOT EXISTS query_embeddings ("
+                "key TEXT PRIMARY KEY, model TEXT, query TEXT, dtype TEXT, embedding BLOB, last_used REAL)"
+            )
+            self.__connection.execute("CREATE INDEX IF NOT EXISTS query_embeddings_last_used ON query_embeddings (last_used)")
+        return self.__connection
+
+    @staticmethod
+    def key(model_name: str, query: str) -> str:
+        return hashlib.sha1(f"{model_name}\0{normalize_query(query)}".encode()).hexdigest()
+
+    def get(self, model_name: str, query: str) -> np.ndarray | None:
+        key = self.key(model_name, query)
+        with self.lock:
+            embedding = self.memory.get(key)
+            if embedding is not None:
+                self.memory.move_to_end(key)
+                self.hits += 1
+                self.memory_hits += 1
+                return embedding
+
+            if self.disk_size > 0:
+                connection = self.__connect()
+                row = connection.execute("SELECT dtype, embedding FROM query_embeddings WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    connection.execute("UPDATE query_embeddings SET last_used = ? WHERE key = ?", (time.time(), key))
+                    connection.commit()
+                    embedding = np.frombuffer(row[1], dtype=np.dtype(row[0]))
+                    self.__remember(key, embedding)
+                    self.hits += 1
+                    return embedding
+
+            self.misses += 1
+            return None
+
+    def put(self, model_name: str, query: str, embedding: np.ndarray) -> None:
+        key = self.key(model_name, query)
+        embedding = np.array(embedding, copy=True)
+        embedding.flags.writeable = False
+        with self.lock:
+            self.__remember(key, embedding)
+            if self.disk_size <= 0:
+                return
+
+            connection = self.__connect()
+            connection.execute(
+                "INSERT OR REPLACE INTO query_embeddings VALUES (?, ?, ?, ?, ?, ?)",
+                (key, model_name, normalize_query(query), embedding.dtype.str, embedding.tobytes(), time.time()),
+            )
+            connection.execute(
+                "DELETE FROM query_embeddings WHERE key IN ("
+                "SELECT key FROM query_embeddings ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (self.disk_size,),
+            )
+            connection.commit()
+
+    def __remember(self, key: str, embedding: np.ndarray) -> None:
+        if self.memory_size <= 0:
+            return
+        self.memory[key] = embedding
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.memory_size:
+            self.memory.popitem(last=False)
+
+    def get_or_compute(self, model_name: str, query: str, compute) -> np.ndarray:
+        embedding = self.get(model_name, query)
+        if embedding is None:
+            embedding = compute(query)
+            self.put(model_name, query, embedding)
+        return embedding
+
+    def clear(self) -> None:
+        with self.lock:
+            self.memory.clear()
+            if os.path.exists(self.path):
+                connection = self.__connect()
+                connection.execute("DELETE FROM query_embeddings")
+                connection.commit()
+
+    def stats(self) -> dict:
+        with self.lock:
+            disk_entries = 0
+            if self.disk_size > 0 and os.path.exists(self.path):
+                disk_entries = self.__connect().execute("SELECT COUNT(*) FROM query_embeddings").fetchone()[0]
+            return {
+                "hits": self.hits,
+                "memory_hits": self.memory_hits,
+                "misses": self.misses,
+                "memory_entries": len(self.memory),
+                "disk_entries": disk_entries,
+            }
+
+
+_query_cache: QueryEmbeddingCache | None = None
+
+def get_query_cache() -> QueryEmbeddingCache:
+    global _query_cache
+    if _query_cache is None:
+        _query_cache = QueryEmbeddingCache()
+    return _query_cache
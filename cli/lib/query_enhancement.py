@@ -0,0 +1,221 @@
+import asyncio
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+from .query_cache import normalize_query
+from .tracing import span
+from .search_utils import (
+    DEFAULT_ENHANCEMENT_TIMEOUT,
+    ENHANCEMENT_CACHE_DISK_SIZE,
+    ENHANCEMENT_CACHE_PATH,
+    ENHANCEMENT_MAX_CONCURRENCY,
+    ENHANCEMENT_MIN_INTERVAL,
+    ENHANCEMENT_MODEL,
+)
+
+ENHANCEMENT_METHODS = ("spell", "rewrite")
+
+
+def enhancement_prompt(method: str, query: str) -> str | None:
+    match method:
+        case "spell":
+            return f"""Fix any spelling errors in this movie search query.
+
+            Only correct obvious typos. Don't change correctly spelled words.
+            
+            Query: "{query}"
+            
+            If no errors, return the original query.
+            """
+        case "rewrite":
+            return f"""Rewrite this movie search query to be more specific and searchable.
+            
+            Original: "{query}"
+            
+            Consider:
+            - Common movie knowledge (famous actors, popular films)
+            - Genre conventions (horror = scary, animation = cartoon)
+            - Keep it concise (under 10 words)
+            - It should be a google style search query that's very specific
+            - Don't use boolean logic
+            
+            Examples:
+            - "that bear movie where leo gets attacked" -> "The Revenant Leonardo DiCaprio bear attack"
+            - "movie about bear in london with marmalade" -> "Paddington London marmalade"
+            - "scary movie with bear from few years ago" -> "bear horror movie 2015-2020"
+            """
+        case _:
+            return None
+
+
+class EnhancementCache:
+    # Persistent LLM enhancements keyed by (model, method, query), so a
+    # repeated --enhance query costs a SQLite lookup instead of a round trip.
+    def __init__(self, path=ENHANCEMENT_CACHE_PATH, disk_size=ENHANCEMENT_CACHE_DISK_SIZE) -> None:
+        self.path = path
+        self.disk_size = disk_size
+        self.memory: dict[str, str] = {}
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.__connection = None
+
+    def __connect(self) -> sqlite3.Connection:
+        if self.__connection is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self.__connection = sqlite3.connect(self.path, check_same_thread=False)
+            self.__connection.execute(
+                "CREATE TABLE IF NOT EXISTS query_enhancements ("
+                "key TEXT PRIMARY KEY, model TEXT, method TEXT, query TEXT, enhanced TEXT, last_used REAL)"
+            )
+            self.__connection.execute("CREATE INDEX IF NOT EXISTS query_enhancements_last_used ON query_enhancements (last_used)")
+        return self.__connection
+
+    @staticmethod
+    def key(model: str, method: str, query: str) -> str:
+        return hashlib.sha1(f"{model}\0{method}\0{normalize_query(query)}".encode()).hexdigest()
+
+    def get(self, model: str, method: str, query: str) -> str | None:
+        key = self.key(model, method, query)
+        with self.lock:
+            enhanced = self.memory.get(key)
+            if enhanced is None and self.disk_size > 0 and os.path.exists(self.path):
+                connection = self.__connect()
+                row = connection.execute("SELECT enhanced FROM query_enhancements WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    connection.execute("UPDATE query_enhancements SET last_used = ? WHERE key = ?", (time.time(), key))
+                    connection.commit()
+                    enhanced = self.memory[key] = row[0]
+
+            if enhanced is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return enhanced
+
+    def put(self, model: str, method: str, query: str, enhanced: str) -> None:
+        key = self.key(model, method, query)
+        with self.lock:
+            self.memory[key] = enhanced
+            if self.disk_size <= 0:
+                return
+
+            connection = self.__connect()
+            connection.execute(
+                "INSERT OR REPLACE INTO query_enhancements VALUES (?, ?, ?, ?, ?, ?)",
+                (key, model, method, normalize_query(query), enhanced, time.time()),
+            )
+            connection.execute(
+                "DELETE FROM query_enhancements WHERE key IN ("
+                "SELECT key FROM query_enhancements ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (self.disk_size,),
+            )
+            connection.commit()
+
+    def clear(self) -> None:
+        with self.lock:
+            self.memory.clear()
+            if os.path.exists(self.path):
+                connection = self.__connect()
+                connection.execute("DELETE FROM query_enhancements")
+                connection.commit()
+
+
+class RateLimiter:
+    # Caps concurrent LLM requests and spaces their starts at least
+    # `min_interval` seconds apart. Bound to the event loop it is first
+    # used on, and rebuilt when a later asyncio.run() brings a new one.
+    def __init__(self, max_concurrency=ENHANCEMENT_MAX_CONCURRENCY, min_interval=ENHANCEMENT_MIN_INTERVAL) -> None:
+        self.max_concurrency = max_concurrency
+        self.min_interval = min_interval
+        self.next_start = 0.0
+        self.__loop = None
+        self.__semaphore = None
+        self.__lock = None
+
+    def __bind(self):
+        loop = asyncio.get_running_loop()
+        if loop is not self.__loop:
+            self.__loop = loop
+            self.__semaphore = asyncio.Semaphore(self.max_concurrency)
+            self.__lock = asyncio.Lock()
+
+    async def __aenter__(self):
+        self.__bind()
+        await self.__semaphore.acquire()
+        async with self.__lock:
+            delay = self.next_start - time.monotonic()
+            self.next_start = max(self.next_start, time.monotonic()) + self.min_interval
+        if delay > 0:
+            await asyncio.sleep(delay)
+        return self
+
+    async def __aexit__(self, *exc):
+        self.__semaphore.release()
+        return False
+
+
+class QueryEnhancer:
+    # Spell-fixes or rewrites queries with an LLM. The client is created
+    # once and reused, results are cached persistently, and a request that
+    # fails or exceeds `timeout` seconds falls back to the original query.
+    def __init__(self, client=None, model=ENHANCEMENT_MODEL, cache: EnhancementCache | None = None, timeout=DEFAULT_ENHANCEMENT_TIMEOUT, rate_limiter: RateLimiter | None = None) -> None:
+        self.__client = client
+        self.model = model
+        self.cache = EnhancementCache() if cache is None else cache
+        self.timeout = timeout
+        self.rate_limiter = RateLimiter() if rate_limiter is None else rate_limiter
+        self.fallbacks = 0
+
+    async def get_client(self):
+        # Importing google.genai and building the client block, so the first
+        # request does that on a worker thread, inside its timeout, instead
+        # of stalling the event loop.
+        if self.__client is None:
+            client = await asyncio.to_thread(create_genai_client)
+            if self.__client is None:
+                self.__client = client
+        return self.__client
+
+    async def enhance(self, method: str, query: str) -> str:
+        prompt = enhancement_prompt(method, query)
+        if prompt is None:
+            return query
+
+        with span("enhance.query", method=method) as trace:
+            enhanced = self.cache.get(self.model, method, query)
+            trace.set(cached=enhanced is not None)
+            if enhanced is not None:
+                return enhanced
+
+            try:
+                enhanced = await asyncio.wait_for(self.__generate(prompt), self.timeout)
+            except Exception as e:
+                # Timeouts and API errors degrade to the unenhanced query and
+                # are not cached, so a later run can still succeed.
+                self.fallbacks += 1
+                trace.set(fallback=type(e).__name__)
+                return query
+
+            if enhanced is None:
+                return query
+            self.cache.put(self.model, method, query, enhanced)
+            return enhanced
+
+    async def __generate(self, prompt: str) -> str | None:
+        client = await self.get_client()
+        async with self.rate_limiter:
+            with span("llm.generate", model=self.model):
+                response = await client.aio.models.generate_content(model=self.model, contents=prompt)
+        return response.text
+
+
+def create_genai_client():
+    from dotenv import load_dotenv
+    from google import genai
+
+    load_dotenv()
+    return genai.Client(api_key=os.environ.get("GEMINI_API_KEY"))
@@ -0,0 +1,19 @@
+import json
+import urllib.error
+import urllib.request
+
+from .search_utils import SEARCH_SERVER_TIMEOUT
+from .tracing import span
+
+
+def search_remote(server_url: str, command: str, timeout=SEARCH_SERVER_TIMEOUT, **params) -> list:
+    request = urllib.request.Request(
+        f"{server_url.rstrip('/')}/{command}",
+        data=json.dumps(params).encode(),
+        headers={"Content-Type": "application/json"},
+    )
+    try:
+        with span("client.request", command=command), urllib.request.urlopen(request, timeout=timeout) as response:
+            return json.loads(response.read())["results"]
+    except urllib.error.HTTPError as e:
+        raise RuntimeError(f"Search server error: {json.loads(e.read()).get('error', e.reason)}") from e
@@ -0,0 +1,132 @@
+import json
+import traceback
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from .catalog import Catalog, load_catalog
+from .hybrid_search import HybridSearch
+from .tracing import MetricsSink, span, start_tracing, stop_tracing
+from .search_utils import (
+    to_json,
+    DEFAULT_ANN_NPROBE,
+    DEFAULT_PQ_RERANK,
+    DEFAULT_EMBEDDING_DTYPE,
+    DEFAULT_HYBRID_SEARCH_ALPHA,
+    DEFAULT_HYBRID_SEARCH_LIMIT,
+    DEFAULT_SEARCH_CHUNK_LIMIT,
+    DEFAULT_SEARCH_LIMIT,
+    HYBRID_SEARCH_THREADS,
+    SEARCH_SERVER_HOST,
+    SEARCH_SERVER_PORT,
+)
+
+
+class SearchService:
+    commands = ("bm25search", "search", "search_chunked", "weighted-search", "rrf-search")
+
+    def __init__(self, documents: list[dict] | Catalog, mmap=False, embedding_dtype=DEFAULT_EMBEDDING_DTYPE, ann=False, nprobe=DEFAULT_ANN_NPROBE, quantized=False, rerank=DEFAULT_PQ_RERANK, sharded=False, threads=HYBRID_SEARCH_THREADS, leg_timeout=None) -> None:
+        self.hybrid_search = HybridSearch(documents, mmap, embedding_dtype, ann, nprobe, quantized, rerank, sharded, threads=threads, leg_timeout=leg_timeout)
+        self.hybrid_search.current_index()
+        self.semantic_search = self.hybrid_search.semantic_search
+
+    def warm_up(self):
+        self.semantic_search.generate_embedding("warm up")
+
+    def handle(self, command: str, params: dict) -> list:
+        with span(command):
+            return self.__handle(command, params)
+
+    def __handle(self, command: str, params: dict) -> list:
+        query = params["query"]
+        match command:
+            case "bm25search":
+                return self.hybrid_search.current_index().bm25_search(query, params.get("limit", DEFAULT_SEARCH_LIMIT), prune=params.get("prune", False))
+            case "search":
+                return self.semantic_search.search(query, params.get("limit", DEFAULT_SEARCH_LIMIT))
+            case "search_chunked":
+                return self.semantic_search.search_chunks(query, params.get("limit", DEFAULT_SEARCH_CHUNK_LIMIT))
+            case "weighted-search":
+                alpha = params.get("alpha", DEFAULT_HYBRID_SEARCH_ALPHA)
+                return self.hybrid_search.weighted_search(query, alpha, params.get("limit", DEFAULT_HYBRID_SEARCH_LIMIT), params.get("depth"))
+            case "rrf-search":
+                return self.hybrid_search.rrf_search(query, params.get("k", 60), params.get("limit", DEFAULT_HYBRID_SEARCH_LIMIT), params.get("depth"))
+            case _:
+                raise KeyError(command)
+
+
+class SearchRequestHandler(BaseHTTPRequestHandler):
+    server: "SearchServer"
+
+    def do_GET(self):
+        if self.path == "/health":
+            self.__respond(200, {"status": "ok"})
+        elif self.path == "/metrics" and self.server.metrics is not None:
+            self.__respond(200, {"stages": self.server.metrics.snapshot()})
+        else:
+            self.__respond(404, {"error": f"Unknown path {self.path}"})
+
+    def do_POST(self):
+        command = self.path.strip("/")
+        if command not in self.server.service.commands:
+            self.__respond(404, {"error": f"Unknown command {command}"})
+            return
+
+        try:
+            params = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            results = self.server.service.handle(command, params)
+        except KeyError as e:
+            self.__respond(400, {"error": f"Missing or unknown field: {e}"})
+        except (ValueError, TypeError) as e:
+            self.__respond(400, {"error": str(e)})
+        except TimeoutError as e:
+            self.__respond(504, {"error": str(e)})
+        except Exception as e:
+            # Anything else is a server fault: log it, but still answer so
+            # the client is not left waiting on a dead handler.
+            traceback.print_exc()
+            self.__respond(500, {"error": f"Internal server error: {type(e).__name__}: {e}"})
+        else:
+            self.__respond(200, {"results": results})
+
+    def __respond(self, status: int, body: dict):
+        data = json.dumps(body, default=to_json).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+class SearchServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, service: SearchService, host=SEARCH_SERVER_HOST, port=SEARCH_SERVER_PORT, verbose=False, metrics: MetricsSink | None = None) -> None:
+        super().__init__((host, port), SearchRequestHandler)
+        self.service = service
+        self.verbose = verbose
+        # Per-stage counters and latency histograms served on /metrics.
+        self.metrics = metrics
+
+
+def serve_command(host=SEARCH_SERVER_HOST, port=SEARCH_SERVER_PORT, mmap=False, embedding_dtype=DEFAULT_EMBEDDING_DTYPE, verbose=False, ann=False, nprobe=DEFAULT_ANN_NPROBE, quantized=False, rerank=DEFAULT_PQ_RERANK, sharded=False, profile=False, threads=HYBRID_SEARCH_THREADS, leg_timeout=None):
+    metrics = None
+    if profile:
+        metrics = MetricsSink()
+        start_tracing(metrics)
+
+    service = SearchService(load_catalog(), mmap, embedding_dtype, ann, nprobe, quantized, rerank, sharded, threads, leg_timeout)
+    service.warm_up()
+
+    server = SearchServer(service, host, port, verbose, metrics)
+    print(f"Serving search on http://{host}:{server.server_port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.hybrid_search.close()
+        stop_tracing()
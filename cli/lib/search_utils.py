@@ -1,17 +1,26 @@
 import json
 import os
 import string
-from nltk.stem import PorterStemmer
+from functools import lru_cache
+
+import numpy as np
 
 DEFAULT_SEARCH_LIMIT = 5
 
 PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
-DATA_PATH = os.path.join(PROJECT_ROOT, "data", "movies.json")
+# SEARCH_DATA_PATH and SEARCH_CACHE_DIR point the CLIs at another catalog and
+# cache, e.g. the synthetic catalogs of the benchmark suite.
+DATA_PATH = os.environ.get("SEARCH_DATA_PATH") or os.path.join(PROJECT_ROOT, "data", "movies.json")
 STOPWORDS_PATH = os.path.join(PROJECT_ROOT, "data", "stopwords.txt")
-CACHE_DIR = os.path.join(PROJECT_ROOT, "cache")
+CACHE_DIR = os.environ.get("SEARCH_CACHE_DIR") or os.path.join(PROJECT_ROOT, "cache")
 
 BM25_K1 = 1.5
 BM25_B = 0.75
+# Documents per block for block-max pruning of BM25 top-k queries.
+BM25_BLOCK_SIZE = 128
+# Precomputed BM25 tf components (default k1/b) are quantized to this many
+# levels over [0, k1 + 1) and stored as uint16.
+BM25_IMPACT_LEVELS = 65535
 
 DEFAULT_CHUNK_SIZE = 200
 DEFAULT_CHUNK_OVERLAP = 0
@@ -19,16 +28,83 @@ DEFAULT_CHUNK_OVERLAP = 0
 DEFAULT_SEMANTIC_CHUNK_SIZE = 4
 DEFAULT_SEMANTIC_CHUNK_OVERLAP = 1
 
+# Chunks encoded (and checkpointed) per batch, documents chunked per pool
+# round, and documents handed to a chunking worker at a time.
+CHUNK_EMBEDDING_BATCH_SIZE = 256
+CHUNK_BUILD_WINDOW = 4096
+CHUNK_POOL_CHUNKSIZE = 64
+
+INDEX_PATH = os.path.join(CACHE_DIR, "index.bin")
+SHARDED_INDEX_DIR = os.path.join(CACHE_DIR, "index_shards")
+DEFAULT_INDEX_SHARDS = 4
+
 MOVIE_EMBEDDINGS_PATH = os.path.join(CACHE_DIR, "movie_embeddings.npy")
 CHUNK_EMBEDDINGS_PATH = os.path.join(CACHE_DIR, "chunk_embeddings.npy")
-CHUNK_METADATA_PATH = os.path.join(CACHE_DIR, "chunk_metadata.json")
+CHUNK_METADATA_PATH = os.path.join(CACHE_DIR, "chunk_metadata.npy")
+LEGACY_CHUNK_METADATA_PATH = os.path.join(CACHE_DIR, "chunk_metadata.json")
+MOVIE_EMBEDDINGS_STATE_PATH = os.path.join(CACHE_DIR, "movie_embeddings_state.npy")
+CHUNK_EMBEDDINGS_STATE_PATH = os.path.join(CACHE_DIR, "chunk_embeddings_state.npy")
+CHUNK_EMBEDDINGS_PARTIAL_PATH = os.path.join(CACHE_DIR, "chunk_embeddings.partial.npy")
+CHUNK_BUILD_CHECKPOINT_PATH = os.path.join(CACHE_DIR, "chunk_embeddings_checkpoint.json")
+MOVIE_ANN_INDEX_PATH = os.path.join(CACHE_DIR, "movie_embeddings_ivf.npz")
+CHUNK_ANN_INDEX_PATH = os.path.join(CACHE_DIR, "chunk_embeddings_ivf.npz")
+
+DEFAULT_ANN_NPROBE = 8
+ANN_KMEANS_ITERATIONS = 10
+ANN_KMEANS_SAMPLE_SIZE = 50_000
+
+MOVIE_PQ_PATH = os.path.join(CACHE_DIR, "movie_embeddings_pq.npz")
+CHUNK_PQ_PATH = os.path.join(CACHE_DIR, "chunk_embeddings_pq.npz")
+
+# 48 one-byte codes per 384-dim vector: 32x smaller than float32.
+DEFAULT_PQ_SUBSPACES = 48
+DEFAULT_PQ_RERANK = 100
+PQ_CENTROIDS = 256
+PQ_KMEANS_ITERATIONS = 10
+PQ_KMEANS_SAMPLE_SIZE = 20_000
+
+# What the embedding caches were last validated against, see CacheManifest.
+CACHE_MANIFEST_PATH = os.path.join(CACHE_DIR, "cache_manifest.json")
+
+QUERY_CACHE_PATH = os.path.join(CACHE_DIR, "query_embeddings.sqlite3")
+QUERY_CACHE_MEMORY_SIZE = 1024
+QUERY_CACHE_DISK_SIZE = 100_000
+
+SEARCH_SERVER_HOST = "127.0.0.1"
+SEARCH_SERVER_PORT = 8765
+SEARCH_SERVER_TIMEOUT = 30
+
+ENHANCEMENT_MODEL = "gemini-2.5-flash"
+ENHANCEMENT_CACHE_PATH = os.path.join(CACHE_DIR, "query_enhancements.sqlite3")
+ENHANCEMENT_CACHE_DISK_SIZE = 100_000
+# Seconds an LLM query enhancement may take before the original query is
+# searched instead.
+DEFAULT_ENHANCEMENT_TIMEOUT = 5.0
+ENHANCEMENT_MAX_CONCURRENCY = 4
+# Minimum seconds between the starts of two LLM requests.
+ENHANCEMENT_MIN_INTERVAL = 0.1
+
+EMBEDDING_DTYPES = ("float32", "float16")
+DEFAULT_EMBEDDING_DTYPE = "float32"
+EMBEDDING_SCORE_BLOCK_SIZE = 4096
+# Queries encoded and scored together by the batch search APIs.
+BATCH_QUERY_BLOCK_SIZE = 256
 
 DEFAULT_SEARCH_CHUNK_LIMIT = 5
 
 DEFAULT_HYBRID_SEARCH_ALPHA = 0.5
 DEFAULT_HYBRID_SEARCH_LIMIT = 5
+# Candidates taken from each leg per result when no depth is given.
+HYBRID_CANDIDATE_MULTIPLIER = 500
+# Threads running a hybrid query's BM25 and semantic legs concurrently.
+HYBRID_SEARCH_THREADS = 2
+
+# Upper bounds (ms) of the latency histogram buckets kept per traced stage.
+TRACE_HISTOGRAM_BOUNDS_MS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
 
-stemmer = PorterStemmer()
+STEM_CACHE_SIZE = 50_000
+
+PUNCTUATION_TABLE = str.maketrans("", "", string.punctuation)
 
 def load_movies() -> list[dict]:
     with open(DATA_PATH, "r") as f:
@@ -40,6 +116,19 @@ def load_stopwords() -> list[str]:
         data = f.read().splitlines()
     return data
 
+def file_stamp(path: str) -> tuple | None:
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+def to_json(value):
+    # json.dumps default= hook for the NumPy scalars search results carry.
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
 def print_search_results(search_results: list[dict]):
     for i in range(len(search_results)):
         print(f"{i + 1}. {search_results[i]["id"]} {search_results[i]["title"]}")
@@ -47,27 +136,39 @@ def print_search_results(search_results: list[dict]):
 def preprocess_text(text: str) -> str:
     text = text.lower()
     # text = ''.join([c for c in text if c not in string.punctuation])
-    text = text.translate(str.maketrans("", "", string.punctuation))
+    text = text.translate(PUNCTUATION_TABLE)
     # tokens = [token.strip() for token in text.split(" ") if len(token.strip()) > 0]
     return text
 
+class Tokenizer:
+    def __init__(self, stopwords: list[str] | None = None, stem_cache_size: int = STEM_CACHE_SIZE) -> None:
+        if stopwords is None:
+            stopwords = load_stopwords()
+        self.stopwords = frozenset(stopwords)
+
+        from nltk.stem import PorterStemmer
+        self.stemmer = PorterStemmer()
+        self.stem = lru_cache(maxsize=stem_cache_size)(self.stemmer.stem)
+
+    def tokenize(self, text: str) -> list[str]:
+        stopwords = self.stopwords
+        stem = self.stem
+        return [stem(word) for word in preprocess_text(text).split() if word not in stopwords]
+
+    def tokenize_many(self, texts) -> list[list[str]]:
+        return [self.tokenize(text) for text in texts]
+
+
+_tokenizer: Tokenizer | None = None
+
+def get_tokenizer() -> Tokenizer:
+    global _tokenizer
+    if _tokenizer is None:
+        _tokenizer = Tokenizer()
+    return _tokenizer
+
 def tokenize_text(text: str) -> list[str]:
-    text = preprocess_text(text)
-    tokens = text.split()
-    valid_tokens = []
-    for token in tokens:
-        if token:
-            valid_tokens.append(token)
-    stop_words = load_stopwords()
-    filtered_words = []
-    for word in valid_tokens:
-        if word not in stop_words:
-            filtered_words.append(word)
-    stemmer = PorterStemmer()
-    stemmed_words = []
-    for word in filtered_words:
-        stemmed_words.append(stemmer.stem(word))
-    return stemmed_words
+    return get_tokenizer().tokenize(text)
 
 def has_matching_token(query_tokens: list[str], title_tokens: list[str]) -> bool:
     for qt in query_tokens:
@@ -76,3 +177,18 @@ def has_matching_token(query_tokens: list[str], title_tokens: list[str]) -> bool
                 return True
     
     return False
+
+def top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    n = len(scores)
+    if k <= 0 or n == 0:
+        return np.empty(0, dtype=np.intp)
+    if k < n:
+        # Ties at the cut-off go to the lowest indices, so the selection does
+        # not depend on how argpartition happens to order equal scores.
+        kth = scores[np.argpartition(scores, n - k)[n - k]]
+        above = np.flatnonzero(scores > kth)
+        indices = np.concatenate([above, np.flatnonzero(scores == kth)[:k - len(above)]])
+        indices.sort()
+    else:
+        indices = np.arange(n)
+    return indices[np.argsort(-scores[indices], kind="stable")]
@@ -1,13 +1,12 @@
-from sentence_transformers import SentenceTransformer
 import numpy as np
 import os
 import json
 import textwrap
+import threading
 import re
+from concurrent.futures import ProcessPoolExecutor
 
 from .search_utils import (
-    CACHE_DIR, 
-    DATA_PATH, 
     DEFAULT_SEARCH_LIMIT, 
     DEFAULT_CHUNK_SIZE,
     DEFAULT_CHUNK_OVERLAP,
@@ -15,67 +14,259 @@ from .search_utils import (
     DEFAULT_SEMANTIC_CHUNK_OVERLAP,
     CHUNK_EMBEDDINGS_PATH,
     CHUNK_METADATA_PATH,
+    LEGACY_CHUNK_METADATA_PATH,
     MOVIE_EMBEDDINGS_PATH,
+    MOVIE_EMBEDDINGS_STATE_PATH,
+    CHUNK_EMBEDDINGS_STATE_PATH,
+    CHUNK_EMBEDDINGS_PARTIAL_PATH,
+    CHUNK_BUILD_CHECKPOINT_PATH,
+    CHUNK_EMBEDDING_BATCH_SIZE,
+    CHUNK_BUILD_WINDOW,
+    CHUNK_POOL_CHUNKSIZE,
+    MOVIE_ANN_INDEX_PATH,
+    CHUNK_ANN_INDEX_PATH,
+    MOVIE_PQ_PATH,
+    CHUNK_PQ_PATH,
+    DEFAULT_ANN_NPROBE,
+    DEFAULT_PQ_RERANK,
+    DEFAULT_PQ_SUBSPACES,
+    DEFAULT_EMBEDDING_DTYPE,
+    EMBEDDING_SCORE_BLOCK_SIZE,
+    BATCH_QUERY_BLOCK_SIZE,
+    file_stamp,
+    top_k_indices,
 )
+from .ann_index import IVFIndex, ann_recall_report, load_or_build_ivf_index
+from .quantization import ProductQuantizer, load_or_train_quantizer, quantization_report
+from .catalog import CacheManifest, CatalogDiff, as_catalog, catalog_fingerprint, load_catalog, load_catalog_state, save_catalog_state
+from .query_cache import get_query_cache
+from .search_client import search_remote
+from .tracing import span
+
+CHUNK_METADATA_DTYPE = np.dtype([("movie_idx", "<i4"), ("chunk_idx", "<i4"), ("total_chunks", "<i4")])
+# The embedding caches are always stored at full precision; other
+# --embedding-dtype values load a converted copy, see load_embeddings().
+EMBEDDING_CACHE_DTYPE = np.dtype(np.float32)
 
 class SemanticSearch:
-    def __init__(self, model_name = "all-MiniLM-L6-v2")->None:
-        self.model = SentenceTransformer(model_name)
+    def __init__(self, model_name = "all-MiniLM-L6-v2", mmap=False, embedding_dtype=DEFAULT_EMBEDDING_DTYPE, cache_queries=True, ann=False, nprobe=DEFAULT_ANN_NPROBE, quantized=False, rerank=DEFAULT_PQ_RERANK, model=None)->None:
+        self.model_name = model_name
+        # `model` may be any object with a SentenceTransformer-style
+        # encode(), such as the offline encoder used by the benchmarks.
+        self.__model = model
+        self.__model_lock = threading.Lock()
+        self.query_cache = get_query_cache() if cache_queries else None
         self.embeddings = None
         self.documents = None
         self.document_map = {}
-        self.embeddings_path = os.path.join(CACHE_DIR, "movie_embeddings.npy")
+        self.embeddings_path = MOVIE_EMBEDDINGS_PATH
+        self.embeddings_state_path = MOVIE_EMBEDDINGS_STATE_PATH
+        # Quantized search only re-ranks a few rows exactly, so the float
+        # originals stay mapped instead of resident.
+        self.mmap = mmap or quantized
+        self.embedding_dtype = np.dtype(embedding_dtype)
+        self.ann = ann
+        self.nprobe = nprobe
+        self.ann_index_path = MOVIE_ANN_INDEX_PATH
+        self.quantized = quantized
+        self.rerank = rerank
+        self.pq_path = MOVIE_PQ_PATH
+        self.derived_indexes: dict[str, tuple] = {}
     
+    @property
+    def model(self):
+        # sentence_transformers pulls in torch, so only import it once a
+        # query or document actually has to be encoded.
+        if self.__model is None:
+            with self.__model_lock:
+                if self.__model is None:
+                    with span("semantic.load_model", model=self.model_name):
+                        from sentence_transformers import SentenceTransformer
+                        self.__model = SentenceTransformer(self.model_name)
+        return self.__model
+
     def generate_embedding(self, text:str):
-        if len(text.strip()) == 0:
-            raise ValueError("Input text is empty")
-        
-        embedding = self.model.encode([text])
+        with span("semantic.embed_query"):
+            if len(text.strip()) == 0:
+                raise ValueError("Input text is empty")
+
+            if self.query_cache is None:
+                return self.__encode_query(text)
+            return self.query_cache.get_or_compute(self.model_name, text, self.__encode_query)
+
+    def __encode_query(self, text: str):
+        with span("semantic.encode", texts=1):
+            embedding = self.model.encode([text])
         return embedding[0]
 
+    def generate_embeddings(self, texts: list[str]) -> np.ndarray:
+        # Cached queries are reused and all others are encoded in a single
+        # model call.
+        with span("semantic.embed_queries", queries=len(texts)):
+            if any(len(text.strip()) == 0 for text in texts):
+                raise ValueError("Input text is empty")
+
+            embeddings = [None if self.query_cache is None else self.query_cache.get(self.model_name, text) for text in texts]
+            pending = {}
+            for text, embedding in zip(texts, embeddings):
+                if embedding is None:
+                    pending.setdefault(text, None)
+            if pending:
+                with span("semantic.encode", texts=len(pending)):
+                    encoded = self.model.encode(list(pending))
+                for text, embedding in zip(pending, encoded):
+                    pending[text] = embedding
+                    if self.query_cache is not None:
+                        self.query_cache.put(self.model_name, text, embedding)
+
+            return np.stack([pending[text] if embedding is None else embedding for text, embedding in zip(texts, embeddings)])
+
     def build_embeddings(self, documents):
-        self.documents = documents
-        sentences = []
-        for doc in documents:
-            self.document_map[doc['id']] = doc
-            sentences.append(f"{doc['title']}: {doc['description']}")
-
-        self.embeddings = self.model.encode(sentences, show_progress_bar=True)
-        with open(self.embeddings_path, 'wb') as f:
-            np.save(f, self.embeddings)
-        
+        catalog = as_catalog(documents)
+        self.documents = catalog.documents
+        self.document_map = catalog.document_map
+        sentences = [movie_embedding_text(doc) for doc in catalog.documents]
+
+        save_embeddings(self.embeddings_path, self.model.encode(sentences, show_progress_bar=True))
+        save_catalog_state(self.embeddings_state_path, catalog.state)
+        self.embeddings = load_embeddings(self.embeddings_path, self.mmap, self.embedding_dtype)
+
         return self.embeddings
 
-    def load_or_create_embeddings(self, documents):
-        self.documents = documents
-        for doc in documents:
-            self.document_map[doc['id']] = doc
+    def update_embeddings(self, documents, old_state=None) -> CatalogDiff:
+        catalog = as_catalog(documents)
+        documents = self.documents = catalog.documents
+        self.document_map = catalog.document_map
+        if old_state is None:
+            old_state = load_catalog_state(self.embeddings_state_path)
 
-        if os.path.exists(self.embeddings_path):
-            with open(self.embeddings_path, 'rb') as f:
-                self.embeddings = np.load(f)
-            if len(self.embeddings) == len(documents):
+        new_state = catalog.state
+        diff = CatalogDiff(old_state, new_state)
+        if not diff.unchanged or diff.reordered:
+            old_embeddings = load_embeddings(self.embeddings_path, True)
+            embeddings = np.empty((len(documents), old_embeddings.shape[1]), dtype=np.float32)
+
+            reused = diff.reused >= 0
+            embeddings[reused] = old_embeddings[diff.reused[reused]]
+            pending = np.flatnonzero(~reused)
+            if len(pending):
+                sentences = [movie_embedding_text(documents[i]) for i in pending]
+                embeddings[pending] = normalize_embeddings(self.model.encode(sentences, show_progress_bar=True))
+
+            save_embeddings(self.embeddings_path, embeddings)
+            save_catalog_state(self.embeddings_state_path, new_state)
+
+        self.embeddings = load_embeddings(self.embeddings_path, self.mmap, self.embedding_dtype)
+        return diff
+
+    def load_or_create_embeddings(self, documents):
+        with span("semantic.load_embeddings", mmap=self.mmap) as trace:
+            catalog = as_catalog(documents)
+            self.documents = catalog.documents
+            self.document_map = catalog.document_map
+
+            manifest = CacheManifest()
+            paths = [self.embeddings_path, self.embeddings_state_path]
+            if manifest.matches("movie_embeddings", catalog, self.model_name, paths):
+                trace.set(manifest=True)
+                self.embeddings = load_embeddings(self.embeddings_path, self.mmap, self.embedding_dtype, validate=False)
                 return self.embeddings
-            
-        return self.build_embeddings(documents)
-    
-    def search(self, query, limit=DEFAULT_SEARCH_LIMIT):
-        if self.embeddings is None:
-            raise ValueError("No embeddings loaded. Call `load_or_create_embeddings` first.")
-        
-        q_embedding = self.generate_embedding(query)
 
-        similarity_scores = []
-        for i in range(len(self.embeddings)):
-            embedding = self.embeddings[i]
-            document = self.documents[i]
-            score = cosine_similarity(q_embedding, embedding)
-            similarity_scores.append((score, document))
+            self.__load_or_create_embeddings(catalog)
+            manifest.record("movie_embeddings", catalog, self.model_name, paths)
+            return self.embeddings
 
-        similarity_scores = sorted(similarity_scores, key=lambda t: t[0], reverse=True)
-        
-        return similarity_scores[:limit]
+    def __load_or_create_embeddings(self, catalog):
+        if os.path.exists(self.embeddings_path):
+            old_state = load_catalog_state(self.embeddings_state_path)
+            if old_state is not None:
+                self.update_embeddings(catalog, old_state)
+                return
+
+            # Caches from before catalog states were recorded are trusted
+            # when the row count matches, and adopt the current catalog.
+            self.embeddings = load_embeddings(self.embeddings_path, self.mmap, self.embedding_dtype)
+            if len(self.embeddings) == len(catalog):
+                save_catalog_state(self.embeddings_state_path, catalog.state)
+                return
+
+        self.build_embeddings(catalog)
+    
+    def __get_derived_index(self, path: str, embeddings_path: str, load_or_build):
+        stamp = file_stamp(embeddings_path)
+        cached = self.derived_indexes.get(path)
+        if cached is None or cached[0] != stamp:
+            cached = (stamp, load_or_build())
+            self.derived_indexes[path] = cached
+        return cached[1]
+
+    def get_ann_index(self, index_path: str, embeddings_path: str, embeddings: np.ndarray) -> IVFIndex:
+        return self.__get_derived_index(index_path, embeddings_path, lambda: load_or_build_ivf_index(index_path, embeddings_path, embeddings))
+
+    def get_quantizer(self, pq_path: str, embeddings_path: str, embeddings: np.ndarray) -> ProductQuantizer:
+        return self.__get_derived_index(pq_path, embeddings_path, lambda: load_or_train_quantizer(pq_path, embeddings_path, embeddings))
+
+    def score_candidates(self, query_embedding, embeddings, embeddings_path, ann_index_path, pq_path, depth) -> tuple[np.ndarray | None, np.ndarray]:
+        # Returns the rows worth ranking and their exact scores; rows is None
+        # when every row was scored.
+        with span("semantic.score", ann=self.ann, pq=self.quantized) as trace:
+            rows = None
+            if self.ann:
+                rows = self.get_ann_index(ann_index_path, embeddings_path, embeddings).probe(query_embedding, self.nprobe)
+            if self.quantized:
+                approx_scores = self.get_quantizer(pq_path, embeddings_path, embeddings).score(query_embedding, rows)
+                best = top_k_indices(approx_scores, max(depth, self.rerank))
+                rows = np.sort(best if rows is None else rows[best])
+
+            trace.set(rows=len(embeddings) if rows is None else len(rows))
+            if rows is None:
+                return None, score_embeddings(embeddings, query_embedding)
+            return rows, score_embeddings(embeddings[rows], query_embedding)
+
+    def search_top_k(self, query, limit=DEFAULT_SEARCH_LIMIT) -> tuple[np.ndarray, np.ndarray]:
+        # Document positions of the best matches and their scores.
+        with span("semantic.search", limit=limit):
+            if self.embeddings is None:
+                raise ValueError("No embeddings loaded. Call `load_or_create_embeddings` first.")
+
+            q_embedding = normalize_embeddings(self.generate_embedding(query))
+            return self.__top_k(q_embedding, limit)
+
+    def __top_k(self, q_embedding, limit) -> tuple[np.ndarray, np.ndarray]:
+        rows, similarity_scores = self.score_candidates(q_embedding, self.embeddings, self.embeddings_path, self.ann_index_path, self.pq_path, limit)
+        best = top_k_indices(similarity_scores, limit)
+        return (best if rows is None else rows[best]), similarity_scores[best]
 
+    def search(self, query, limit=DEFAULT_SEARCH_LIMIT):
+        rows, scores = self.search_top_k(query, limit)
+        return [(score, self.documents[row]) for row, score in zip(rows, scores)]
+
+    def batch_search_top_k(self, queries: list[str], limit=DEFAULT_SEARCH_LIMIT, block_size=BATCH_QUERY_BLOCK_SIZE) -> list[tuple[np.ndarray, np.ndarray]]:
+        with span("semantic.batch_search", queries=len(queries), limit=limit):
+            if self.embeddings is None:
+                raise ValueError("No embeddings loaded. Call `load_or_create_embeddings` first.")
+
+            results = []
+            for start in range(0, len(queries), block_size):
+                query_embeddings = normalize_embeddings(self.generate_embeddings(queries[start:start + block_size]))
+                if self.ann or self.quantized:
+                    # Every query probes its own candidate rows, so they are
+                    # scored one by one.
+                    results.extend(self.__top_k(q_embedding, limit) for q_embedding in query_embeddings)
+                    continue
+
+                with span("semantic.score", queries=len(query_embeddings), rows=len(self.embeddings)):
+                    similarity_scores = score_embeddings(self.embeddings, query_embeddings.T)
+                for column in similarity_scores.T:
+                    best = top_k_indices(column, limit)
+                    results.append((best, column[best]))
+            return results
+
+    def batch_search(self, queries: list[str], limit=DEFAULT_SEARCH_LIMIT, block_size=BATCH_QUERY_BLOCK_SIZE) -> list[list[tuple]]:
+        return [
+            [(score, self.documents[row]) for row, score in zip(rows, scores)]
+            for rows, scores in self.batch_search_top_k(queries, limit, block_size)
+        ]
 
 def verify_model():
     search = SemanticSearch()
@@ -89,13 +280,12 @@ def embed_text(text):
     print(f"First 3 dimensions: {embedding[:3]}")
     print(f"Dimensions: {embedding.shape[0]}")
 
-def verify_embeddings():
-    search = SemanticSearch()
-    with open(DATA_PATH, 'r') as f:
-        data = json.load(f)
+def verify_embeddings(mmap=False, embedding_dtype=DEFAULT_EMBEDDING_DTYPE):
+    search = SemanticSearch(mmap=mmap, embedding_dtype=embedding_dtype)
+    catalog = load_catalog()
 
-    embeddings = search.load_or_create_embeddings(data['movies'])
-    print(f"Number of docs:   {len(data['movies'])}")
+    embeddings = search.load_or_create_embeddings(catalog)
+    print(f"Number of docs:   {len(catalog)}")
     print(f"Embeddings shape: {embeddings.shape[0]} vectors in {embeddings.shape[1]} dimensions")
 
 def embed_query_text(query):
@@ -105,6 +295,153 @@ def embed_query_text(query):
     print(f"First 5 dimensions: {embedding[:5]}")
     print(f"Shape: {embedding.shape}")
 
+def normalize_embeddings(embeddings) -> np.ndarray:
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    norms = np.linalg.norm(embeddings, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return embeddings / norms
+
+def movie_embedding_text(doc: dict) -> str:
+    return f"{doc['title']}: {doc['description']}"
+
+def document_chunks(doc: dict) -> list[str]:
+    text = doc.get("description", "")
+    if not text.strip():
+        return []
+    return semantic_chunk(text, DEFAULT_SEMANTIC_CHUNK_SIZE, DEFAULT_SEMANTIC_CHUNK_OVERLAP)
+
+def document_chunk_count(doc: dict) -> int:
+    return len(document_chunks(doc))
+
+def iter_chunk_batches(documents: list[dict], pool, first_doc=0, skip=0, batch_size=CHUNK_EMBEDDING_BATCH_SIZE):
+    # Chunks documents window by window so only a bounded number of chunk
+    # strings is alive at once; `skip` drops chunks of `first_doc` that were
+    # already embedded.
+    batch = []
+    for window_start in range(first_doc, len(documents), CHUNK_BUILD_WINDOW):
+        window = documents[window_start:window_start + CHUNK_BUILD_WINDOW]
+        for chunks in pool.map(document_chunks, window, chunksize=CHUNK_POOL_CHUNKSIZE):
+            batch.extend(chunks[skip:])
+            skip = 0
+            while len(batch) >= batch_size:
+                yield batch[:batch_size]
+                batch = batch[batch_size:]
+    if batch:
+        yield batch
+
+def load_chunk_build_checkpoint(expected: dict) -> int:
+    if not os.path.exists(CHUNK_BUILD_CHECKPOINT_PATH) or not os.path.exists(CHUNK_EMBEDDINGS_PARTIAL_PATH):
+        return 0
+    with open(CHUNK_BUILD_CHECKPOINT_PATH, 'r') as f:
+        checkpoint = json.load(f)
+    if any(checkpoint.get(key) != value for key, value in expected.items() if key != "done"):
+        return 0
+    return checkpoint["done"]
+
+def save_chunk_build_checkpoint(checkpoint: dict):
+    tmp_path = f"{CHUNK_BUILD_CHECKPOINT_PATH}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(checkpoint, f)
+    os.replace(tmp_path, CHUNK_BUILD_CHECKPOINT_PATH)
+
+def is_normalized(embeddings: np.ndarray, samples: int = 64) -> bool:
+    if len(embeddings) == 0:
+        return True
+    rows = np.linspace(0, len(embeddings) - 1, num=min(samples, len(embeddings)), dtype=np.intp)
+    norms = np.linalg.norm(np.asarray(embeddings[rows], dtype=np.float32), axis=-1)
+    return bool(np.all((np.abs(norms - 1) < 1e-2) | (norms == 0)))
+
+def save_embeddings(path: str, embeddings, dtype=EMBEDDING_CACHE_DTYPE):
+    embeddings = normalize_embeddings(embeddings).astype(dtype)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        np.save(f, embeddings)
+    os.replace(tmp_path, path)
+
+def converted_embeddings_path(path: str, dtype) -> str:
+    root, ext = os.path.splitext(path)
+    return f"{root}.{np.dtype(dtype).name}{ext}"
+
+def load_embeddings(path: str, mmap=False, dtype=DEFAULT_EMBEDDING_DTYPE, validate=True) -> np.ndarray:
+    embeddings = np.load(path, mmap_mode='r')
+    # Older caches hold raw model output, or were stored in whatever dtype
+    # they were built with; they are migrated once to normalized float32 so
+    # the file can be mapped and scored as is. Caches the manifest vouches
+    # for skip the check.
+    if validate and (embeddings.dtype != EMBEDDING_CACHE_DTYPE or not is_normalized(embeddings)):
+        save_embeddings(path, embeddings)
+        embeddings = np.load(path, mmap_mode='r')
+
+    if np.dtype(dtype) != EMBEDDING_CACHE_DTYPE:
+        embeddings = load_converted_embeddings(path, embeddings, dtype)
+    if not mmap:
+        embeddings = np.array(embeddings)
+    return embeddings
+
+def load_converted_embeddings(path: str, embeddings: np.ndarray, dtype) -> np.ndarray:
+    # Other dtypes get their own file next to the float32 cache, rewritten
+    # whenever that cache changes, so runs with different dtypes never
+    # overwrite (or lose precision in) each other's caches.
+    converted_path = converted_embeddings_path(path, dtype)
+    source_path = f"{converted_path}.source.json"
+    source_stamp = list(file_stamp(path))
+    try:
+        with open(source_path) as f:
+            if json.load(f)["source_stamp"] == source_stamp and os.path.exists(converted_path):
+                return np.load(converted_path, mmap_mode='r')
+    except (FileNotFoundError, json.JSONDecodeError, KeyError):
+        pass
+
+    save_embeddings(converted_path, embeddings, dtype)
+    tmp_path = f"{source_path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump({"source_stamp": source_stamp}, f)
+    os.replace(tmp_path, source_path)
+    return np.load(converted_path, mmap_mode='r')
+
+def chunk_metadata_from_counts(counts) -> np.ndarray:
+    counts = np.asarray(counts, dtype=np.int32)
+    metadata = np.empty(int(counts.sum()), dtype=CHUNK_METADATA_DTYPE)
+    metadata["movie_idx"] = np.repeat(np.arange(len(counts), dtype=np.int32), counts)
+    metadata["total_chunks"] = np.repeat(counts, counts)
+    metadata["chunk_idx"] = np.arange(len(metadata)) - np.repeat(np.cumsum(counts) - counts, counts)
+    return metadata
+
+def chunk_metadata_exists() -> bool:
+    return os.path.exists(CHUNK_METADATA_PATH) or os.path.exists(LEGACY_CHUNK_METADATA_PATH)
+
+def save_chunk_metadata(metadata: np.ndarray):
+    os.makedirs(os.path.dirname(CHUNK_METADATA_PATH), exist_ok=True)
+    tmp_path = f"{CHUNK_METADATA_PATH}.tmp"
+    with open(tmp_path, 'wb') as f:
+        np.save(f, metadata)
+    os.replace(tmp_path, CHUNK_METADATA_PATH)
+
+def load_chunk_metadata(mmap=False) -> np.ndarray:
+    # Metadata written as indented JSON by older versions is converted once.
+    if not os.path.exists(CHUNK_METADATA_PATH):
+        with open(LEGACY_CHUNK_METADATA_PATH, 'r') as f:
+            chunks = json.load(f)['chunks']
+        metadata = np.empty(len(chunks), dtype=CHUNK_METADATA_DTYPE)
+        for field in CHUNK_METADATA_DTYPE.names:
+            metadata[field] = [chunk[field] for chunk in chunks]
+        save_chunk_metadata(metadata)
+        os.remove(LEGACY_CHUNK_METADATA_PATH)
+
+    return np.load(CHUNK_METADATA_PATH, mmap_mode='r' if mmap else None)
+
+def score_embeddings(embeddings: np.ndarray, query_embedding: np.ndarray, block_size=EMBEDDING_SCORE_BLOCK_SIZE) -> np.ndarray:
+    # `query_embedding` may also be a (dim, queries) matrix, giving one
+    # column of scores per query.
+    if embeddings.dtype == np.float32:
+        return embeddings @ query_embedding
+
+    scores = np.empty((len(embeddings),) + query_embedding.shape[1:], dtype=np.float32)
+    for start in range(0, len(embeddings), block_size):
+        scores[start:start + block_size] = embeddings[start:start + block_size].astype(np.float32) @ query_embedding
+    return scores
+
 def cosine_similarity(vec1, vec2):
     dot_product = np.dot(vec1, vec2)
     norm1 = np.linalg.norm(vec1)
@@ -115,15 +452,18 @@ def cosine_similarity(vec1, vec2):
 
     return dot_product / (norm1 * norm2)
 
-def search_command(query, limit=DEFAULT_SEARCH_LIMIT):
-    search = SemanticSearch()
+def search_command(query, limit=DEFAULT_SEARCH_LIMIT, mmap=False, embedding_dtype=DEFAULT_EMBEDDING_DTYPE, server=None, ann=False, nprobe=DEFAULT_ANN_NPROBE, quantized=False, rerank=DEFAULT_PQ_RERANK):
+    if server:
+        results = search_remote(server, "search", query=query, limit=limit)
+    else:
+        search = SemanticSearch(mmap=mmap, embedding_dtype=embedding_dtype, ann=ann, nprobe=nprobe, quantized=quantized, rerank=rerank)
 
-    with open(DATA_PATH, 'r') as f:
-        data = json.load(f)
+        catalog = load_catalog()
 
-    search.load_or_create_embeddings(data['movies'])
+        search.load_or_create_embeddings(catalog)
+
+        results = search.search(query, limit)
 
-    results = search.search(query, limit)
     for i in range(len(results)):
         score = results[i][0]
         doc = results[i][1]
@@ -207,112 +547,268 @@ def semantic_chunk(text: str, chunk_size=DEFAULT_SEMANTIC_CHUNK_SIZE, overlap=DE
     return chunks
 
 class ChunkedSemanticSearch(SemanticSearch):
-    def __init__(self, model_name = "all-MiniLM-L6-v2") -> None:
-        super().__init__(model_name)
+    def __init__(self, model_name = "all-MiniLM-L6-v2", mmap=False, embedding_dtype=DEFAULT_EMBEDDING_DTYPE, cache_queries=True, ann=False, nprobe=DEFAULT_ANN_NPROBE, quantized=False, rerank=DEFAULT_PQ_RERANK, model=None) -> None:
+        super().__init__(model_name, mmap, embedding_dtype, cache_queries, ann, nprobe, quantized, rerank, model)
         self.chunk_embeddings = None
         self.chunk_metadata = None
+        self.chunk_movie_idx = None
     
-    def build_chunk_embeddings(self, documents):
-        self.documents = documents
-        self.document_map = {}
-        for doc in documents:
-            self.document_map[doc['id']] = doc
-        
-        all_chunks = []
-        all_chunks_metadata = []
-
-        for movie_idx, doc in enumerate(documents):
-            text = doc.get("description", "")
-            if not text.strip():
-                continue
-
-            chunks = semantic_chunk(text, DEFAULT_SEMANTIC_CHUNK_SIZE, DEFAULT_SEMANTIC_CHUNK_OVERLAP)
-            for chunk_idx, chunk in enumerate(chunks):
-                all_chunks.append(chunk)
-                all_chunks_metadata.append({ 
-                    "movie_idx": movie_idx, 
-                    "chunk_idx": chunk_idx, 
-                    "total_chunks": len(chunks),
-                })
-        
-        self.chunk_embeddings = self.model.encode(all_chunks, show_progress_bar=True)
-        self.chunk_metadata = all_chunks_metadata
-
-        os.makedirs(os.path.dirname(CHUNK_EMBEDDINGS_PATH), exist_ok=True)
-        np.save(CHUNK_EMBEDDINGS_PATH, self.chunk_embeddings)
+    def build_chunk_embeddings(self, documents, workers=None):
+        catalog = as_catalog(documents)
+        documents = self.documents = catalog.documents
+        self.document_map = catalog.document_map
+
+        state = catalog.state
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            counts = list(pool.map(document_chunk_count, documents, chunksize=CHUNK_POOL_CHUNKSIZE))
+            metadata = chunk_metadata_from_counts(counts)
+            doc_starts = np.concatenate([[0], np.cumsum(counts, dtype=np.int64)])
+            total_chunks = len(metadata)
+
+            # Embeddings are written batch by batch into a preallocated .npy
+            # and the checkpoint records how many rows are safely on disk, so
+            # an interrupted build picks up from there.
+            checkpoint = {
+                "catalog": catalog_fingerprint(state),
+                "model": self.model_name,
+                "dtype": EMBEDDING_CACHE_DTYPE.str,
+                "total_chunks": total_chunks,
+                "done": 0,
+            }
+            done = load_chunk_build_checkpoint(checkpoint)
+            embeddings = None
+            if done:
+                embeddings = np.lib.format.open_memmap(CHUNK_EMBEDDINGS_PARTIAL_PATH, mode='r+')
+                print(f"Resuming chunk embedding build at {done}/{total_chunks} chunks")
+
+            first_doc = int(np.searchsorted(doc_starts, done, side='right')) - 1
+            skip = done - int(doc_starts[first_doc])
+            for batch in iter_chunk_batches(documents, pool, first_doc, skip):
+                vectors = normalize_embeddings(self.model.encode(batch)).astype(EMBEDDING_CACHE_DTYPE)
+                if embeddings is None:
+                    os.makedirs(os.path.dirname(CHUNK_EMBEDDINGS_PARTIAL_PATH), exist_ok=True)
+                    embeddings = np.lib.format.open_memmap(
+                        CHUNK_EMBEDDINGS_PARTIAL_PATH, mode='w+', dtype=EMBEDDING_CACHE_DTYPE, shape=(total_chunks, vectors.shape[1])
+                    )
+                embeddings[done:done + len(batch)] = vectors
+                embeddings.flush()
+                done += len(batch)
+                checkpoint["done"] = done
+                save_chunk_build_checkpoint(checkpoint)
+                print(f"\rEmbedded {done}/{total_chunks} chunks", end="", flush=True)
+
+        if embeddings is None:
+            save_embeddings(CHUNK_EMBEDDINGS_PATH, np.empty((0, 0), dtype=np.float32))
+        else:
+            print()
+            del embeddings
+            os.replace(CHUNK_EMBEDDINGS_PARTIAL_PATH, CHUNK_EMBEDDINGS_PATH)
+
+        save_chunk_metadata(metadata)
+        self.chunk_embeddings = load_embeddings(CHUNK_EMBEDDINGS_PATH, self.mmap, self.embedding_dtype)
+        self.__load_chunk_metadata()
+
+        save_catalog_state(CHUNK_EMBEDDINGS_STATE_PATH, state)
+        if os.path.exists(CHUNK_BUILD_CHECKPOINT_PATH):
+            os.remove(CHUNK_BUILD_CHECKPOINT_PATH)
 
-        with open(CHUNK_METADATA_PATH, "w") as f:
-            json.dump({"chunks": self.chunk_metadata, "total_chunks": len(all_chunks)}, f, indent=2)
-        
         return self.chunk_embeddings
 
-    def load_or_create_chunk_embeddings(self, documents: list[dict]) -> np.ndarray:
-        self.documents = documents
-        self.document_map = {}
-        for doc in documents:
-            self.document_map[doc['id']] = doc
-        
-        if os.path.exists(CHUNK_EMBEDDINGS_PATH) and os.path.exists(CHUNK_METADATA_PATH):
-            self.chunk_embeddings = np.load(CHUNK_EMBEDDINGS_PATH)
-            with open(CHUNK_METADATA_PATH, 'r') as f:
-                self.chunk_metadata = json.load(f)['chunks']
+    def update_chunk_embeddings(self, documents, old_state=None) -> CatalogDiff:
+        catalog = as_catalog(documents)
+        documents = self.documents = catalog.documents
+        self.document_map = catalog.document_map
+        if old_state is None:
+            old_state = load_catalog_state(CHUNK_EMBEDDINGS_STATE_PATH)
+
+        new_state = catalog.state
+        diff = CatalogDiff(old_state, new_state)
+
+        if not diff.unchanged or diff.reordered:
+            old_embeddings = load_embeddings(CHUNK_EMBEDDINGS_PATH, True)
+            old_movie_idx = load_chunk_metadata(mmap=True)["movie_idx"]
+            old_starts = np.searchsorted(old_movie_idx, np.arange(len(old_state)), side='left')
+            old_ends = np.searchsorted(old_movie_idx, np.arange(len(old_state)), side='right')
+
+            # Row of the cached embedding to copy for every new chunk, or -1
+            # for chunks of added or changed movies that must be encoded.
+            sources = []
+            counts = np.empty(len(documents), dtype=np.int32)
+            pending_chunks = []
+            for movie_idx, doc in enumerate(documents):
+                old_idx = diff.reused[movie_idx]
+                if old_idx >= 0:
+                    sources.extend(range(old_starts[old_idx], old_ends[old_idx]))
+                    counts[movie_idx] = old_ends[old_idx] - old_starts[old_idx]
+                    continue
+
+                chunks = document_chunks(doc)
+                sources.extend([-1] * len(chunks))
+                pending_chunks.extend(chunks)
+                counts[movie_idx] = len(chunks)
+
+            sources = np.array(sources, dtype=np.intp)
+            embeddings = np.empty((len(sources), old_embeddings.shape[1]), dtype=np.float32)
+            reused = sources >= 0
+            embeddings[reused] = old_embeddings[sources[reused]]
+            if pending_chunks:
+                embeddings[~reused] = normalize_embeddings(self.model.encode(pending_chunks, show_progress_bar=True))
+
+            save_embeddings(CHUNK_EMBEDDINGS_PATH, embeddings)
+            save_chunk_metadata(chunk_metadata_from_counts(counts))
+            save_catalog_state(CHUNK_EMBEDDINGS_STATE_PATH, new_state)
+
+        self.chunk_embeddings = load_embeddings(CHUNK_EMBEDDINGS_PATH, self.mmap, self.embedding_dtype)
+        self.__load_chunk_metadata()
+        return diff
+
+    def load_or_create_chunk_embeddings(self, documents, workers=None) -> np.ndarray:
+        with span("semantic.load_chunk_embeddings", mmap=self.mmap) as trace:
+            catalog = as_catalog(documents)
+            self.documents = catalog.documents
+            self.document_map = catalog.document_map
+
+            manifest = CacheManifest()
+            paths = [CHUNK_EMBEDDINGS_PATH, CHUNK_METADATA_PATH, CHUNK_EMBEDDINGS_STATE_PATH]
+            if manifest.matches("chunk_embeddings", catalog, self.model_name, paths):
+                trace.set(manifest=True)
+                self.chunk_embeddings = load_embeddings(CHUNK_EMBEDDINGS_PATH, self.mmap, self.embedding_dtype, validate=False)
+                self.__load_chunk_metadata()
+                return self.chunk_embeddings
+
+            self.__load_or_create_chunk_embeddings(catalog, workers)
+            manifest.record("chunk_embeddings", catalog, self.model_name, paths)
             return self.chunk_embeddings
-        
-        return self.build_chunk_embeddings(documents)
+
+    def __load_or_create_chunk_embeddings(self, catalog, workers=None):
+        if os.path.exists(CHUNK_EMBEDDINGS_PATH) and chunk_metadata_exists():
+            old_state = load_catalog_state(CHUNK_EMBEDDINGS_STATE_PATH)
+            if old_state is not None:
+                self.update_chunk_embeddings(catalog, old_state)
+                return
+
+            self.chunk_embeddings = load_embeddings(CHUNK_EMBEDDINGS_PATH, self.mmap, self.embedding_dtype)
+            self.__load_chunk_metadata()
+            save_catalog_state(CHUNK_EMBEDDINGS_STATE_PATH, catalog.state)
+            return
+
+        self.build_chunk_embeddings(catalog, workers)
     
+    def __load_chunk_metadata(self):
+        self.chunk_metadata = load_chunk_metadata(self.mmap)
+        self.chunk_movie_idx = self.chunk_metadata["movie_idx"]
+
     def search_chunks(self, query: str, limit: int = 10):
-        query_embedding = self.generate_embedding(query)
-        chunk_scores = []
-            
-        for chunk_idx, chunk_embedding in enumerate(self.chunk_embeddings):
-            similarity_score = cosine_similarity(chunk_embedding, query_embedding)
-            
-            chunk_scores.append({
-                'chunk_idx': chunk_idx,
-                'movie_idx': self.chunk_metadata[chunk_idx]['movie_idx'],
-                'score': similarity_score,
-            })
-
-        movie_scores = {}
-        for chunk_score in chunk_scores:
-            movie_score = movie_scores.get(chunk_score['movie_idx'])
-            if movie_score is None or chunk_score['score'] > movie_score:
-                movie_scores[chunk_score['movie_idx']] = chunk_score['score']
- 
-        sorted_movie_scores = sorted(movie_scores.items(), key=lambda s: s[1], reverse=True)[:limit]
-
-        results = []
-        for doc_id, score in sorted_movie_scores:
-            document = self.documents[doc_id]
-            if document is not None:
-                results.append({
-                    "id": 1,
-                    "title": document['title'],
-                    "description": document['description'][:100],
-                    "score": score, 
-                })
-        return results
-
-
-def embed_chunks_command():
-    with open(DATA_PATH, 'r') as f:
-        data = json.load(f)
+        with span("semantic.search_chunks", limit=limit):
+            query_embedding = normalize_embeddings(self.generate_embedding(query))
+            rows, chunk_scores = self.score_candidates(query_embedding, self.chunk_embeddings, CHUNK_EMBEDDINGS_PATH, CHUNK_ANN_INDEX_PATH, CHUNK_PQ_PATH, limit)
+            chunk_movie_idx = self.chunk_movie_idx if rows is None else self.chunk_movie_idx[rows]
+
+            movie_scores = np.full(len(self.documents), -np.inf, dtype=chunk_scores.dtype)
+            np.maximum.at(movie_scores, chunk_movie_idx, chunk_scores)
+            limit = min(limit, int(np.count_nonzero(np.isfinite(movie_scores))))
+
+            results = []
+            for movie_idx in top_k_indices(movie_scores, limit):
+                document = self.documents[movie_idx]
+                if document is not None:
+                    results.append({
+                        "id": document['id'],
+                        "title": document['title'],
+                        "description": document['description'][:100],
+                        "score": movie_scores[movie_idx],
+                    })
+            return results
+
+
+def embed_chunks_command(mmap=False, embedding_dtype=DEFAULT_EMBEDDING_DTYPE, workers=None):
+    catalog = load_catalog()
     
-    search = ChunkedSemanticSearch()
+    search = ChunkedSemanticSearch(mmap=mmap, embedding_dtype=embedding_dtype)
 
-    embeddings = search.load_or_create_chunk_embeddings(data['movies'])
+    embeddings = search.load_or_create_chunk_embeddings(catalog, workers)
 
     print(f"Generated {len(embeddings)} chunked embeddings")
 
-def search_chunked_command(query: str, limit: int = 10):
-    search = ChunkedSemanticSearch()
+def search_chunked_command(query: str, limit: int = 10, mmap=False, embedding_dtype=DEFAULT_EMBEDDING_DTYPE, server=None, ann=False, nprobe=DEFAULT_ANN_NPROBE, quantized=False, rerank=DEFAULT_PQ_RERANK):
+    if server:
+        results = search_remote(server, "search_chunked", query=query, limit=limit)
+    else:
+        search = ChunkedSemanticSearch(mmap=mmap, embedding_dtype=embedding_dtype, ann=ann, nprobe=nprobe, quantized=quantized, rerank=rerank)
 
-    with open(DATA_PATH, 'r') as f:
-        data = json.load(f)
+        catalog = load_catalog()
 
-    search.load_or_create_chunk_embeddings(data['movies'])
+        search.load_or_create_chunk_embeddings(catalog)
 
-    results = search.search_chunks(query, limit)
+        results = search.search_chunks(query, limit)
     for i, result in enumerate(results, start=1):
         print(f"\n{i}. {result['title']} (score: {result['score']:.4f})")
         print(f"   {result['description']}...")
+
+def query_cache_command(clear=False):
+    cache = get_query_cache()
+    if clear:
+        cache.clear()
+        print(f"Cleared query embedding cache at {cache.path}")
+        return
+
+    stats = cache.stats()
+    print(f"Query embedding cache: {cache.path}")
+    print(f"Entries on disk: {stats['disk_entries']} (max {cache.disk_size})")
+
+def update_embeddings_command(mmap=False, embedding_dtype=DEFAULT_EMBEDDING_DTYPE):
+    catalog = load_catalog()
+
+    search = ChunkedSemanticSearch(mmap=mmap, embedding_dtype=embedding_dtype)
+    if os.path.exists(search.embeddings_path) and os.path.exists(search.embeddings_state_path):
+        diff = search.update_embeddings(catalog)
+        print(f"Movie embeddings: {diff.summary()}")
+    else:
+        search.build_embeddings(catalog)
+        print(f"Movie embeddings: built {len(search.embeddings)} vectors")
+
+    if os.path.exists(CHUNK_EMBEDDINGS_PATH) and chunk_metadata_exists() and os.path.exists(CHUNK_EMBEDDINGS_STATE_PATH):
+        diff = search.update_chunk_embeddings(catalog)
+        print(f"Chunk embeddings: {diff.summary()}")
+    else:
+        search.build_chunk_embeddings(catalog)
+        print(f"Chunk embeddings: built {len(search.chunk_embeddings)} vectors")
+
+def ann_recall_command(target="chunks", limit=DEFAULT_SEARCH_LIMIT, nprobes=(1, 2, 4, DEFAULT_ANN_NPROBE, 16, 32), n_queries=200, mmap=False, embedding_dtype=DEFAULT_EMBEDDING_DTYPE):
+    catalog = load_catalog()
+
+    search = ChunkedSemanticSearch(mmap=mmap, embedding_dtype=embedding_dtype)
+    if target == "chunks":
+        embeddings = search.load_or_create_chunk_embeddings(catalog)
+        index = search.get_ann_index(CHUNK_ANN_INDEX_PATH, CHUNK_EMBEDDINGS_PATH, embeddings)
+    else:
+        embeddings = search.load_or_create_embeddings(catalog)
+        index = search.get_ann_index(search.ann_index_path, search.embeddings_path, embeddings)
+
+    print(f"IVF index over {len(embeddings)} {target} vectors with {index.n_lists} lists, recall@{limit} over {n_queries} queries")
+    for row in ann_recall_report(embeddings, index, limit, list(nprobes), n_queries):
+        nprobe = "exact" if row['nprobe'] is None else row['nprobe']
+        print(f"  nprobe={nprobe:<6} recall={row['recall']:.3f}  candidates={row['candidates']:.0f}  {row['ms_per_query']:.3f} ms/query")
+
+def pq_recall_command(target="chunks", limit=DEFAULT_SEARCH_LIMIT, rerank_depths=(0, 20, 50, DEFAULT_PQ_RERANK, 200), n_queries=200, subspaces=DEFAULT_PQ_SUBSPACES, embedding_dtype=DEFAULT_EMBEDDING_DTYPE):
+    catalog = load_catalog()
+
+    search = ChunkedSemanticSearch(mmap=True, embedding_dtype=embedding_dtype)
+    if target == "chunks":
+        embeddings = search.load_or_create_chunk_embeddings(catalog)
+        pq_path, embeddings_path = CHUNK_PQ_PATH, CHUNK_EMBEDDINGS_PATH
+    else:
+        embeddings = search.load_or_create_embeddings(catalog)
+        pq_path, embeddings_path = search.pq_path, search.embeddings_path
+
+    if subspaces == DEFAULT_PQ_SUBSPACES:
+        quantizer = search.get_quantizer(pq_path, embeddings_path, embeddings)
+    else:
+        quantizer = ProductQuantizer.train(embeddings, subspaces)
+
+    dense_bytes = embeddings.shape[0] * embeddings.shape[1] * np.dtype(np.float32).itemsize
+    print(f"PQ over {len(embeddings)} {target} vectors with {quantizer.n_subspaces} subspaces, recall@{limit} over {n_queries} queries")
+    print(f"Resident vectors: {quantizer.nbytes / 1e6:.2f} MB quantized vs {dense_bytes / 1e6:.2f} MB float32 ({dense_bytes / quantizer.nbytes:.1f}x)")
+    for row in quantization_report(embeddings, quantizer, limit, list(rerank_depths), n_queries):
+        rerank = "exact" if row['rerank'] is None else row['rerank']
+        print(f"  rerank={rerank:<6} recall={row['recall']:.3f}  {row['ms_per_query']:.3f} ms/query")
@@ -0,0 +1,223 @@
+import json
+import os
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+
+from .catalog import Catalog, load_catalog
+from .inverted_index import InvertedIndex, bm25_idf
+from .tracing import span
+from .search_utils import (
+    file_stamp,
+    get_tokenizer,
+    top_k_indices,
+    BM25_B,
+    BM25_K1,
+    DEFAULT_INDEX_SHARDS,
+    DEFAULT_SEARCH_LIMIT,
+    SHARDED_INDEX_DIR,
+)
+
+SHARD_MANIFEST_VERSION = 1
+
+
+def shard_path(index_dir: str, shard: int) -> str:
+    return os.path.join(index_dir, f"shard_{shard:03d}.bin")
+
+
+def build_shard(path: str, documents: list[dict], store_impacts=False) -> tuple[int, int]:
+    index = InvertedIndex(path)
+    index.build(documents)
+    index.store_impacts = store_impacts
+    index.save()
+    return index.num_docs, int(index.doc_lengths.sum())
+
+
+def finalize_shard(path: str, avg_doc_length: float):
+    # Rewrites the shard's stored block bounds and impacts for the
+    # collection-wide average document length.
+    index = InvertedIndex(path)
+    index.load()
+    index.set_collection_avg_doc_length(avg_doc_length)
+    index.save()
+
+
+class ShardedIndex:
+    # Documents are split into contiguous ranges, one InvertedIndex file per
+    # range. Queries are weighted with collection-wide document frequencies
+    # and every shard normalizes lengths by the collection average, so
+    # scores and the merged top-k match the unsharded index exactly.
+    def __init__(self, index_dir=SHARDED_INDEX_DIR, workers=None) -> None:
+        self.index_dir = index_dir
+        self.manifest_path = os.path.join(index_dir, "manifest.json")
+        self.manifest_stamp = None
+        self.shards: list[InvertedIndex] = []
+        self.doc_offsets = np.zeros(1, dtype=np.int64)
+        self.doc_ids = np.empty(0, dtype=np.int64)
+        self.num_docs = 0
+        self.avg_doc_length = 0.0
+        self.workers = workers
+        self.pool = None
+        with span("tokenizer.load"):
+            self.tokenizer = get_tokenizer()
+
+    @property
+    def n_shards(self) -> int:
+        return len(self.shards)
+
+    def build(self, documents: list[dict] | None = None, n_shards=DEFAULT_INDEX_SHARDS, workers=None, store_impacts=False):
+        documents = load_catalog().documents if documents is None else documents
+        n_shards = max(1, min(n_shards, len(documents)))
+        bounds = np.linspace(0, len(documents), n_shards + 1).astype(int)
+        paths = [shard_path(self.index_dir, i) for i in range(n_shards)]
+        os.makedirs(self.index_dir, exist_ok=True)
+
+        with ProcessPoolExecutor(max_workers=workers or n_shards) as pool:
+            futures = [
+                pool.submit(build_shard, path, documents[start:end], store_impacts)
+                for path, start, end in zip(paths, bounds[:-1], bounds[1:])
+            ]
+            counts = [future.result() for future in futures]
+            num_docs = sum(n for n, _ in counts)
+            avg_doc_length = float(sum(length for _, length in counts)) / num_docs if num_docs else 0.0
+            for future in [pool.submit(finalize_shard, path, avg_doc_length) for path in paths]:
+                future.result()
+
+        manifest = {
+            "version": SHARD_MANIFEST_VERSION,
+            "shards": [os.path.basename(path) for path in paths],
+            "doc_offsets": bounds.tolist(),
+            "num_docs": num_docs,
+            "avg_doc_length": avg_doc_length,
+        }
+        # The manifest is written last, so readers never see a partial build.
+        tmp_path = f"{self.manifest_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, self.manifest_path)
+
+    def load(self):
+        with span("bm25.sharded_load", path=os.path.basename(self.index_dir)):
+            if not os.path.exists(self.manifest_path):
+                raise FileNotFoundError(f"{self.manifest_path} doesn't exist, build the sharded index first!")
+
+            manifest_stamp = file_stamp(self.manifest_path)
+            with open(self.manifest_path) as f:
+                manifest = json.load(f)
+            if manifest.get("version") != SHARD_MANIFEST_VERSION:
+                raise ValueError(f"Unsupported sharded index version in {self.manifest_path}, rebuild the index")
+
+            shards = []
+            for name in manifest["shards"]:
+                shard = InvertedIndex(os.path.join(self.index_dir, name))
+                shard.load()
+                shards.append(shard)
+
+            self.shards = shards
+            self.doc_offsets = np.array(manifest["doc_offsets"], dtype=np.int64)
+            self.doc_ids = np.concatenate([shard.doc_ids for shard in shards]) if shards else np.empty(0, dtype=np.int64)
+            self.num_docs = manifest["num_docs"]
+            self.avg_doc_length = manifest["avg_doc_length"]
+            self.manifest_stamp = manifest_stamp
+            if self.pool is not None:
+                self.pool.shutdown()
+            self.pool = ThreadPoolExecutor(max_workers=self.workers or self.n_shards)
+
+    @property
+    def store_impacts(self) -> bool:
+        return any(shard.store_impacts for shard in self.shards)
+
+    def is_current(self, catalog: Catalog) -> bool:
+        # Whether the loaded shards hold exactly the catalog's documents, in
+        # order and unchanged.
+        hashes = np.concatenate([shard.doc_hashes for shard in self.shards]) if self.shards else np.empty(0, dtype=np.uint64)
+        return np.array_equal(self.doc_ids, catalog.state["id"]) and np.array_equal(hashes, catalog.state["hash"])
+
+    def is_stale(self) -> bool:
+        if self.manifest_stamp is None or self.manifest_stamp != file_stamp(self.manifest_path):
+            return True
+        return any(shard.is_stale() for shard in self.shards)
+
+    def ensure_loaded(self):
+        if self.is_stale():
+            self.load()
+
+    def reloaded(self) -> "ShardedIndex":
+        # Like InvertedIndex.reloaded(). The replaced index keeps its pool
+        # for queries still running on it; its threads exit once it is
+        # garbage collected.
+        if not self.is_stale():
+            return self
+        index = ShardedIndex(self.index_dir, self.workers)
+        index.load()
+        return index
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+
+    def bm25_top_k(self, query, limit, k1=BM25_K1, b=BM25_B, prune=False) -> tuple[np.ndarray, np.ndarray, dict]:
+        # Returns collection-wide document positions (shard offset plus the
+        # position within the shard).
+        with span("bm25.sharded_score", shards=self.n_shards, limit=limit, prune=prune):
+            term_weights = []
+            for term, query_tf in Counter(self.tokenizer.tokenize(query)).items():
+                df = sum(shard.get_document_frequency(term) for shard in self.shards)
+                if df > 0:
+                    term_weights.append((term, bm25_idf(self.num_docs, df) * query_tf))
+
+            futures = [self.pool.submit(shard.bm25_top_k_weighted, term_weights, limit, k1, b, prune) for shard in self.shards]
+            positions, scores, stats = [], [], Counter()
+            for offset, future in zip(self.doc_offsets.tolist(), futures):
+                shard_best, shard_scores, shard_stats = future.result()
+                positions.append(shard_best + offset)
+                scores.append(shard_scores)
+                stats.update(shard_stats)
+
+            # Shards hold ascending position ranges, so sorting by position
+            # first reproduces the unsharded tie-breaking.
+            positions = np.concatenate(positions)
+            scores = np.concatenate(scores)
+            order = np.argsort(positions, kind="stable")
+            best = order[top_k_indices(scores[order], limit)]
+            return positions[best], scores[best], dict(stats)
+
+    def bm25_top_k_batch(self, queries: list[str], limit, k1=BM25_K1, b=BM25_B, prune=False) -> list[tuple[np.ndarray, np.ndarray, dict]]:
+        results = {}
+        for query in queries:
+            if query not in results:
+                results[query] = self.bm25_top_k(query, limit, k1, b, prune)
+        return [results[query] for query in queries]
+
+    def bm25_search(self, query, limit, k1=BM25_K1, b=BM25_B, prune=False):
+        positions, scores, _ = self.bm25_top_k(query, limit, k1, b, prune)
+        return self.__search_results(positions, scores)
+
+    def bm25_search_batch(self, queries: list[str], limit, k1=BM25_K1, b=BM25_B, prune=False) -> list[list[dict]]:
+        return [self.__search_results(positions, scores) for positions, scores, _ in self.bm25_top_k_batch(queries, limit, k1, b, prune)]
+
+    def __search_results(self, positions: np.ndarray, scores: np.ndarray) -> list[dict]:
+        shards = np.searchsorted(self.doc_offsets, positions, side="right") - 1
+        return [
+            self.shards[shard].search_result(position - int(self.doc_offsets[shard]), score)
+            for shard, position, score in zip(shards.tolist(), positions.tolist(), scores.tolist())
+        ]
+
+
+def build_sharded_index_command(n_shards=DEFAULT_INDEX_SHARDS, workers=None, store_impacts=False):
+    index = ShardedIndex()
+    index.build(n_shards=n_shards, workers=workers, store_impacts=store_impacts)
+    index.load()
+    print(f"Built {index.n_shards} shards with {index.num_docs} documents in {index.index_dir}")
+    index.close()
+
+
+def sharded_bm25_search_command(query: str, limit=DEFAULT_SEARCH_LIMIT, prune=False):
+    index = ShardedIndex()
+    index.ensure_loaded()
+    try:
+        return index.bm25_search(query, limit, prune=prune)
+    finally:
+        index.close()
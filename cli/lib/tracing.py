@@ -0,0 +1,240 @@
+import json
+import sys
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from .search_utils import TRACE_HISTOGRAM_BOUNDS_MS
+
+
+class NullSpan:
+    # Returned by span() while tracing is off, so instrumented code pays for
+    # one global lookup and two no-op calls per stage.
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, **attributes):
+        pass
+
+
+NULL_SPAN = NullSpan()
+
+
+class Span:
+    __slots__ = ("tracer", "name", "attributes", "path", "thread", "start", "duration", "error", "token")
+
+    def __init__(self, tracer: "Tracer", name: str, attributes: dict) -> None:
+        self.tracer = tracer
+        self.name = name
+        self.attributes = attributes
+        self.path = name
+        self.thread = threading.current_thread().name
+        self.start = 0.0
+        self.duration = 0.0
+        self.error = None
+        self.token = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def __enter__(self):
+        parent = _current_span.get()
+        if parent is not None:
+            self.path = f"{parent.path}/{self.name}"
+        self.token = _current_span.set(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.duration = time.perf_counter() - self.start
+        if exc_type is not None:
+            self.error = exc_type.__name__
+        _current_span.reset(self.token)
+        self.tracer.record(self)
+        return False
+
+    def to_dict(self) -> dict:
+        record = {
+            "name": self.name,
+            "path": self.path,
+            "thread": self.thread,
+            "start": self.tracer.wall_time(self.start),
+            "duration_ms": self.duration * 1000,
+        }
+        if self.attributes:
+            record["attributes"] = self.attributes
+        if self.error is not None:
+            record["error"] = self.error
+        return record
+
+
+class Tracer:
+    # Spans nest by context: a span opened inside another in the same
+    # thread or asyncio task (or in a thread started with asyncio.to_thread)
+    # gets a "parent/child" path; spans on executor pool threads start a
+    # new root.
+    def __init__(self, sinks) -> None:
+        self.sinks = list(sinks)
+        self.origin = (time.time(), time.perf_counter())
+
+    def wall_time(self, perf_time: float) -> float:
+        return self.origin[0] + perf_time - self.origin[1]
+
+    def span(self, name: str, attributes: dict) -> Span:
+        return Span(self, name, attributes)
+
+    def record(self, span: Span):
+        for sink in self.sinks:
+            sink.record(span)
+
+    def close(self):
+        for sink in self.sinks:
+            sink.close()
+
+
+class JsonlSink:
+    # One JSON object per finished span, appended to `path`.
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.file = open(path, "a")
+        self.lock = threading.Lock()
+
+    def record(self, span: Span):
+        line = json.dumps(span.to_dict(), default=str) + "\n"
+        with self.lock:
+            self.file.write(line)
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+
+class MetricsSink:
+    # In-process counters and latency histograms per span path, e.g. for a
+    # long-running server or a benchmark to read back.
+    def __init__(self, bounds_ms=TRACE_HISTOGRAM_BOUNDS_MS) -> None:
+        self.bounds_ms = list(bounds_ms)
+        self.counts: dict[str, int] = defaultdict(int)
+        self.errors: dict[str, int] = defaultdict(int)
+        self.total_ms: dict[str, float] = defaultdict(float)
+        self.max_ms: dict[str, float] = defaultdict(float)
+        self.histograms: dict[str, list[int]] = {}
+        self.lock = threading.Lock()
+
+    def record(self, span: Span):
+        duration_ms = span.duration * 1000
+        with self.lock:
+            histogram = self.histograms.get(span.path)
+            if histogram is None:
+                histogram = self.histograms[span.path] = [0] * (len(self.bounds_ms) + 1)
+            histogram[bisect_left(self.bounds_ms, duration_ms)] += 1
+            self.counts[span.path] += 1
+            self.total_ms[span.path] += duration_ms
+            self.max_ms[span.path] = max(self.max_ms[span.path], duration_ms)
+            if span.error is not None:
+                self.errors[span.path] += 1
+
+    def percentile(self, path: str, q: float) -> float:
+        # Upper bound of the histogram bucket holding the q-th percentile.
+        with self.lock:
+            histogram = self.histograms.get(path)
+            if histogram is None:
+                return 0.0
+            rank = q / 100 * self.counts[path]
+            seen = 0
+            for i, count in enumerate(histogram):
+                seen += count
+                if count and seen >= rank:
+                    return self.bounds_ms[i] if i < len(self.bounds_ms) else self.max_ms[path]
+            return self.max_ms[path]
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            paths = list(self.counts)
+        return {
+            path: {
+                "count": self.counts[path],
+                "errors": self.errors[path],
+                "total_ms": self.total_ms[path],
+                "max_ms": self.max_ms[path],
+                "p50_ms": self.percentile(path, 50),
+                "p95_ms": self.percentile(path, 95),
+                "histogram": list(zip(self.bounds_ms + [None], self.histograms[path])),
+            }
+            for path in paths
+        }
+
+    def close(self):
+        pass
+
+
+class SummarySink(MetricsSink):
+    # Prints a per-stage breakdown to stderr when tracing stops.
+    def __init__(self, stream=None) -> None:
+        super().__init__()
+        self.stream = stream
+
+    def close(self):
+        stream = self.stream or sys.stderr
+        print(f"{'stage':<48} {'calls':>6} {'total ms':>10} {'mean ms':>9} {'max ms':>9}", file=stream)
+        for path in sorted(self.counts, key=lambda path: path.split("/")):
+            depth = path.count("/")
+            name = "  " * depth + path.rsplit("/", 1)[-1]
+            count = self.counts[path]
+            errors = f"  ({self.errors[path]} failed)" if self.errors[path] else ""
+            print(f"{name:<48} {count:>6} {self.total_ms[path]:>10.2f} {self.total_ms[path] / count:>9.2f} {self.max_ms[path]:>9.2f}{errors}", file=stream)
+
+
+_tracer: Tracer | None = None
+_current_span: ContextVar[Span | None] = ContextVar("current_span", default=None)
+
+
+def span(name: str, **attributes):
+    tracer = _tracer
+    if tracer is None:
+        return NULL_SPAN
+    return tracer.span(name, attributes)
+
+
+def tracing_enabled() -> bool:
+    return _tracer is not None
+
+
+def start_tracing(*sinks) -> Tracer:
+    global _tracer
+    stop_tracing()
+    _tracer = Tracer(sinks)
+    return _tracer
+
+
+def stop_tracing():
+    global _tracer
+    tracer, _tracer = _tracer, None
+    if tracer is not None:
+        tracer.close()
+
+
+@contextmanager
+def profiling(enabled=False, output_path: str | None = None):
+    # What the CLIs' --profile/--profile-output set up: a per-stage summary
+    # on stderr and, given a path, every span appended to it as JSONL.
+    if not enabled and output_path is None:
+        yield
+        return
+
+    sinks = [SummarySink()]
+    if output_path is not None:
+        sinks.append(JsonlSink(output_path))
+    start_tracing(*sinks)
+    try:
+        yield
+    finally:
+        stop_tracing()
@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+
+import argparse
+
+from lib.search_server import serve_command
+from lib.search_utils import (
+    SEARCH_SERVER_HOST,
+    SEARCH_SERVER_PORT,
+    DEFAULT_EMBEDDING_DTYPE,
+    DEFAULT_ANN_NPROBE,
+    DEFAULT_PQ_RERANK,
+    HYBRID_SEARCH_THREADS,
+    EMBEDDING_DTYPES
+)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Search Server CLI")
+    subparsers = parser.add_subparsers(dest="command", help="Available commands")
+
+    serve_parser = subparsers.add_parser("serve", help="Load indexes and embeddings once and serve search requests over HTTP")
+    serve_parser.add_argument("--host", type=str, default=SEARCH_SERVER_HOST, help="Address to bind")
+    serve_parser.add_argument("--port", type=int, default=SEARCH_SERVER_PORT, help="Port to bind")
+    serve_parser.add_argument("--mmap", action="store_true", help="Memory-map cached embeddings instead of reading them into memory")
+    serve_parser.add_argument("--embedding-dtype", type=str, choices=EMBEDDING_DTYPES, default=DEFAULT_EMBEDDING_DTYPE, help="Dtype embeddings are loaded and scored in; float16 uses a half-size copy of the float32 cache")
+    serve_parser.add_argument("--ann", action="store_true", help="Use the approximate nearest-neighbour (IVF) index instead of exhaustive scoring")
+    serve_parser.add_argument("--nprobe", type=int, default=DEFAULT_ANN_NPROBE, help="IVF lists to scan per query, higher is slower but more accurate")
+    serve_parser.add_argument("--pq", action="store_true", help="Score product-quantized codes and re-rank the best candidates against the memory-mapped originals")
+    serve_parser.add_argument("--rerank", type=int, default=DEFAULT_PQ_RERANK, help="Candidates re-ranked exactly when --pq is set")
+    serve_parser.add_argument("--sharded", action="store_true", help="Serve BM25 from the sharded keyword index, building it if missing")
+    serve_parser.add_argument("--threads", type=int, default=HYBRID_SEARCH_THREADS, help="Threads running the BM25 and semantic legs of a query concurrently, 1 runs them one after the other")
+    serve_parser.add_argument("--leg-timeout", type=float, help="Seconds to wait for each leg before fusing the other leg's results alone")
+    serve_parser.add_argument("--verbose", action="store_true", help="Log every request")
+    serve_parser.add_argument("--profile", action="store_true", help="Trace every search stage and serve per-stage counters and latency histograms on GET /metrics")
+
+    args = parser.parse_args()
+
+    match args.command:
+        case "serve":
+            serve_command(args.host, args.port, args.mmap, args.embedding_dtype, args.verbose, args.ann, args.nprobe, args.pq, args.rerank, args.sharded, args.profile, args.threads, args.leg_timeout)
+        case _:
+            parser.print_help()
+
+
+if __name__ == "__main__":
+    main()
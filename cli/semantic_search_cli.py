@@ -11,7 +11,11 @@ from lib.semantic_search import (
     chunk_command,
     semantic_chunk_command,
     embed_chunks_command,
-    search_chunked_command
+    search_chunked_command,
+    query_cache_command,
+    update_embeddings_command,
+    ann_recall_command,
+    pq_recall_command
 )
 
 from lib.search_utils import (
@@ -19,26 +23,45 @@ from lib.search_utils import (
     DEFAULT_CHUNK_SIZE,
     DEFAULT_SEMANTIC_CHUNK_SIZE,
     DEFAULT_SEMANTIC_CHUNK_OVERLAP,
-    DEFAULT_SEARCH_CHUNK_LIMIT
+    DEFAULT_SEARCH_CHUNK_LIMIT,
+    DEFAULT_EMBEDDING_DTYPE,
+    DEFAULT_ANN_NPROBE,
+    DEFAULT_PQ_RERANK,
+    DEFAULT_PQ_SUBSPACES,
+    EMBEDDING_DTYPES
 )
+from lib.tracing import profiling, span
 
 def main():
     parser = argparse.ArgumentParser(description="Semantic Search CLI")
+    parser.add_argument("--profile", action="store_true", help="Trace every search stage and print a per-stage timing summary to stderr")
+    parser.add_argument("--profile-output", type=str, metavar="PATH", help="Also append every traced span to PATH as JSONL (implies --profile)")
     subparsers = parser.add_subparsers(dest="command", help="Available commands")
 
+    embedding_parser = argparse.ArgumentParser(add_help=False)
+    embedding_parser.add_argument("--mmap", action="store_true", help="Memory-map cached embeddings instead of reading them into memory")
+    embedding_parser.add_argument("--embedding-dtype", type=str, choices=EMBEDDING_DTYPES, default=DEFAULT_EMBEDDING_DTYPE, help="Dtype embeddings are loaded and scored in; float16 uses a half-size copy of the float32 cache")
+
+    index_parser = argparse.ArgumentParser(add_help=False)
+    index_parser.add_argument("--ann", action="store_true", help="Use the approximate nearest-neighbour (IVF) index instead of exhaustive scoring")
+    index_parser.add_argument("--nprobe", type=int, default=DEFAULT_ANN_NPROBE, help="IVF lists to scan per query, higher is slower but more accurate")
+    index_parser.add_argument("--pq", action="store_true", help="Score product-quantized codes and re-rank the best candidates against the memory-mapped originals")
+    index_parser.add_argument("--rerank", type=int, default=DEFAULT_PQ_RERANK, help="Candidates re-ranked exactly when --pq is set")
+
     subparsers.add_parser("verify", help="Verifies semantic search model")
 
     embed_text_parser = subparsers.add_parser("embed_text", help="Generate text embedding")
     embed_text_parser.add_argument("text", type=str, help="Text to embed")
 
-    subparsers.add_parser("verify_embeddings", help="Verifies embeddings")
+    subparsers.add_parser("verify_embeddings", help="Verifies embeddings", parents=[embedding_parser])
 
     embedquery_parser = subparsers.add_parser("embedquery", help="Embeds query")
     embedquery_parser.add_argument("query", type=str, help="User query to embed")
 
-    search_parser = subparsers.add_parser("search", help="Does a semantic search")
+    search_parser = subparsers.add_parser("search", help="Does a semantic search", parents=[embedding_parser, index_parser])
     search_parser.add_argument("query", type=str, help="User query")
     search_parser.add_argument("--limit", type=int, default=DEFAULT_SEARCH_LIMIT, help="Search results limit")
+    search_parser.add_argument("--server", type=str, help="Forward the query to a running search server, e.g. http://127.0.0.1:8765")
 
     chunk_parser = subparsers.add_parser("chunk", help="Chunks text")
     chunk_parser.add_argument("text", type=str, help="Text to chunk")
@@ -50,35 +73,64 @@ def main():
     semantic_chunk_parser.add_argument("--max-chunk-size", type=int, default=DEFAULT_SEMANTIC_CHUNK_SIZE, help="Sentences per chunk")
     semantic_chunk_parser.add_argument("--overlap", type=int, default=DEFAULT_SEMANTIC_CHUNK_OVERLAP, help="Overlap between chunks")
 
-    subparsers.add_parser("embed_chunks", help="Embed chunks by sentences")
+    embed_chunks_parser = subparsers.add_parser("embed_chunks", help="Embed chunks by sentences", parents=[embedding_parser])
+    embed_chunks_parser.add_argument("--workers", type=int, help="Processes used to chunk documents (default: one per CPU)")
 
-    search_chunked_parser = subparsers.add_parser("search_chunked", help="Smantic search on chunked data")
+    search_chunked_parser = subparsers.add_parser("search_chunked", help="Smantic search on chunked data", parents=[embedding_parser, index_parser])
     search_chunked_parser.add_argument("query", type=str, help="query to search for")
     search_chunked_parser.add_argument("--limit", type=int, default=DEFAULT_SEARCH_CHUNK_LIMIT, help="results limit")
+    search_chunked_parser.add_argument("--server", type=str, help="Forward the query to a running search server, e.g. http://127.0.0.1:8765")
+
+    subparsers.add_parser("update_embeddings", help="Re-embed only added and changed movies", parents=[embedding_parser])
+
+    ann_recall_parser = subparsers.add_parser("ann_recall", help="Report ANN recall and latency against exhaustive search", parents=[embedding_parser])
+    ann_recall_parser.add_argument("--target", type=str, choices=["chunks", "movies"], default="chunks", help="Embeddings to evaluate")
+    ann_recall_parser.add_argument("--limit", type=int, default=DEFAULT_SEARCH_LIMIT, help="k for recall@k")
+    ann_recall_parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 2, 4, DEFAULT_ANN_NPROBE, 16, 32], help="nprobe values to evaluate")
+    ann_recall_parser.add_argument("--queries", type=int, default=200, help="Number of sampled queries")
+
+    pq_recall_parser = subparsers.add_parser("pq_recall", help="Report product-quantization memory savings and recall against exhaustive search", parents=[embedding_parser])
+    pq_recall_parser.add_argument("--target", type=str, choices=["chunks", "movies"], default="chunks", help="Embeddings to evaluate")
+    pq_recall_parser.add_argument("--limit", type=int, default=DEFAULT_SEARCH_LIMIT, help="k for recall@k")
+    pq_recall_parser.add_argument("--rerank", type=int, nargs="+", default=[0, 20, 50, DEFAULT_PQ_RERANK, 200], help="Re-rank depths to evaluate, 0 ranks by quantized scores only")
+    pq_recall_parser.add_argument("--subspaces", type=int, default=DEFAULT_PQ_SUBSPACES, help="Bytes per vector, must divide the embedding dimension")
+    pq_recall_parser.add_argument("--queries", type=int, default=200, help="Number of sampled queries")
+
+    query_cache_parser = subparsers.add_parser("query_cache", help="Show or clear the query embedding cache")
+    query_cache_parser.add_argument("--clear", action="store_true", help="Remove every cached query embedding")
 
     args = parser.parse_args()
 
-    match args.command:
-        case "verify":
-            verify_model()
-        case "embed_text":
-            embed_text(args.text)
-        case "verify_embeddings":
-            verify_embeddings()
-        case "embedquery":
-            embed_query_text(args.query)
-        case "search":
-            search_command(args.query, args.limit)
-        case "chunk":
-            chunk_command(args.text, args.chunk_size, args.overlap)
-        case "semantic_chunk":
-            semantic_chunk_command(args.text, args.max_chunk_size, args.overlap)
-        case "embed_chunks":
-            embed_chunks_command()
-        case "search_chunked":
-            search_chunked_command(args.query, args.limit)
-        case _:
-            parser.print_help()
+    with profiling(args.profile, args.profile_output), span(args.command or "help"):
+        match args.command:
+            case "verify":
+                verify_model()
+            case "embed_text":
+                embed_text(args.text)
+            case "verify_embeddings":
+                verify_embeddings(args.mmap, args.embedding_dtype)
+            case "embedquery":
+                embed_query_text(args.query)
+            case "search":
+                search_command(args.query, args.limit, args.mmap, args.embedding_dtype, args.server, args.ann, args.nprobe, args.pq, args.rerank)
+            case "chunk":
+                chunk_command(args.text, args.chunk_size, args.overlap)
+            case "semantic_chunk":
+                semantic_chunk_command(args.text, args.max_chunk_size, args.overlap)
+            case "embed_chunks":
+                embed_chunks_command(args.mmap, args.embedding_dtype, args.workers)
+            case "search_chunked":
+                search_chunked_command(args.query, args.limit, args.mmap, args.embedding_dtype, args.server, args.ann, args.nprobe, args.pq, args.rerank)
+            case "update_embeddings":
+                update_embeddings_command(args.mmap, args.embedding_dtype)
+            case "ann_recall":
+                ann_recall_command(args.target, args.limit, args.nprobe, args.queries, args.mmap, args.embedding_dtype)
+            case "pq_recall":
+                pq_recall_command(args.target, args.limit, args.rerank, args.queries, args.subspaces, args.embedding_dtype)
+            case "query_cache":
+                query_cache_command(args.clear)
+            case _:
+                parser.print_help()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,31 @@
+import asyncio
+import re
+
+
+class StubLLMClient:
+    # Offline stand-in for genai.Client exposing the same async
+    # `aio.models.generate_content` call. By default it answers with the
+    # quoted query from the prompt, i.e. "no change"; `respond` maps a
+    # prompt to the reply text and `latency` simulates the round trip.
+    def __init__(self, respond=None, latency=0.0) -> None:
+        self.respond = respond or self.echo_query
+        self.latency = latency
+        self.calls = 0
+        self.aio = self
+        self.models = self
+
+    @staticmethod
+    def echo_query(prompt: str) -> str | None:
+        match = re.search(r'"([^"]*)"', prompt)
+        return None if match is None else match.group(1)
+
+    async def generate_content(self, model: str, contents: str):
+        self.calls += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return StubLLMResponse(self.respond(contents))
+
+
+class StubLLMResponse:
+    def __init__(self, text: str | None) -> None:
+        self.text = text
@@ -0,0 +1,186 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from lib.inverted_index import IMPACT_STEP, InvertedIndex
+from lib.sharded_index import ShardedIndex
+from lib.search_utils import BM25_BLOCK_SIZE
+
+VOCABULARY = (
+    "bear london marmalade detective spaceship robot wizard dragon pirate island "
+    "castle murder winter desert ocean jungle knight princess zombie vampire "
+    "heist casino train racing boxing soldier treasure ghost haunted alien"
+).split()
+
+
+def random_documents(rng: np.random.Generator, n: int) -> list[dict]:
+    # Word counts follow a skewed distribution so some terms are frequent
+    # and others rare; every fifth document repeats an earlier one, which
+    # produces exact score ties.
+    weights = 1 / np.arange(1, len(VOCABULARY) + 1)
+    weights /= weights.sum()
+    texts = []
+    for i in range(n):
+        if i >= 5 and i % 5 == 0:
+            texts.append(texts[int(rng.integers(i))])
+            continue
+        words = rng.choice(VOCABULARY, size=int(rng.integers(3, 30)), p=weights)
+        texts.append(" ".join(words))
+    return [{"id": 1000 + i, "title": f"Movie {i}", "description": text} for i, text in enumerate(texts)]
+
+
+def random_queries(rng: np.random.Generator, n: int) -> list[str]:
+    queries = [" ".join(rng.choice(VOCABULARY, size=int(rng.integers(1, 5)))) for _ in range(n)]
+    # Repeated terms, terms missing from the index and empty matches.
+    return queries + ["bear bear london", "bear unknownword", "unknownword", ""]
+
+
+class BM25TestCase(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp = tempfile.TemporaryDirectory()
+        rng = np.random.default_rng(16)
+        cls.documents = random_documents(rng, 10 * BM25_BLOCK_SIZE + 37)
+        cls.queries = random_queries(rng, 40)
+        cls.index = InvertedIndex(os.path.join(cls.tmp.name, "index.bin"))
+        cls.index.build(cls.documents)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp.cleanup()
+
+    def assertSameTopK(self, expected, actual):
+        expected_positions, expected_scores, _ = expected
+        actual_positions, actual_scores, _ = actual
+        np.testing.assert_array_equal(actual_positions, expected_positions)
+        np.testing.assert_array_equal(actual_scores, expected_scores)
+
+
+class PrunedBM25Test(BM25TestCase):
+    def test_pruned_matches_exhaustive(self):
+        for index in [self.index, self.saved_index()]:
+            for query in self.queries:
+                for limit in [1, 3, 10, 50, 500, len(self.documents) + 10]:
+                    with self.subTest(query=query, limit=limit):
+                        self.assertSameTopK(
+                            index.bm25_top_k(query, limit),
+                            index.bm25_top_k(query, limit, prune=True),
+                        )
+
+    def test_ties_at_cut_off_keep_lowest_positions(self):
+        documents = [{"id": i, "title": "Bear", "description": "bear in london"} for i in range(3 * BM25_BLOCK_SIZE)]
+        documents[2 * BM25_BLOCK_SIZE + 5]["description"] = "bear bear in london"
+        index = InvertedIndex(os.path.join(self.tmp.name, "ties.bin"))
+        index.build(documents)
+        for limit in [1, 4, BM25_BLOCK_SIZE + 1]:
+            with self.subTest(limit=limit):
+                exhaustive = index.bm25_top_k("bear london", limit)
+                self.assertSameTopK(exhaustive, index.bm25_top_k("bear london", limit, prune=True))
+                expected = [2 * BM25_BLOCK_SIZE + 5] + list(range(limit - 1))
+                self.assertEqual(exhaustive[0].tolist(), expected)
+
+    def test_pruning_skips_postings(self):
+        _, _, stats = self.index.bm25_top_k("bear", 5, prune=True)
+        self.assertLess(stats["postings_scored"], stats["postings"])
+
+    def saved_index(self) -> InvertedIndex:
+        self.index.save()
+        index = InvertedIndex(self.index.index_path)
+        index.load()
+        return index
+
+
+class ImpactsBM25Test(BM25TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.impact_index = InvertedIndex(os.path.join(cls.tmp.name, "impacts.bin"))
+        cls.impact_index.build(cls.documents)
+        cls.impact_index.store_impacts = True
+        cls.impact_index.save()
+        cls.loaded_impact_index = InvertedIndex(cls.impact_index.index_path)
+        cls.loaded_impact_index.load()
+
+    def test_pruned_matches_exhaustive_impacts(self):
+        for index in [self.impact_index, self.loaded_impact_index]:
+            self.assertTrue(index.store_impacts)
+            for query in self.queries:
+                for limit in [1, 10, 100]:
+                    with self.subTest(query=query, limit=limit):
+                        self.assertSameTopK(
+                            index.bm25_top_k(query, limit),
+                            index.bm25_top_k(query, limit, prune=True),
+                        )
+
+    def test_impacts_approximate_exact_scores(self):
+        # Each query term contributes at most idf * IMPACT_STEP / 2 of
+        # quantization error.
+        n_docs = len(self.documents)
+        for query in self.queries:
+            with self.subTest(query=query):
+                exact_positions, exact_scores, _ = self.index.bm25_top_k(query, n_docs)
+                positions, scores, _ = self.loaded_impact_index.bm25_top_k(query, n_docs)
+                self.assertEqual(sorted(positions.tolist()), sorted(exact_positions.tolist()))
+                terms = [term for term in self.index.tokenizer.tokenize(query) if self.index.get_postings(term) is not None]
+                max_error = sum(self.index.get_bm25_idf(term) for term in terms) * IMPACT_STEP / 2 + 1e-12
+                exact = dict(zip(exact_positions.tolist(), exact_scores.tolist()))
+                for position, score in zip(positions.tolist(), scores.tolist()):
+                    self.assertLessEqual(abs(score - exact[position]), max_error)
+
+    def test_other_parameters_score_exactly(self):
+        for query in self.queries:
+            for prune in [False, True]:
+                with self.subTest(query=query, prune=prune):
+                    self.assertSameTopK(
+                        self.index.bm25_top_k(query, 10, k1=1.2, b=0.5),
+                        self.loaded_impact_index.bm25_top_k(query, 10, k1=1.2, b=0.5, prune=prune),
+                    )
+
+
+class ShardedBM25Test(BM25TestCase):
+    def test_sharded_matches_single_index(self):
+        for n_shards in [1, 3, 8]:
+            sharded = ShardedIndex(os.path.join(self.tmp.name, f"sharded_{n_shards}"))
+            sharded.build(self.documents, n_shards=n_shards, workers=2)
+            sharded.load()
+            self.addCleanup(sharded.close)
+            for query in self.queries:
+                for limit in [1, 10, 100]:
+                    for prune in [False, True]:
+                        with self.subTest(n_shards=n_shards, query=query, limit=limit, prune=prune):
+                            expected = self.index.bm25_top_k(query, limit)
+                            actual = sharded.bm25_top_k(query, limit, prune=prune)
+                            np.testing.assert_array_equal(actual[0], expected[0])
+                            np.testing.assert_allclose(actual[1], expected[1], rtol=1e-12)
+            self.assertEqual(
+                [result["id"] for result in sharded.bm25_search("bear london", 10)],
+                [result["id"] for result in self.index.bm25_search("bear london", 10)],
+            )
+
+
+class BatchBM25Test(BM25TestCase):
+    def test_batch_matches_single_queries(self):
+        queries = self.queries + self.queries[:5]
+        for limit in [1, 10, 100]:
+            for prune in [False, True]:
+                batch = self.index.bm25_top_k_batch(queries, limit, prune=prune)
+                self.assertEqual(len(batch), len(queries))
+                for query, actual in zip(queries, batch):
+                    with self.subTest(query=query, limit=limit, prune=prune):
+                        self.assertSameTopK(self.index.bm25_top_k(query, limit, prune=prune), actual)
+
+    def test_batch_with_other_parameters(self):
+        batch = self.index.bm25_top_k_batch(self.queries, 10, k1=1.2, b=0.5)
+        for query, actual in zip(self.queries, batch):
+            with self.subTest(query=query):
+                self.assertSameTopK(self.index.bm25_top_k(query, 10, k1=1.2, b=0.5), actual)
+
+    def test_search_batch_matches_search(self):
+        batch = self.index.bm25_search_batch(self.queries, 5)
+        self.assertEqual(batch, [self.index.bm25_search(query, 5) for query in self.queries])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,103 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from lib.hybrid_search import hybrid_score, normalize_scores, pad_keyword_leg, rrf_fusion, rrf_score, weighted_fusion
+from lib.inverted_index import InvertedIndex
+
+from .test_bm25 import random_documents, random_queries
+
+
+def baseline_leg(scores: np.ndarray, depth: int) -> list[tuple[int, float]]:
+    # A leg as the original search returned it: every document scored,
+    # sorted by score with ties in catalog order, cut to `depth`.
+    return sorted(enumerate(scores.tolist()), key=lambda item: item[1], reverse=True)[:depth]
+
+
+def baseline_weighted(keyword, semantic, alpha, limit) -> list[tuple[int, float, float, float]]:
+    keyword_scores = normalize_scores([score for _, score in keyword]).tolist()
+    semantic_scores = normalize_scores([score for _, score in semantic]).tolist()
+    results = {}
+    for (doc, _), score in zip(keyword, keyword_scores):
+        results.setdefault(doc, [0.0, 0.0])[0] = score
+    for (doc, _), score in zip(semantic, semantic_scores):
+        results.setdefault(doc, [0.0, 0.0])[1] = score
+    fused = [(doc, hybrid_score(bm25, sem, alpha), bm25, sem) for doc, (bm25, sem) in results.items()]
+    return sorted(fused, key=lambda result: result[1], reverse=True)[:limit]
+
+
+def baseline_rrf(keyword, semantic, k, limit) -> list[tuple[int, float, int, int]]:
+    results = {}
+    for rank, (doc, _) in enumerate(keyword, start=1):
+        results[doc] = [rrf_score(rank, k), rank, 0]
+    for rank, (doc, _) in enumerate(semantic, start=1):
+        result = results.setdefault(doc, [0.0, 0, 0])
+        result[0] += rrf_score(rank, k)
+        result[2] = rank
+    fused = [(doc, score, bm25_rank, semantic_rank) for doc, (score, bm25_rank, semantic_rank) in results.items()]
+    return sorted(fused, key=lambda result: result[1], reverse=True)[:limit]
+
+
+class FusionTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp = tempfile.TemporaryDirectory()
+        rng = np.random.default_rng(20)
+        cls.documents = random_documents(rng, 400)
+        cls.queries = random_queries(rng, 30)
+        cls.index = InvertedIndex(os.path.join(cls.tmp.name, "index.bin"))
+        cls.index.build(cls.documents)
+        # Cosine-like semantic scores with a few exact ties.
+        cls.semantic_scores = np.round(rng.uniform(-0.2, 0.8, size=(len(cls.queries), len(cls.documents))), 3)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp.cleanup()
+
+    def legs(self, query_i: int, depth: int):
+        # The fused legs, built the way HybridSearch builds them, next to
+        # the original search's padded legs.
+        n_docs = len(self.documents)
+        best, scores, _ = self.index.bm25_top_k(self.queries[query_i], depth)
+        keyword = pad_keyword_leg(best, scores, n_docs, depth)
+        semantic_all = self.semantic_scores[query_i]
+        semantic_positions = np.argsort(-semantic_all, kind="stable")[:depth]
+        semantic = (semantic_positions, semantic_all[semantic_positions])
+
+        all_scores = np.zeros(n_docs)
+        all_scores[best] = scores
+        return keyword, semantic, baseline_leg(all_scores, depth), baseline_leg(semantic_all, depth)
+
+    def test_padded_keyword_leg(self):
+        positions, scores = pad_keyword_leg(np.array([5, 2]), np.array([3.0, 1.0]), 8, 5)
+        self.assertEqual(positions.tolist(), [5, 2, 0, 1, 3])
+        self.assertEqual(scores.tolist(), [3.0, 1.0, 0.0, 0.0, 0.0])
+        positions, _ = pad_keyword_leg(np.array([5, 2]), np.array([3.0, 1.0]), 6, 10)
+        self.assertEqual(positions.tolist(), [5, 2, 0, 1, 3, 4])
+        positions, _ = pad_keyword_leg(np.array([5, 2]), np.array([3.0, 1.0]), 8, 2)
+        self.assertEqual(positions.tolist(), [5, 2])
+
+    def test_weighted_matches_baseline(self):
+        for query_i, query in enumerate(self.queries):
+            for depth in [5, 50, 150, 1000]:
+                keyword, semantic, baseline_keyword, baseline_semantic = self.legs(query_i, depth)
+                for alpha in [0.0, 0.3, 1.0]:
+                    with self.subTest(query=query, depth=depth, alpha=alpha):
+                        best, hybrid, bm25, sem = weighted_fusion(*keyword, *semantic, len(self.documents), alpha, 10)
+                        actual = list(zip(best.tolist(), hybrid.tolist(), bm25.tolist(), sem.tolist()))
+                        self.assertEqual(actual, baseline_weighted(baseline_keyword, baseline_semantic, alpha, 10))
+
+    def test_rrf_matches_baseline(self):
+        for query_i, query in enumerate(self.queries):
+            for depth in [5, 50, 150, 1000]:
+                keyword, semantic, baseline_keyword, baseline_semantic = self.legs(query_i, depth)
+                with self.subTest(query=query, depth=depth):
+                    best, scores, bm25_ranks, semantic_ranks = rrf_fusion(keyword[0], semantic[0], len(self.documents), 60, 10)
+                    actual = list(zip(best.tolist(), scores.tolist(), bm25_ranks.tolist(), semantic_ranks.tolist()))
+                    self.assertEqual(actual, baseline_rrf(baseline_keyword, baseline_semantic, 60, 10))
+
+
+if __name__ == "__main__":
+    unittest.main()
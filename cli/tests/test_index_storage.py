@@ -0,0 +1,98 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from lib.index_storage import (
+    DocStore,
+    decode_postings,
+    decode_varints,
+    encode_documents,
+    encode_postings,
+    encode_varints,
+    read_index,
+    write_index,
+)
+
+
+class VarintTest(unittest.TestCase):
+    def test_round_trip(self):
+        values = np.array([0, 1, 127, 128, 300, 16383, 16384, 2**31 - 1, 2**32, 2**63 + 5], dtype=np.uint64)
+        encoded = encode_varints(values)
+        self.assertEqual(encoded.dtype, np.uint8)
+        np.testing.assert_array_equal(decode_varints(encoded), values)
+        np.testing.assert_array_equal(decode_varints(encoded.tobytes()), values)
+
+    def test_encoding(self):
+        self.assertEqual(encode_varints(np.array([1, 300])).tolist(), [0x01, 0xAC, 0x02])
+
+    def test_empty(self):
+        self.assertEqual(len(encode_varints(np.empty(0, dtype=np.uint64))), 0)
+        self.assertEqual(len(decode_varints(b"")), 0)
+
+
+class PostingsTest(unittest.TestCase):
+    def test_round_trip(self):
+        rng = np.random.default_rng(11)
+        postings = []
+        for df in [1, 2, 50, 1000]:
+            doc_idx = np.sort(rng.choice(200_000, size=df, replace=False)).astype(np.int32)
+            tfs = rng.integers(1, 500, size=df).astype(np.int32)
+            postings.append((doc_idx, tfs))
+
+        data, offsets = encode_postings(postings)
+        self.assertEqual(len(offsets), len(postings) + 1)
+        self.assertEqual(int(offsets[-1]), len(data))
+        for i, (doc_idx, tfs) in enumerate(postings):
+            decoded_doc_idx, decoded_tfs = decode_postings(data[offsets[i]:offsets[i + 1]])
+            np.testing.assert_array_equal(decoded_doc_idx, doc_idx)
+            np.testing.assert_array_equal(decoded_tfs, tfs)
+
+
+class IndexFileTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.path = os.path.join(self.tmp.name, "index.bin")
+
+    def test_sections_and_metadata_round_trip(self):
+        sections = {
+            "bytes": np.arange(13, dtype=np.uint8),
+            "ids": np.array([3, -1, 2**40], dtype=np.int64),
+            "scores": np.array([0.5, 1.25], dtype=np.float32),
+            "empty": np.empty(0, dtype=np.int32),
+        }
+        write_index(self.path, sections, {"num_docs": 3, "name": "test"})
+        loaded, metadata = read_index(self.path)
+        self.assertEqual(metadata, {"num_docs": 3, "name": "test"})
+        self.assertEqual(set(loaded), set(sections))
+        for name, array in sections.items():
+            self.assertEqual(loaded[name].dtype, array.dtype)
+            np.testing.assert_array_equal(loaded[name], array)
+        self.assertFalse(os.path.exists(f"{self.path}.tmp"))
+
+    def test_rejects_other_files(self):
+        with open(self.path, "wb") as f:
+            f.write(b"not an index file at all")
+        with self.assertRaises(ValueError):
+            read_index(self.path)
+
+    def test_doc_store(self):
+        documents = [{"id": 7, "title": "Paddington"}, {"id": 9, "title": "Amélie"}]
+        data, offsets = encode_documents(documents)
+        store = DocStore({7: 0, 9: 1}, offsets, data)
+        self.assertEqual(store[9], documents[1])
+
+        store[11] = {"id": 11, "title": "Heat"}
+        store[7] = {"id": 7, "title": "Paddington 2"}
+        del store[9]
+        self.assertEqual(len(store), 2)
+        self.assertEqual(sorted(store), [7, 11])
+        self.assertEqual(store[7]["title"], "Paddington 2")
+        with self.assertRaises(KeyError):
+            store[9]
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,142 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from lib.catalog import Catalog
+from lib.inverted_index import DELETED_DOC_ID, InvertedIndex
+
+from .test_bm25 import random_documents, random_queries
+
+
+def index_contents(index: InvertedIndex) -> dict:
+    # Everything an index holds, keyed by document id instead of slot so
+    # that indexes with different slot layouts compare equal.
+    slots = np.flatnonzero(index.doc_ids != DELETED_DOC_ID)
+    doc_ids = index.doc_ids[slots].tolist()
+    postings = {}
+    for term in index.lexicon:
+        doc_idx, tfs = index.get_postings(term)
+        postings[term] = dict(zip(index.doc_ids[doc_idx].tolist(), tfs.tolist()))
+    return {
+        "postings": postings,
+        "doc_lengths": dict(zip(doc_ids, index.doc_lengths[slots].tolist())),
+        "doc_hashes": dict(zip(doc_ids, index.doc_hashes[slots].tolist())),
+        "documents": {doc_id: index.docmap[doc_id] for doc_id in doc_ids},
+    }
+
+
+def updated_documents(rng: np.random.Generator, documents: list[dict]) -> list[dict]:
+    # Removes, changes and adds documents, and moves a few around.
+    documents = [dict(doc) for doc in documents]
+    removed = set(rng.choice(len(documents), size=len(documents) // 10, replace=False).tolist())
+    documents = [doc for i, doc in enumerate(documents) if i not in removed]
+    for i in rng.choice(len(documents), size=len(documents) // 10, replace=False).tolist():
+        documents[i]["description"] += " haunted castle sequel"
+    next_id = max(doc["id"] for doc in documents) + 1
+    added = random_documents(rng, len(documents) // 5)
+    for i, doc in enumerate(added):
+        doc["id"] = next_id + i
+    documents += added
+    documents[:3], documents[-3:] = documents[-3:], documents[:3]
+    return documents
+
+
+class InvertedIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        rng = np.random.default_rng(11)
+        self.documents = random_documents(rng, 600)
+        self.new_documents = updated_documents(rng, self.documents)
+        self.queries = random_queries(rng, 20) + ["haunted castle sequel"]
+
+    def index(self, name: str) -> InvertedIndex:
+        return InvertedIndex(os.path.join(self.tmp.name, f"{name}.bin"))
+
+    def loaded(self, index: InvertedIndex) -> InvertedIndex:
+        index.save()
+        loaded = InvertedIndex(index.index_path)
+        loaded.load()
+        return loaded
+
+    def fresh(self, documents: list[dict]) -> InvertedIndex:
+        index = self.index("fresh")
+        index.build(documents)
+        return index
+
+    def assertSameIndex(self, expected: InvertedIndex, actual: InvertedIndex):
+        self.assertEqual(index_contents(actual), index_contents(expected))
+        self.assertEqual(actual.num_docs, expected.num_docs)
+        self.assertAlmostEqual(actual.avg_doc_length, expected.avg_doc_length, places=12)
+        for query in self.queries:
+            with self.subTest(query=query):
+                expected_positions, expected_scores, _ = expected.bm25_top_k(query, expected.num_docs)
+                actual_positions, actual_scores, _ = actual.bm25_top_k(query, actual.num_docs)
+                expected_results = dict(zip(expected.doc_ids[expected_positions].tolist(), expected_scores.tolist()))
+                actual_results = dict(zip(actual.doc_ids[actual_positions].tolist(), actual_scores.tolist()))
+                self.assertEqual(actual_results.keys(), expected_results.keys())
+                for doc_id, score in expected_results.items():
+                    self.assertAlmostEqual(actual_results[doc_id], score, places=9)
+
+    def test_save_load_round_trip(self):
+        index = self.fresh(self.documents)
+        loaded = self.loaded(index)
+        self.assertEqual(list(loaded.lexicon), list(index.lexicon))
+        for term in index.lexicon:
+            for expected, actual in zip(index.get_postings(term), loaded.get_postings(term)):
+                np.testing.assert_array_equal(actual, expected)
+        np.testing.assert_array_equal(loaded.doc_ids, index.doc_ids)
+        np.testing.assert_array_equal(loaded.doc_lengths, index.doc_lengths)
+        np.testing.assert_array_equal(loaded.doc_hashes, index.doc_hashes)
+        for query in self.queries:
+            with self.subTest(query=query):
+                self.assertEqual(loaded.bm25_search(query, 20), index.bm25_search(query, 20))
+                self.assertEqual(loaded.bm25_search(query, 20, prune=True), index.bm25_search(query, 20))
+
+    def test_update_matches_fresh_build(self):
+        index = self.index("updated")
+        index.build(self.documents)
+        diff = index.update(self.new_documents)
+        self.assertFalse(diff.unchanged)
+        self.assertTrue(diff.added and diff.changed and diff.removed)
+
+        fresh = self.fresh(self.new_documents)
+        self.assertSameIndex(fresh, index)
+        self.assertSameIndex(fresh, self.loaded(index))
+
+    def test_update_of_loaded_index(self):
+        built = self.index("updated")
+        built.build(self.documents)
+        index = self.loaded(built)
+        index.update(Catalog(self.new_documents))
+
+        fresh = self.fresh(self.new_documents)
+        self.assertSameIndex(fresh, index)
+        loaded = self.loaded(index)
+        self.assertSameIndex(fresh, loaded)
+        self.assertTrue(loaded.update(self.new_documents).unchanged)
+
+    def test_repeated_updates(self):
+        index = self.index("updated")
+        index.build(self.documents)
+        rng = np.random.default_rng(3)
+        documents = self.documents
+        for _ in range(3):
+            documents = updated_documents(rng, documents)
+            index.update(documents)
+        self.assertSameIndex(self.fresh(documents), index)
+
+    def test_remove_everything(self):
+        index = self.index("updated")
+        index.build(self.documents[:10])
+        diff = index.update([])
+        self.assertEqual(len(diff.removed), 10)
+        self.assertEqual(index.num_docs, 0)
+        self.assertEqual(index.lexicon, {})
+        self.assertEqual(index.bm25_search("bear", 5), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
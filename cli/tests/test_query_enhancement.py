@@ -0,0 +1,109 @@
+import asyncio
+import os
+import tempfile
+import unittest
+
+from lib.query_enhancement import EnhancementCache, QueryEnhancer, RateLimiter
+
+from .fakes import StubLLMClient
+
+
+class FailingLLMClient(StubLLMClient):
+    async def generate_content(self, model: str, contents: str):
+        self.calls += 1
+        raise RuntimeError("API unavailable")
+
+
+class ConcurrencyTrackingLLMClient(StubLLMClient):
+    def __init__(self, latency: float) -> None:
+        super().__init__(latency=latency)
+        self.active = 0
+        self.max_active = 0
+
+    async def generate_content(self, model: str, contents: str):
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        try:
+            return await super().generate_content(model, contents)
+        finally:
+            self.active -= 1
+
+
+class QueryEnhancerTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.cache = EnhancementCache(os.path.join(self.tmp.name, "enhancements.sqlite3"))
+
+    def enhancer(self, client, **kwargs) -> QueryEnhancer:
+        return QueryEnhancer(client, cache=self.cache, rate_limiter=RateLimiter(min_interval=0), **kwargs)
+
+    def test_enhancement_is_cached(self):
+        client = StubLLMClient(respond=lambda prompt: "Paddington London marmalade")
+        self.assertEqual(asyncio.run(self.enhancer(client).enhance("rewrite", "bear in london")), "Paddington London marmalade")
+        self.assertEqual(client.calls, 1)
+
+        client = StubLLMClient(respond=lambda prompt: "something else")
+        self.assertEqual(asyncio.run(self.enhancer(client).enhance("rewrite", " bear in  london")), "Paddington London marmalade")
+        self.assertEqual(client.calls, 0)
+
+    def test_cache_persists_across_instances(self):
+        asyncio.run(self.enhancer(StubLLMClient(respond=lambda prompt: "bear in london")).enhance("spell", "bear in londn"))
+
+        client = StubLLMClient()
+        cache = EnhancementCache(self.cache.path)
+        enhanced = asyncio.run(QueryEnhancer(client, cache=cache).enhance("spell", "bear in londn"))
+        self.assertEqual(enhanced, "bear in london")
+        self.assertEqual(client.calls, 0)
+
+    def test_timeout_falls_back_and_is_not_cached(self):
+        enhancer = self.enhancer(StubLLMClient(respond=lambda prompt: "slow answer", latency=1.0), timeout=0.05)
+        self.assertEqual(asyncio.run(enhancer.enhance("spell", "bear in londn")), "bear in londn")
+        self.assertEqual(enhancer.fallbacks, 1)
+        self.assertIsNone(self.cache.get(enhancer.model, "spell", "bear in londn"))
+
+    def test_error_falls_back_and_is_not_cached(self):
+        client = FailingLLMClient()
+        enhancer = self.enhancer(client)
+        self.assertEqual(asyncio.run(enhancer.enhance("rewrite", "bear in london")), "bear in london")
+        self.assertEqual(client.calls, 1)
+        self.assertEqual(enhancer.fallbacks, 1)
+        self.assertIsNone(self.cache.get(enhancer.model, "rewrite", "bear in london"))
+
+    def test_unknown_method_returns_query(self):
+        client = StubLLMClient()
+        self.assertEqual(asyncio.run(self.enhancer(client).enhance("expand", "bear")), "bear")
+        self.assertEqual(client.calls, 0)
+
+
+class RateLimiterTest(unittest.TestCase):
+    def test_limits_concurrency(self):
+        client = ConcurrencyTrackingLLMClient(latency=0.02)
+        enhancer = QueryEnhancer(client, cache=EnhancementCache(disk_size=0), rate_limiter=RateLimiter(max_concurrency=2, min_interval=0))
+
+        async def enhance_all():
+            return await asyncio.gather(*[enhancer.enhance("spell", f"query {i}") for i in range(8)])
+
+        self.assertEqual(asyncio.run(enhance_all()), [f"query {i}" for i in range(8)])
+        self.assertEqual(client.calls, 8)
+        self.assertEqual(client.max_active, 2)
+
+    def test_spaces_request_starts(self):
+        limiter = RateLimiter(max_concurrency=4, min_interval=0.05)
+
+        async def start_times():
+            loop = asyncio.get_running_loop()
+
+            async def start():
+                async with limiter:
+                    return loop.time()
+
+            return sorted(await asyncio.gather(*[start() for _ in range(4)]))
+
+        times = asyncio.run(start_times())
+        gaps = [later - earlier for earlier, later in zip(times, times[1:])]
+        self.assertTrue(all(gap >= 0.04 for gap in gaps), times)
+
+
+if __name__ == "__main__":
+    unittest.main()